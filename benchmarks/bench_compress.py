@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the compressed texts on the file size and the scan speed.
+
+The same `-n` tasks, every `--log-every`th with a pasted log of a few
+kilobytes as its text, are written to a table with a plain `TextField`
+and to a table with a `CompressedTextField`, each in its own database
+file under `-d`. The report shows the size of the files, the time of the
+writes, of a scan which does not read the text, of a listing of the
+records which does not read the text and of one which reads it.
+
+Usage
+-----
+    python benchmarks/bench_compress.py -n 200000 -d /tmp
+"""
+from argparse import ArgumentParser
+from todo.field import BooleanField, CompressedTextField, FloatField, IntegerField, TextField
+from todo.model import Model
+from todo.storage import SQLiteBackend, Storage
+from todo.utility import Connection
+import os
+import random
+import time
+
+
+class PlainTask(Model):
+    """
+    A task whose text is stored as it is.
+    """
+    id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+    text = TextField(column_type='TEXT NOT NULL', default='')
+    is_completed = BooleanField(column_type='BOOLEAN NOT NULL')
+    priority = IntegerField(column_type='INTEGER NOT NULL', default=3)
+    created_at = FloatField()
+
+
+class CompressedTask(Model):
+    """
+    A task whose long text is stored compressed.
+    """
+    id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+    text = CompressedTextField(column_type='TEXT NOT NULL', default='')
+    is_completed = BooleanField(column_type='BOOLEAN NOT NULL')
+    priority = IntegerField(column_type='INTEGER NOT NULL', default=3)
+    created_at = FloatField()
+
+
+def pasted_log(rng):
+    """
+    A log of 40 to 200 lines with a stack trace, like a pasted one.
+    """
+    lines = []
+    for i in range(rng.randint(40, 200)):
+        lines.append('2024-05-{:02d} 12:{:02d}:{:02d} {} worker-{} request {} took {} ms'.format(
+            rng.randint(1, 28), rng.randint(0, 59), rng.randint(0, 59),
+            rng.choice(['INFO', 'WARN', 'ERROR']), rng.randint(1, 16),
+            rng.randint(1, 10 ** 6), rng.randint(1, 5000)))
+        if i % 25 == 24:
+            lines.append('Traceback (most recent call last):\n'
+                         '  File "/srv/app/handler.py", line 42, in handle\n'
+                         '    return self.process(request)\n'
+                         'ValueError: invalid literal for int() with base 10')
+    return '\n'.join(lines)
+
+
+def rows(number, log_every, seed=1):
+    """
+    The records of the tasks.
+    """
+    rng = random.Random(seed)
+    for i in range(1, number + 1):
+        text = pasted_log(rng) if i % log_every == 0 else 'Task {} to do'.format(i)
+        yield {'id': i, 'text': text, 'is_completed': i % 3 == 0,
+               'priority': rng.randint(1, 5), 'created_at': 1.7e9 + i}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the compressed texts.')
+    parser.add_argument('-n', '--number', type=int, default=200000,
+                        help='The number of tasks.')
+    parser.add_argument('-d', '--directory', type=str, default='/tmp',
+                        help='The directory of the database files.')
+    parser.add_argument('--log-every', type=int, default=10,
+                        help='Every Nth task has a pasted log as its text.')
+    args = parser.parse_args()
+
+    print('{} tasks, every {}th with a pasted log'.format(args.number, args.log_every))
+    print('{:<16} {:>10} {:>10} {:>10} {:>12} {:>12}'.format(
+        'table', 'size MB', 'write s', 'scan ms', 'list ms', 'list text ms'))
+    for model in (PlainTask, CompressedTask):
+        path = os.path.join(args.directory, 'data-{}.db'.format(model.TABLE_NAME.lower()))
+        if os.path.exists(path):
+            os.remove(path)
+        backend = SQLiteBackend(Connection('file:' + path))
+        with Storage.use(backend):
+            model.create_table()
+            _, write = timed(model.bulk_upsert, rows(args.number, args.log_every), 'replace', 5000)
+            # A scan of a column after the text, it reads every row.
+            sql = 'SELECT COUNT(*) FROM {} WHERE created_at > 0'.format(model.TABLE_NAME)
+            _, scan = timed(lambda: backend.connection.execute(sql).fetchall())
+            condition = {'priority': 1}
+            _, listing = timed(lambda: [t.id for t in model.find_all(condition)])
+            _, text = timed(lambda: sum(len(t.text) for t in model.find_all(condition)))
+        backend.close()
+        print('{:<16} {:>10.1f} {:>10.2f} {:>10.1f} {:>12.1f} {:>12.1f}'.format(
+            model.TABLE_NAME, os.path.getsize(path) / 1e6, write, scan * 1000,
+            listing * 1000, text * 1000))
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
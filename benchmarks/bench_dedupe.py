@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the near-duplicate index on a large database.
+
+The database of `-n` open tasks, a few of them copies of another task
+with a changed letter case or punctuation, is written once to the path
+of `-f` and reused by the later runs. The index is built, a batch of new
+tasks is indexed incrementally and the check of a candidate text by the
+index is compared with a pairwise scan of every task.
+
+Usage
+-----
+    python benchmarks/bench_dedupe.py -n 1000000 -f /tmp/data-dedupe.db
+"""
+from argparse import ArgumentParser
+from todo.dedupe import DuplicateIndex, shingles, similarity
+from todo.storage import Storage
+from todo.todo import MODELS, Checkpoint, Todo, TodoSignature
+import os
+import random
+import time
+
+
+def words(number):
+    """
+    Random words of 3 to 9 letters.
+    """
+    return [
+        ''.join(random.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(random.randint(3, 9)))
+        for _ in range(number)]
+
+
+def texts(number, lexicon):
+    """
+    Texts of 4 to 8 words, every 20th a near-duplicate of an earlier text.
+    """
+    result = []
+    for i in range(number):
+        if i % 20 == 19:
+            text = random.choice(result[-1000:])
+            result.append(text.capitalize() + random.choice(['.', '!', ' ', '?']))
+        else:
+            result.append(' '.join(random.sample(lexicon, random.randint(4, 8))))
+    return result
+
+
+def populate(number, lexicon):
+    """
+    Store the tasks in batches.
+    """
+    batch = 100000
+    for start in range(0, number, batch):
+        Todo.bulk_upsert([
+            {'id': start + i + 1, 'text': text}
+            for i, text in enumerate(texts(min(batch, number - start), lexicon))],
+            batch_size=batch)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def pairwise(text, threshold):
+    """
+    The similar tasks by a pairwise scan of every task.
+    """
+    grams = shingles(text)
+    return [
+        t for t in Todo.find_all({'is_completed': False}) or []
+        if similarity(grams, shingles(t.text)) >= threshold]
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the near-duplicate index.')
+    parser.add_argument('-n', '--number', type=int, default=1000000,
+                        help='The number of tasks.')
+    parser.add_argument('-f', '--file-path', type=str, default='/tmp/data-dedupe.db',
+                        help='The database file, it is created if it does not exist.')
+    parser.add_argument('--checks', type=int, default=100,
+                        help='The number of the checked candidate texts.')
+    args = parser.parse_args()
+
+    random.seed(1)
+    lexicon = words(20000)
+    exists = os.path.exists(args.file_path)
+    Storage.initialize('file:' + args.file_path)
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    if not exists:
+        populate(args.number, lexicon)
+    count = Todo.count()
+    print('{} tasks'.format(count))
+    index = DuplicateIndex(Todo, TodoSignature, 'todo_id', Checkpoint)
+
+    indexed, seconds = timed(index.rebuild)
+    print('{:<28} {:>8.3f} s ({} tasks)'.format('build the index', seconds, indexed))
+
+    Todo.bulk_upsert([
+        {'id': count + i + 1, 'text': text} for i, text in enumerate(texts(1000, lexicon))])
+    indexed, seconds = timed(index.refresh)
+    print('{:<28} {:>8.3f} s ({} tasks)'.format('refresh after 1000 adds', seconds, indexed))
+
+    candidates = [t.text + '!' for t in Todo.find_all(
+        {'is_completed': False}, order_by='random()', size=args.checks)]
+    start = time.perf_counter()
+    found = sum(len(index.similar(text)) for text in candidates)
+    seconds = (time.perf_counter() - start) / len(candidates)
+    print('{:<28} {:>8.3f} ms ({} similar tasks)'.format(
+        'check by the index', seconds * 1000, found))
+
+    similar, seconds = timed(pairwise, candidates[0], index.threshold)
+    print('{:<28} {:>8.3f} ms ({} similar tasks)'.format(
+        'check by a pairwise scan', seconds * 1000, len(similar)))
+
+    groups, seconds = timed(index.groups)
+    print('{:<28} {:>8.3f} s ({} groups)'.format('dedupe every task', seconds, len(groups)))
+    Storage.close()
+
+
+if __name__ == '__main__':
+    main()
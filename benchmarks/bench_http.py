@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of `todo http`.
+
+The server runs as a `todo http` process on the database of `-n` tasks,
+which is written once to the path of `-f` and reused by the later runs.
+Every scenario runs for `-d` seconds in `-c` client processes with a
+keep-alive connection each, and the report shows its requests per second
+and the p50/p99 latency:
+
+- ``poll``: a page of open tasks with the ETag of the last answer, 304
+- ``page``: a page of open tasks after a random id, without an ETag
+- ``get``: a random task
+- ``add``: a new task, every add changes the ETag
+
+At the end the whole table is streamed as JSON lines once.
+
+Usage
+-----
+    python benchmarks/bench_http.py -n 1000000 -f /tmp/data-http.db -c 4 -d 5
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from todo.storage import Storage
+from todo.todo import MODELS, Todo
+import http.client
+import json
+import os
+import random
+import subprocess
+import time
+
+SCENARIOS = ('poll', 'page', 'get', 'add')
+
+
+def percentile(values, rate):
+    """
+    Nearest-rank percentile of the values.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(rate * (len(values) - 1))))]
+
+
+def populate(path, number):
+    """
+    Store the tasks in batches, a third of them completed.
+    """
+    Storage.initialize('file:' + path)
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    batch = 100000
+    for start in range(0, number, batch):
+        Todo.bulk_upsert([
+            {'id': i, 'text': 'task {}'.format(i), 'is_completed': i % 3 == 0}
+            for i in range(start + 1, min(start + batch, number) + 1)], batch_size=batch)
+    Storage.close()
+
+
+def run_client(port, scenario, duration, number, seed):
+    """
+    Send the requests of a scenario for `duration` seconds.
+
+    Returns
+    -------
+    latencies : list(float)
+        The seconds of every request.
+    """
+    rng = random.Random(seed)
+    client = http.client.HTTPConnection('127.0.0.1', port)
+    etag = ''
+    latencies = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        headers = {}
+        body = None
+        method = 'GET'
+        if scenario == 'poll':
+            url = '/tasks?status=open&limit=50'
+            headers['If-None-Match'] = etag
+        elif scenario == 'page':
+            url = '/tasks?status=open&limit=50&after={}'.format(rng.randint(0, number))
+        elif scenario == 'get':
+            url = '/tasks/{}'.format(rng.randint(1, number))
+        else:
+            method, url, body = 'POST', '/tasks', json.dumps({'text': 'load test'})
+        start = time.perf_counter()
+        client.request(method, url, body, headers)
+        response = client.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status >= 400:
+            raise RuntimeError('{} {} answered {}'.format(method, url, response.status))
+        etag = response.getheader('ETag') or etag
+    client.close()
+    return latencies
+
+
+def main():
+    parser = ArgumentParser(description='Load test of todo http.')
+    parser.add_argument('-n', '--number', type=int, default=1000000,
+                        help='The number of tasks.')
+    parser.add_argument('-f', '--file-path', type=str, default='/tmp/data-http.db',
+                        help='The database file, it is created if it does not exist.')
+    parser.add_argument('-c', '--clients', type=int, default=4,
+                        help='The number of client processes.')
+    parser.add_argument('-d', '--duration', type=float, default=5.0,
+                        help='Seconds of every scenario.')
+    parser.add_argument('--pool-size', type=int, default=8,
+                        help='The number of open connections of the server.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file_path):
+        populate(args.file_path, args.number)
+    server = subprocess.Popen(
+        ['todo', '-f', args.file_path, 'http', '--bind', '127.0.0.1:0',
+         '--pool-size', str(args.pool_size)], stdout=subprocess.PIPE)
+    try:
+        line = server.stdout.readline().decode()
+        port = int(line.rsplit(':', 1)[1].split('/')[0])
+        print('{} tasks, {} clients'.format(args.number, args.clients))
+        print('{:<8} {:>10} {:>10} {:>10}'.format('scenario', 'req/s', 'p50 ms', 'p99 ms'))
+        with ProcessPoolExecutor(args.clients) as executor:
+            for scenario in SCENARIOS:
+                futures = [
+                    executor.submit(run_client, port, scenario, args.duration, args.number, i)
+                    for i in range(args.clients)]
+                latencies = [x for f in futures for x in f.result()]
+                print('{:<8} {:>10.0f} {:>10.2f} {:>10.2f}'.format(
+                    scenario, len(latencies) / args.duration,
+                    percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+
+        client = http.client.HTTPConnection('127.0.0.1', port)
+        start = time.perf_counter()
+        client.request('GET', '/tasks?format=jsonl')
+        response = client.getresponse()
+        rows = size = 0
+        while True:
+            data = response.read(1 << 16)
+            if not data:
+                break
+            rows += data.count(b'\n')
+            size += len(data)
+        seconds = time.perf_counter() - start
+        print('stream {} tasks as JSON lines: {:.2f} s, {:.0f} tasks/s, {:.1f} MB'.format(
+            rows, seconds, rows / seconds, size / 1e6))
+        client.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
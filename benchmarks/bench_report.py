@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of `todo report` on a large database.
+
+The database of `-n` tasks created over a year, half of them completed,
+is written once to the path of `-f` and reused by the later runs. The
+report of the default list, which has every task, is computed from the
+indexes of the database and from a projection of its rows into arrays.
+
+Usage
+-----
+    python benchmarks/bench_report.py -n 5000000 -f /tmp/data-report.db
+"""
+from argparse import ArgumentParser
+from todo.report import ArraySource, IndexSource, Report, numpy
+from todo.storage import Storage
+from todo.todo import MODELS, Todo
+import os
+import random
+import time
+
+YEAR = 365 * 86400.0
+
+
+def populate(number, now):
+    """
+    Store the tasks in batches.
+    """
+    random.seed(1)
+    batch = 100000
+    for start in range(0, number, batch):
+        rows = []
+        for i in range(start, min(start + batch, number)):
+            created_at = now - random.random() * YEAR
+            done = i % 2 == 0
+            rows.append({
+                'id': i + 1, 'text': 'task {}'.format(i), 'is_completed': done,
+                'created_at': created_at,
+                'update_at': min(created_at + random.expovariate(1 / 86400.0), now)
+                if done else 0.0,
+            })
+        Todo.bulk_upsert(rows, batch_size=batch)
+
+
+def bench(report, source):
+    start = time.perf_counter()
+    report.run(source(Todo, Storage.backend(), report.condition))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the report.')
+    parser.add_argument('-n', '--number', type=int, default=1000000,
+                        help='The number of tasks.')
+    parser.add_argument('-f', '--file-path', type=str, default='/tmp/data-report.db',
+                        help='The database file, it is created if it does not exist.')
+    parser.add_argument('--days', type=int, default=30,
+                        help='The days of the report.')
+    args = parser.parse_args()
+
+    now = time.time()
+    exists = os.path.exists(args.file_path)
+    Storage.initialize('file:' + args.file_path)
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    if not exists:
+        populate(args.number, now)
+    print('{} tasks, NumPy {}'.format(
+        Todo.count(), 'installed' if numpy is not None else 'not installed'))
+    report = Report(Todo, Storage.backend(), days=args.days, now=now, condition={'list_id': 0})
+    print('{:<28} {:>8.3f} s'.format('indexes', bench(report, IndexSource)))
+    print('{:<28} {:>8.3f} s'.format('projection into arrays', bench(report, ArraySource)))
+    Storage.close()
+
+
+if __name__ == '__main__':
+    main()
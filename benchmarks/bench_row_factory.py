@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of building model instances from record tuples.
+
+It compares the former ``cls(**dict(zip(keys, row)))`` conversion with
+the `ROW_FACTORY` which `ModelMetaclass` compiles for every model, both
+on plain tuples and installed as the `row_factory` of a sqlite3 cursor.
+
+Usage
+-----
+    python benchmarks/bench_row_factory.py -n 1000000
+"""
+from argparse import ArgumentParser
+from todo.todo import Todo
+import sqlite3
+import time
+
+
+def convert_with_kwargs(model, rows):
+    keys = model.COLUMN_TO_FILED
+    return [model(**dict(zip(keys, r))) for r in rows]
+
+
+def convert_with_row_factory(model, rows):
+    row_factory = model.ROW_FACTORY
+    return [row_factory(None, r) for r in rows]
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description='Micro-benchmark of the row factory.')
+    parser.add_argument('-n', '--number', type=int, default=1000000,
+                        help='The number of rows.')
+    args = parser.parse_args()
+
+    rows = [(i, 'task {}'.format(i), i % 2, 1530000000.0 + i, 0.0)
+            for i in range(args.number)]
+    print('{} rows'.format(args.number))
+    print('{:<36}{:>8.3f} s'.format(
+        'tuples, kwargs dict', measure(convert_with_kwargs, Todo, rows)))
+    print('{:<36}{:>8.3f} s'.format(
+        'tuples, ROW_FACTORY', measure(convert_with_row_factory, Todo, rows)))
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE Todo ({})'.format(', '.join(Todo.COLUMNS)))
+    conn.executemany('INSERT INTO Todo VALUES (?,?,?,?,?)', rows)
+    sql = 'SELECT {} FROM Todo'.format(', '.join(Todo.COLUMNS))
+
+    def fetch_then_convert():
+        convert_with_kwargs(Todo, conn.execute(sql).fetchall())
+
+    def fetch_with_row_factory():
+        cursor = conn.execute(sql)
+        cursor.row_factory = Todo.ROW_FACTORY
+        cursor.fetchall()
+
+    print('{:<36}{:>8.3f} s'.format(
+        'sqlite3, fetchall then kwargs dict', measure(fetch_then_convert)))
+    print('{:<36}{:>8.3f} s'.format(
+        'sqlite3, cursor.row_factory', measure(fetch_with_row_factory)))
+
+
+if __name__ == '__main__':
+    main()
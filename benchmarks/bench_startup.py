@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the startup of `todo` by its launch methods.
+
+Every method runs ``todo -f <file> stats`` on a small database `-r`
+times, the methods take turns so a drift of the machine spreads over
+all of them, and the report shows the mean, p50 and minimum wall time:
+
+- ``python -c pass``: the interpreter alone, the floor of the others
+- ``import todo.app``: the interpreter and the imports of `todo`, without
+  a command
+- ``python -m todo``: `todo/__main__.py`
+- ``zipapp``: the single-file zipapp of ``python setup.py zipapp``,
+  built into a temporary directory, with its precompiled bytecode
+- ``console script``: the `todo` script of the Python's scripts
+  directory, run by the Python
+- ``todo on PATH``: the `todo` command as the shell finds it, e.g. through
+  a pyenv shim, when it is not the script above
+- ``pkg_resources wrapper``: the wrapper which ``setup.py install`` and
+  ``setup.py develop`` write, it resolves the entry point with
+  `pkg_resources`
+
+After the table, the cumulative import time of every `todo` module, the
+smallest of `-r` runs of ``python -X importtime -c "import todo.app"``,
+shows where the imports spend their time.
+
+Usage
+-----
+    python benchmarks/bench_startup.py -r 20
+"""
+from argparse import ArgumentParser
+import importlib.util
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The script of `easy_install`, as `setup.py develop` writes it.
+PKG_RESOURCES_WRAPPER = '''
+__requires__ = 'todocli'
+import re
+import sys
+from pkg_resources import load_entry_point
+sys.argv[0] = 'todo'
+sys.exit(load_entry_point('todocli', 'console_scripts', 'todo')())
+'''
+
+
+def methods(directory):
+    """
+    The command of every launch method which exists here.
+    """
+    result = [('python -c pass', [sys.executable, '-c', 'pass'])]
+    result.append(('import todo.app', [sys.executable, '-c', 'import todo.app']))
+    result.append(('python -m todo', [sys.executable, '-m', 'todo']))
+    zipapp = os.path.join(directory, 'todo.pyz')
+    subprocess.run([sys.executable, 'setup.py', '-q', 'zipapp', '-o', zipapp],
+                   cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    result.append(('zipapp', [sys.executable, zipapp]))
+    script = os.path.join(sysconfig.get_path('scripts'), 'todo')
+    if os.path.exists(script):
+        result.append(('console script', [sys.executable, script]))
+    command = shutil.which('todo')
+    if command and os.path.realpath(command) != os.path.realpath(script):
+        result.append(('todo on PATH', [command]))
+    if importlib.util.find_spec('pkg_resources'):
+        result.append(('pkg_resources wrapper', [sys.executable, '-c', PKG_RESOURCES_WRAPPER]))
+    return result
+
+
+def import_times(runs):
+    """
+    The smallest self and cumulative import time in milliseconds of every
+    `todo` module over the runs of ``-X importtime``, in import order.
+    """
+    times = {}
+    for _ in range(runs):
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import todo.app'],
+                           check=True, stderr=subprocess.PIPE, universal_newlines=True)
+        for line in p.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line[len('import time:'):].split('|')
+            name = fields[-1].strip()
+            if not name.startswith('todo') or not fields[0].strip().isdigit():
+                continue
+            own, cumulative = int(fields[0]) / 1000, int(fields[1]) / 1000
+            best = times.get(name, (own, cumulative))
+            times[name] = (min(best[0], own), min(best[1], cumulative))
+    return times
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the startup of todo.')
+    parser.add_argument('-r', '--runs', type=int, default=20,
+                        help='The number of runs of every method.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'data.db')
+        subprocess.run([sys.executable, '-m', 'todo', '-f', path, 'add', 'Say Hello.'],
+                       check=True, stdout=subprocess.DEVNULL)
+        launches = methods(directory)
+        times = {name: [] for name, _ in launches}
+        for _ in range(args.runs):
+            for name, command in launches:
+                if not name.startswith(('python -c pass', 'import ')):
+                    command = command + ['-f', path, 'stats']
+                start = time.perf_counter()
+                subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+                times[name].append(time.perf_counter() - start)
+
+    print('{:<24} {:>10} {:>10} {:>10}'.format('method', 'mean ms', 'p50 ms', 'min ms'))
+    for name, _ in launches:
+        print('{:<24} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            name, statistics.mean(times[name]) * 1000,
+            statistics.median(times[name]) * 1000, min(times[name]) * 1000))
+
+    print()
+    print('{:<24} {:>10} {:>10}'.format('module', 'self ms', 'cumul. ms'))
+    for name, (own, cumulative) in import_times(args.runs).items():
+        print('{:<24} {:>10.1f} {:>10.1f}'.format(name, own, cumulative))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the add throughput of the storage backends.
+
+Every backend stores `-n` tasks through ``Todo.save()`` one by one, the
+way `todo add` does, into a fresh file of the temporary directory.
+
+Usage
+-----
+    python benchmarks/bench_storage.py -n 5000
+"""
+from argparse import ArgumentParser
+from todo.storage import Storage
+from todo.todo import Todo
+import os
+import tempfile
+import time
+
+
+def bench_add(path, number, transaction=False):
+    """
+    Store tasks in the backend of the path.
+
+    Parameters
+    ----------
+    path : str
+        The path given to ``Storage.initialize()``.
+    number : int
+        The number of tasks.
+    transaction : bool
+        Whether to store all the tasks in a single transaction.
+
+    Returns
+    -------
+    rate : float
+        The number of tasks stored per second.
+    """
+    Storage.initialize(path)
+    Todo.create_table()
+    start = time.perf_counter()
+    if transaction:
+        with Todo.transaction():
+            for i in range(number):
+                Todo(id=i, text='task {}'.format(i)).save()
+    else:
+        for i in range(number):
+            Todo(id=i, text='task {}'.format(i)).save()
+    Storage.close()
+    return number / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the add throughput.')
+    parser.add_argument('-n', '--number', type=int, default=2000,
+                        help='The number of tasks to add.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    cases = [
+        ('sqlite', 'file:' + os.path.join(directory, 'data.db'), False),
+        ('sqlite (one transaction)',
+         'file:' + os.path.join(directory, 'data-tx.db'), True),
+        ('log', 'log:' + os.path.join(directory, 'data.log'), False),
+        ('memory', 'memory:', False),
+    ]
+    for name, path, transaction in cases:
+        rate = bench_add(path, args.number, transaction)
+        print('{:<26} {:>12.0f} adds/s'.format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
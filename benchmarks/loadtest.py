@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrency stress harness of the todo database.
+
+Several workers run a mixed `add/complete/update/show` workload against
+the same database, either through the real `todo` command (``--cli``)
+or through the `Model` API in worker processes. The report shows the
+throughput, the p50/p99 latency of every operation and the rate of
+`database is locked` errors.
+
+`add` allocates ids the way `todo add` does, with
+``CmdLineParser.generate_next_id()``, so concurrent adds race for the
+same id. After the run every stored id is checked for duplicates and the
+adds which lost the race are reported as id collisions.
+
+Usage
+-----
+    python benchmarks/loadtest.py -f file:/tmp/load.db -w 8 -d 10
+    python benchmarks/loadtest.py -f file:/tmp/load.db -w 8 --cli --pool thread
+"""
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from todo.cmd_manager import CmdLineParser
+from todo.storage import Storage
+from todo.todo import Todo
+import os
+import random
+import sqlite3
+import subprocess
+import time
+
+OPERATIONS = ('add', 'complete', 'update', 'show')
+
+
+def classify_error(message):
+    """
+    Classify the message of a failed operation.
+
+    Returns
+    -------
+    kind : str
+        'locked', 'duplicate' or 'other'.
+    """
+    if 'database is locked' in message:
+        return 'locked'
+    if 'UNIQUE constraint failed' in message:
+        return 'duplicate'
+    return 'other'
+
+
+def percentile(values, rate):
+    """
+    Nearest-rank percentile of the values.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(rate * (len(values) - 1))))]
+
+
+def run_model_operation(parser, operation, rng):
+    """
+    Run an operation through the `Model` API.
+    """
+    if operation == 'add':
+        Todo(text='load test', id=parser.generate_next_id()).save()
+    elif operation == 'complete':
+        Todo(id=rng.randint(1, 100), is_completed=True, update_at=time.time()).update()
+    elif operation == 'update':
+        Todo(id=rng.randint(1, 100), text='updated', update_at=time.time()).update()
+    else:
+        Todo.find_all({'is_completed': False}, size=100)
+
+
+def run_cli_operation(path, operation, rng):
+    """
+    Run an operation through the `todo` command.
+    """
+    args = ['todo', '-f', path]
+    if operation == 'add':
+        args += ['add', 'load test']
+    elif operation == 'complete':
+        args += ['complete', str(rng.randint(1, 100))]
+    elif operation == 'update':
+        args += ['update', '-i', str(rng.randint(1, 100)), '-t', 'updated']
+    else:
+        args += ['show', '-i']
+    p = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    message = str(p.stderr, encoding='utf-8')
+    if p.returncode != 0 and 'not exist' not in message:
+        raise RuntimeError(message)
+
+
+def worker(path, cli, mix, duration, seed):
+    """
+    Run random operations until the duration has passed.
+
+    Returns
+    -------
+    samples : list(tuple)
+        The operation, the latency in seconds and the error kind or None.
+    """
+    rng = random.Random(seed)
+    operations, weights = zip(*mix.items())
+    parser = None
+    if not cli:
+        Storage.initialize(path)
+        Todo.create_table()
+        parser = CmdLineParser([])
+    samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        start = time.perf_counter()
+        error = None
+        try:
+            if cli:
+                run_cli_operation(path, operation, rng)
+            else:
+                run_model_operation(parser, operation, rng)
+        except (sqlite3.Error, RuntimeError) as e:
+            error = classify_error(str(e))
+        samples.append((operation, time.perf_counter() - start, error))
+    if not cli:
+        Storage.close()
+    return samples
+
+
+def check_duplicate_ids(path):
+    """
+    Count the stored tasks and the ids which are stored more than once.
+    """
+    Storage.initialize(path)
+    Todo.create_table()
+    ids = Counter(str(t.id) for t in Todo.find_all() or [])
+    Storage.close()
+    return sum(ids.values()), sum(1 for c in ids.values() if c > 1)
+
+
+def report(samples, elapsed, workers, path):
+    """
+    Print the throughput, latency and error rates of the samples.
+    """
+    by_operation = defaultdict(list)
+    for sample in samples:
+        by_operation[sample[0]].append(sample)
+    print('{:<10}{:>8}{:>8}{:>10}{:>10}{:>8}{:>11}{:>7}'.format(
+        'operation', 'count', 'ok', 'p50 ms', 'p99 ms', 'locked', 'duplicate', 'other'))
+    for operation in OPERATIONS:
+        rows = by_operation.get(operation, [])
+        errors = Counter(e for _, _, e in rows)
+        latency = [l for _, l, _ in rows]
+        print('{:<10}{:>8}{:>8}{:>10.2f}{:>10.2f}{:>8}{:>11}{:>7}'.format(
+            operation, len(rows), errors[None],
+            percentile(latency, 0.5) * 1000, percentile(latency, 0.99) * 1000,
+            errors['locked'], errors['duplicate'], errors['other']))
+    errors = Counter(e for _, _, e in samples)
+    total = len(samples)
+    print('')
+    print('workers: {}  elapsed: {:.1f}s  throughput: {:.1f} ops/s'.format(
+        workers, elapsed, errors[None] / elapsed))
+    print('database is locked: {:.2%} of {} operations'.format(
+        errors['locked'] / total if total else 0.0, total))
+    adds = sum(1 for o, _, e in samples if o == 'add' and e is None)
+    stored, duplicates = check_duplicate_ids(path)
+    print('adds: {} succeeded, {} lost the id race'.format(adds, errors['duplicate']))
+    print('stored tasks: {}, duplicate ids: {}'.format(stored, duplicates))
+
+
+def parse_mix(text):
+    """
+    Parse the workload mix, e.g. 'add=4,complete=2,update=2,show=2'.
+    """
+    mix = dict()
+    for item in text.split(','):
+        operation, weight = item.split('=')
+        if operation not in OPERATIONS:
+            raise ValueError('Unknown operation: {}'.format(operation))
+        mix[operation] = int(weight)
+    return mix
+
+
+def main():
+    parser = ArgumentParser(description='Concurrency stress harness of todo.')
+    parser.add_argument('-f', '--file-path', type=str, default='file:/tmp/data-load.db',
+                        help='The database the workers share.')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='The number of concurrent workers.')
+    parser.add_argument('-d', '--duration', type=float, default=5.0,
+                        help='Seconds every worker runs.')
+    parser.add_argument('-m', '--mix', type=parse_mix,
+                        default='add=4,complete=2,update=2,show=2',
+                        help='Weights of the operations.')
+    parser.add_argument('--cli', action='store_true',
+                        help='Run the `todo` command instead of the Model API.')
+    parser.add_argument('--pool', choices=('process', 'thread'), default='process',
+                        help='Run the workers in processes or threads.')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the existing tasks of the database.')
+    args = parser.parse_args()
+    if args.pool == 'thread' and not args.cli:
+        parser.error('--pool thread needs --cli, the Model API shares one storage '
+                     'backend per process')
+
+    if not args.keep:
+        Storage.initialize(args.file_path)
+        Todo.create_table()
+        Todo.drop_table()
+        Storage.close()
+
+    executor = ProcessPoolExecutor if args.pool == 'process' else ThreadPoolExecutor
+    start = time.perf_counter()
+    with executor(args.workers) as pool:
+        futures = [
+            pool.submit(worker, args.file_path, args.cli, args.mix, args.duration,
+                        os.getpid() + i)
+            for i in range(args.workers)
+        ]
+        samples = [s for f in futures for s in f.result()]
+    report(samples, time.perf_counter() - start, args.workers, args.file_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,48 @@
-from setuptools import setup
+from setuptools import Command, setup
+import compileall
+import os
+import py_compile
+import shutil
+import tempfile
+import zipapp
+
+
+class ZipappCommand(Command):
+	"""
+	Build a single-file zipapp of todo, `python todo.pyz` runs it.
+
+	The modules are stored uncompressed with their bytecode next to them,
+	where `zipimport` reads it, so the zipapp neither compiles nor inflates
+	a module when it starts. The bytecode is of the Python which builds it.
+	"""
+	description = 'build a single-file zipapp of todo'
+	user_options = [
+		('output=', 'o', 'The path of the zipapp, dist/todo.pyz by default.'),
+	]
+
+	def initialize_options(self):
+		self.output = None
+
+	def finalize_options(self):
+		if self.output is None:
+			self.output = os.path.join('dist', 'todo.pyz')
+
+	def run(self):
+		with tempfile.TemporaryDirectory() as staging:
+			shutil.copytree(
+				'todo', os.path.join(staging, 'todo'),
+				ignore=shutil.ignore_patterns('tests', '__pycache__', '*.pyc'))
+			# The hash of the source is not checked, the bytecode is valid
+			# whatever the time stamps in the archive are.
+			compileall.compile_dir(
+				staging, quiet=1, legacy=True,
+				invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+			os.makedirs(os.path.dirname(self.output) or '.', exist_ok=True)
+			zipapp.create_archive(
+				staging, self.output, interpreter='/usr/bin/env python3',
+				main='todo.app:main')
+		print('Built {}.'.format(self.output))
+
 
 setup(
 	name='todocli',
@@ -10,14 +54,26 @@ setup(
 		'todo.field',
 		'todo.app',
 		'todo.cmd_manager',
+		'todo.storage',
+		'todo.migration',
+		'todo.sync',
+		'todo.remind',
+		'todo.completion',
+		'todo.trace',
+		'todo.memprofile',
+		'todo.report',
+		'todo.dedupe',
+		'todo.server',
+		'todo.__main__',
 	],
 	entry_points={
 		'console_scripts': [
 			'todo = todo.app:main'
 		]
 	},
+	cmdclass={'zipapp': ZipappCommand},
 	test_suite='tests',
-	python_requires='>=3',
+	python_requires='>=3.9',
 	author='k-fang',
 	author_email='k-fang@com',
 	description='A command line todo list manager',
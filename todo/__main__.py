@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+# `python -m todo` runs the command without the wrapper of the console
+# script, which may import `pkg_resources` before `main()`.
+from .app import main
+
+if __name__ == '__main__':
+    main()
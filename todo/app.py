@@ -1,32 +1,121 @@
 # -*- coding: utf-8 -*-
+# The tracer is imported first, it measures the imports of the others.
+from .trace import IMPORTED_AT, TRACER
 from .cmd_manager import CmdLineParser
-from .utility import RecordIsNotFoundError
-from .todo import Todo
-from .utility import SQLConnection
+from .completion import remove_caches
+from .utility import DuplicateRecordError, RecordIsNotFoundError
+from .todo import MODELS, Todo
+from .memprofile import PROFILER
+from .storage import Storage
+import os
+import sqlite3
 import sys
+import time
+
+
+def open_read_only(path, immutable=False):
+    """
+    Open the database read-only for a subcommand which only reads it.
+
+    The read-only connection neither creates tables nor commits, so the
+    read never takes the write lock nor waits for a writer.
+
+    Returns
+    -------
+    opened : bool
+        False if the database is missing or has to be migrated first, the
+        storage is then reset to the default one.
+    """
+    Storage.initialize(path, read_only=True, immutable=immutable)
+    try:
+        if Storage.backend().is_migrated(MODELS, Todo.SCHEMA_VERSION):
+            return True
+    except sqlite3.OperationalError:
+        # The file does not exist yet.
+        pass
+    Storage.initialize(None)
+    return False
+
+
+def remove_completion_caches(path):
+    """
+    Remove the completion caches after a subcommand which writes.
+
+    Rewriting the cache would read every open task of the list on every
+    write, the next completion rewrites it with `todo completion ids`.
+    """
+    try:
+        remove_caches(path)
+    except OSError:
+        pass
+
+
+def report_trace():
+    """
+    Write the Chrome trace JSON file, to `TODO_TRACE_FILE` if it is set,
+    and print the summary of the spans.
+    """
+    path = TRACER.write(os.environ.get('TODO_TRACE_FILE'))
+    print(TRACER.summary(), file=sys.stderr)
+    print('Trace is written to {}.'.format(path), file=sys.stderr)
 
 
 def main():
     """
     Main function execute todo cli.
+
+    `TODO_TRACE=1` or `--trace` records the spans of the phases of the
+    call, see `Tracer`.
     """
+    if os.environ.get('TODO_TRACE') == '1' or '--trace' in sys.argv[1:]:
+        TRACER.enable()
+        TRACER.add('import', IMPORTED_AT, time.perf_counter())
     try:
         if len(sys.argv) == 1:
             CmdLineParser(['-h'])
         else:
-            parser = CmdLineParser(sys.argv[1:])
+            with TRACER.span('parse_args'):
+                parser = CmdLineParser(sys.argv[1:])
+            if vars(parser.args)['memprofile']:
+                PROFILER.enable()
             path = vars(parser.args)['file_path']
-            if path:
-                SQLConnection.initialize(path)
-            Todo.create_table()
-            parser.args.execute_cmd()
+            immutable = vars(parser.args)['immutable']
+            with TRACER.span('open'):
+                read_only = parser.read_only() and open_read_only(path, immutable)
+            if not read_only:
+                if immutable and parser.read_only():
+                    raise ValueError(
+                        'The database file is missing or has to be migrated with '
+                        '`todo migrate` before it is read with --immutable.')
+                if immutable:
+                    raise ValueError('An immutable database file can only be read.')
+                if path:
+                    Storage.initialize(path)
+                if parser.args.execute_cmd != parser._migrate_action:
+                    # The commands create the tables and add the new columns,
+                    # only `todo migrate` rebuilds a table.
+                    with TRACER.span('migrate'):
+                        Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION, rebuild=False)
+            with TRACER.span('command', action=parser.args.execute_cmd.__name__):
+                parser.args.execute_cmd()
+            if not parser.read_only():
+                with TRACER.span('completion_cache'):
+                    remove_completion_caches(path)
 
-    except RecordIsNotFoundError as e:
+    except (RecordIsNotFoundError, DuplicateRecordError) as e:
         # As usually Unix programs does, `todo` cmd use exit code 2 for
         # command line syntax errors and 1 for all other kinds of errors.
         print(str(e), file=sys.stderr)
         sys.exit(1)
 
-    except Exception:
+    except Exception as e:
         print('Failed to execute todo command...', file=sys.stderr)
+        print('{}: {}'.format(type(e).__name__, e), file=sys.stderr)
         sys.exit(1)
+
+    finally:
+        Storage.close()
+        if TRACER.enabled:
+            report_trace()
+        if PROFILER.enabled:
+            print(PROFILER.report(), file=sys.stderr)
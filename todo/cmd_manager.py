@@ -1,12 +1,57 @@
 # -*- coding: utf-8 -*-
 from argparse import ArgumentParser
-from .todo import Todo
-from .utility import RecordIsNotFoundError, convert_time_to_message
+from .completion import script, write_cache, cache_lines
+from .storage import Compare, Storage, SQLiteBackend
+from .memprofile import PROFILER
+from .migration import Migration
+from .trace import TRACER
+from .todo import MODELS, Checkpoint, Tag, Todo, TodoList, TodoSignature
+from .utility import (
+    Connection, DuplicateRecordError, SQLConnection, RecordIsNotFoundError, convert_time_to_message,
+    format_time, parse_list_name, parse_time, positive_int)
 from datetime import datetime
+from uuid import uuid4
+import json
+import sys
 import time
 
 
+# The modules of the subcommands which most calls do not run, `dedupe`,
+# `remind`, `report`, `server` and `sync`, are imported by their actions,
+# and by the argument types below, so they do not slow down the startup.
+def open_sink(spec):
+    """
+    The sink of `remind --sink`, see `todo.remind.open_sink`.
+    """
+    from .remind import open_sink
+    return open_sink(spec)
+
+
+def parse_bind(text):
+    """
+    The address of `http --bind`, see `todo.server.parse_bind`.
+    """
+    from .server import parse_bind
+    return parse_bind(text)
+
+
 class CmdLineParser(object):
+    # The orders of `show --sort`, each is served by an index of `Todo`
+    # after the `list_id` and `is_completed` columns.
+    SORT_ORDERS = {
+        'due': 'due_at, priority',
+        'priority': 'priority',
+        'created': 'created_at',
+    }
+    # The subcommands which only read, they open the database read-only.
+    READ_ONLY_ACTIONS = (
+        '_show_action', '_next_action', '_remind_action', '_stats_action',
+        '_watch_action', '_completion_action', '_report_action', '_lists_action',
+    )
+    # The subcommands which take a task id, they complete the open task ids.
+    ID_SUBCOMMANDS = ('delete', 'complete', 'update')
+    # The name of the list of the tasks without `--list`, its id is 0.
+    DEFAULT_LIST = TodoList.DEFAULT_NAME
 
     def __init__(self, argv):
         """
@@ -17,7 +62,8 @@ class CmdLineParser(object):
         argv : list
             A list of arguments from sys.argv.
         """
-        self.parser = ArgumentParser(description='Todo list manager')
+        # `python -m todo` and the zipapp would show their file name.
+        self.parser = ArgumentParser(prog='todo', description='Todo list manager')
         self.subparsers = self.parser.add_subparsers(
             help='sub-command of Todo List manager help')
         self.option_command()
@@ -25,12 +71,25 @@ class CmdLineParser(object):
         self.subcommand_delete()
         self.subcommand_update()
         self.subcommand_show()
+        self.subcommand_next()
+        self.subcommand_remind()
         self.subcommand_complete()
+        self.subcommand_stats()
+        self.subcommand_lists()
+        self.subcommand_report()
+        self.subcommand_dedupe()
+        self.subcommand_migrate()
+        self.subcommand_watch()
+        self.subcommand_prune()
+        self.subcommand_sync()
+        self.subcommand_http()
+        self.subcommand_tag()
+        self.subcommand_completion()
         self.args = self.parser.parse_args(argv)
 
     def option_command(self):
         """
-        Create `--init` and `--file-path` option of todo cli.
+        Create `--init`, `--file-path` and `--list` option of todo cli.
         """
         self.parser.add_argument('--init', action='store_true',
                           help='Initialize table of the database.')
@@ -39,6 +98,18 @@ class CmdLineParser(object):
 
         self.parser.add_argument('-f', '--file-path', type=str,
                          help='Open the path of database file.')
+        self.parser.add_argument('-l', '--list', type=parse_list_name, default=None,
+                         metavar='NAME',
+                         help='The list of the tasks, `add` creates it. The {} list '
+                              'by default.'.format(self.DEFAULT_LIST))
+        self.parser.add_argument('--immutable', action='store_true',
+                         help='Open the database file as a snapshot which never '
+                              'changes, e.g. on a read-only mount.')
+        self.parser.add_argument('--trace', action='store_true',
+                         help='Print the time of the phases of the call and write '
+                              'them as a Chrome trace, like TODO_TRACE=1.')
+        self.parser.add_argument('--memprofile', action='store_true',
+                         help='Print the memory allocated by the phases of the call.')
 
     def subcommand_add(self):
         """
@@ -48,8 +119,35 @@ class CmdLineParser(object):
             'add', help='Add a task to the todo list')
         parser_add.add_argument('add-text', type=str,
                                 help='Add a task using this text.')
+        parser_add.add_argument('--show-open', type=positive_int, nargs='?', const=10,
+                                default=None, metavar='N',
+                                help='List the first N open tasks (10 if N is '
+                                     'not set) instead of the added task.')
+        parser_add.add_argument('-q', '--quiet', action='store_true', default=False,
+                                help='Print only the id of the added task.')
+        parser_add.add_argument('-p', '--priority', type=int, default=3,
+                                choices=range(1, 6),
+                                help='The priority from 1 (most urgent) to 5, 3 by default.')
+        parser_add.add_argument('--due', type=parse_time, default=None,
+                                metavar='"YYYY-MM-DD [HH:MM]"',
+                                help='The due date of the task.')
+        parser_add.add_argument('--parent', type=int, default=None, metavar='TASK_ID',
+                                help='Add the task as a subtask of this task.')
+        parser_add.add_argument('--no-duplicates', action='store_true', default=False,
+                                help='Do not add the task if an open task has a '
+                                     'similar text.')
+        self.add_threshold_argument(parser_add)
         parser_add.set_defaults(execute_cmd=self._add_action)
 
+    def add_threshold_argument(self, parser):
+        """
+        Add the `--threshold` option of the similar texts to a subcommand.
+        """
+        parser.add_argument('--threshold', type=float, default=None,
+                            help='The lowest similarity of two similar texts from 0 '
+                                 'to 1, the Jaccard similarity of their character '
+                                 'trigrams, 0.8 by default.')
+
     def subcommand_delete(self):
         """
         Create `delete` subcommand of todo cli.
@@ -86,8 +184,43 @@ class CmdLineParser(object):
                                  help='Show incomplete task list.')
         parser_show.add_argument('-a', '--all', action='store_true', default=False,
                                  help='Show all tasks.')
+        parser_show.add_argument('--tag', action='append', default=None, metavar='TAG',
+                                 help='Show the tasks which have the tag, repeat it '
+                                      'to show the tasks which have every tag.')
+        parser_show.add_argument('--sort', choices=sorted(self.SORT_ORDERS), default=None,
+                                 help='Sort the tasks by due date, priority or '
+                                      'creation time instead of id.')
+        parser_show.add_argument('--tree', action='store_true', default=False,
+                                 help='Show all tasks under their parent task with '
+                                      'the number of their done subtasks.')
         parser_show.set_defaults(execute_cmd=self._show_action)
 
+    def subcommand_next(self):
+        """
+        Create `next` subcommand of todo cli.
+        """
+        parser_next = self.subparsers.add_parser(
+            'next', help='Show the most urgent open tasks.')
+        parser_next.add_argument('-n', '--number', type=positive_int, default=5, metavar='K',
+                                 help='The number of tasks to show, 5 by default.')
+        parser_next.set_defaults(execute_cmd=self._next_action)
+
+    def subcommand_remind(self):
+        """
+        Create `remind` subcommand of todo cli.
+        """
+        parser_remind = self.subparsers.add_parser(
+            'remind', help='Show the overdue tasks or send a reminder when a task is due.')
+        parser_remind.add_argument('--daemon', action='store_true', default=False,
+                                   help='Keep running and send a reminder when an '
+                                        'open task is due.')
+        parser_remind.add_argument('--sink', type=open_sink, default='stdout',
+                                   metavar='{stdout,file:PATH,command:CMD}',
+                                   help='Where the reminders are sent, stdout by default.')
+        parser_remind.add_argument('--interval', type=float, default=5.0,
+                                   help='Seconds between the checks of the database.')
+        parser_remind.set_defaults(execute_cmd=self._remind_action)
+
     def subcommand_complete(self):
         """
         Create `complete` subcommand of todo cli.
@@ -96,24 +229,224 @@ class CmdLineParser(object):
             'complete', help='Mark a task as complete.')
         parser_complete.add_argument('complete-task-id', type=int,
                                      help='The task id you want complete.')
+        parser_complete.add_argument('-r', '--recursive', action='store_true', default=False,
+                                     help='Complete the subtasks of the task too.')
         parser_complete.set_defaults(execute_cmd=self._complete_action)
-    
+
+    def subcommand_stats(self):
+        """
+        Create `stats` subcommand of todo cli.
+        """
+        parser_stats = self.subparsers.add_parser(
+            'stats', help='Show the number of open and completed tasks.')
+        parser_stats.set_defaults(execute_cmd=self._stats_action)
+
+    def subcommand_lists(self):
+        """
+        Create `lists` subcommand of todo cli.
+        """
+        parser_lists = self.subparsers.add_parser(
+            'lists', help='Show the lists with the number of their open and all tasks.')
+        parser_lists.set_defaults(execute_cmd=self._lists_action)
+
+    def subcommand_report(self):
+        """
+        Create `report` subcommand of todo cli.
+        """
+        parser_report = self.subparsers.add_parser(
+            'report', help='Show the lead time, throughput, open task age and burndown.')
+        parser_report.add_argument('--days', type=int, default=30,
+                                   help='The days of the throughput and burndown, '
+                                        '30 by default.')
+        parser_report.add_argument('--json', action='store_true', default=False,
+                                   help='Print the report as JSON.')
+        parser_report.set_defaults(execute_cmd=self._report_action)
+
+    def subcommand_dedupe(self):
+        """
+        Create `dedupe` subcommand of todo cli.
+        """
+        parser_dedupe = self.subparsers.add_parser(
+            'dedupe', help='Show the groups of the open tasks which have similar texts.')
+        self.add_threshold_argument(parser_dedupe)
+        parser_dedupe.set_defaults(execute_cmd=self._dedupe_action)
+
+    def subcommand_migrate(self):
+        """
+        Create `migrate` subcommand of todo cli.
+        """
+        parser_migrate = self.subparsers.add_parser(
+            'migrate', help='Migrate the database to the current schema.')
+        parser_migrate.add_argument('--batch-size', type=int, default=1000,
+                                    help='The number of rows copied per transaction.')
+        parser_migrate.set_defaults(execute_cmd=self._migrate_action)
+
+    def subcommand_watch(self):
+        """
+        Create `watch` subcommand of todo cli.
+        """
+        parser_watch = self.subparsers.add_parser(
+            'watch', help='Print the changes of the todo list as JSON lines.')
+        parser_watch.add_argument('--since', type=int, default=None, metavar='SEQ',
+                                  help='Print the changes after this sequence '
+                                       'number (the latest change if not set).')
+        parser_watch.add_argument('--interval', type=float, default=0.2,
+                                  help='Seconds between the checks of the database.')
+        parser_watch.add_argument('--once', action='store_true', default=False,
+                                  help='Print the pending changes and exit.')
+        parser_watch.set_defaults(execute_cmd=self._watch_action)
+
+    def subcommand_prune(self):
+        """
+        Create `prune` subcommand of todo cli.
+        """
+        parser_prune = self.subparsers.add_parser(
+            'prune', help='Delete the old changes of the change feed.')
+        parser_prune.add_argument('--keep', type=int, default=10000,
+                                  help='The number of the latest changes which are kept '
+                                       'for `watch --since`, 10000 by default.')
+        parser_prune.set_defaults(execute_cmd=self._prune_action)
+
+    def subcommand_sync(self):
+        """
+        Create `sync` subcommand of todo cli.
+        """
+        parser_sync = self.subparsers.add_parser(
+            'sync', help='Exchange the changed tasks with another database file.')
+        parser_sync.add_argument('other-file', type=str,
+                                 help='The path of the other database file.')
+        parser_sync.add_argument('--batch-size', type=int, default=500,
+                                 help='The number of tasks applied per transaction.')
+        parser_sync.set_defaults(execute_cmd=self._sync_action)
+
+    def subcommand_http(self):
+        """
+        Create `http` subcommand of todo cli.
+        """
+        parser_http = self.subparsers.add_parser(
+            'http', help='Serve the tasks over HTTP as JSON.')
+        parser_http.add_argument('--bind', type=parse_bind, default=('127.0.0.1', 8080),
+                                 metavar='HOST:PORT',
+                                 help='The address of the server, 127.0.0.1:8080 by default.')
+        parser_http.add_argument('--pool-size', type=int, default=8,
+                                 help='The number of open connections of the database file.')
+        parser_http.add_argument('-v', '--verbose', action='store_true', default=False,
+                                 help='Log every request to stderr.')
+        parser_http.set_defaults(execute_cmd=self._http_action)
+
+    def subcommand_tag(self):
+        """
+        Create `tag` subcommand of todo cli, with `add` and `rm` subcommands.
+        """
+        parser_tag = self.subparsers.add_parser(
+            'tag', help='Add or remove the tags of a task.')
+        tag_subparsers = parser_tag.add_subparsers(help='sub-command of tag help')
+        for name, help, action in (
+                ('add', 'Add tags to a task.', self._tag_add_action),
+                ('rm', 'Remove tags from a task.', self._tag_rm_action)):
+            parser = tag_subparsers.add_parser(name, help=help)
+            parser.add_argument('tag-task-id', type=int, help='The id of the task.')
+            parser.add_argument('tag-names', type=str, nargs='+', help='The tags.')
+            parser.set_defaults(execute_cmd=action)
+
+    def subcommand_completion(self):
+        """
+        Create `completion` subcommand of todo cli.
+        """
+        parser_completion = self.subparsers.add_parser(
+            'completion', help='Print the shell completion script or the open task ids.')
+        parser_completion.add_argument('completion-shell', choices=['bash', 'zsh', 'fish', 'ids'],
+                                       help='The shell of the script, `ids` rewrites the '
+                                            'completion cache and prints it.')
+        parser_completion.set_defaults(execute_cmd=self._completion_action)
+
+    def read_only(self):
+        """
+        Whether the subcommand only reads the database.
+        """
+        return getattr(self.args.execute_cmd, '__name__', None) in self.READ_ONLY_ACTIONS
+
+    def _list_id(self, create=False):
+        """
+        The id of the list of `--list`, 0 for the default list.
+
+        Parameters
+        ----------
+        create : bool
+            Create the list if it does not exist, otherwise raise
+            RecordIsNotFoundError.
+        """
+        name = vars(self.args)['list']
+        if name is None or name == self.DEFAULT_LIST:
+            return 0
+        if create:
+            return TodoList.find_or_create({'name': name}).id
+        todo_list = TodoList.find_all({'name': name}, size=1)
+        if not todo_list:
+            raise RecordIsNotFoundError('This list not exist.')
+        return todo_list[0].id
+
+    def list_condition(self):
+        """
+        The condition of the tasks of the list of `--list`, it is the
+        prefix of the indexes of `Todo`.
+        """
+        return {'list_id': self._list_id()}
+
+    def _find_task(self, id, message='This id of task not exist.'):
+        """
+        The task of an id in the list of `--list`, RecordIsNotFoundError
+        with the message if the list has no such task.
+        """
+        task = Todo.find_all(dict(self.list_condition(), id=id), size=1)
+        if not task:
+            raise RecordIsNotFoundError(message)
+        return task[0]
+
     def _init_action(self):
         """
         Initial todo table action
         """
         if vars(self.args)['init']:
             Todo.drop_table()
+            # The tags of the dropped tasks go with them.
+            for model in MODELS:
+                if model is not Todo:
+                    model.drop_table()
 
     def _add_action(self):
         """
         Add todo action
         """
         text = vars(self.args)['add-text']
-        Todo(text=text, id=self.generate_next_id()).save()
+        parent_id = vars(self.args)['parent']
+        if parent_id is not None:
+            # A subtask is in the list of its parent.
+            self._find_task(parent_id, 'This id of parent task not exist.')
+        list_id = self._list_id(create=True)
+        if vars(self.args)['no_duplicates']:
+            similar = self._duplicate_index().similar(text)
+            if similar:
+                self._print_similar([r for r, _ in similar], text)
+                raise DuplicateRecordError(
+                    'Task has not been added, it is similar to the open tasks above.')
+        todo = Todo(text=text, id=self.generate_next_id(), uid=uuid4().hex,
+                    priority=vars(self.args)['priority'], due_at=vars(self.args)['due'],
+                    parent_id=parent_id, list_id=list_id)
+        todo.save()
+        if vars(self.args)['quiet']:
+            print(todo.id)
+            return
         print('Task has been added successfully.')
-        result = Todo.find_all({'is_completed': False})
-        self._print_and_check_result(result)
+        size = vars(self.args)['show_open']
+        if size is not None:
+            result = Todo.find_all(
+                {'list_id': list_id, 'is_completed': False}, order_by='id', size=size)
+            self._print_and_check_result(result)
+        else:
+            # `save()` has set the default values, the task is printed
+            # as stored without querying it again.
+            self._print_and_check_result([todo])
 
     def _delete_action(self):
         """
@@ -125,11 +458,14 @@ class CmdLineParser(object):
             An Namespace object of argparse use to storing attributes. 
         """
         id = vars(self.args)['del-task-id']
-        result = Todo(id=id).remove()
-        if result:
-            print('Task {} is deleted successfully.'.format(id))
-        else:
-            raise RecordIsNotFoundError('This id of task not exist.')
+        with Todo.transaction():
+            task = self._find_task(id)
+            Todo(id=id).remove()
+            Todo.tags.clear(id)
+            # The subtasks move up to the parent of the deleted task.
+            for subtask in Todo.find_all({'parent_id': id}) or []:
+                Todo(id=subtask.id, parent_id=task.parent_id).update()
+        print('Task {} is deleted successfully.'.format(id))
 
     def _update_action(self):
         """
@@ -137,38 +473,327 @@ class CmdLineParser(object):
         """
         id = vars(self.args)['update_task_id']
         text = vars(self.args)['update_task_text']
-        result = Todo(id=id, text=text, update_at=time.time()).update()
-        if result:
-            print('The text of task {} has changed to "{}".'.format(id, text))
-        else:
-            raise RecordIsNotFoundError('This id of task not exist.')
+        self._find_task(id)
+        Todo(id=id, text=text, update_at=time.time()).update()
+        print('The text of task {} has changed to "{}".'.format(id, text))
 
     def _show_action(self):
         """
         Show todo action
         """
-        if vars(self.args)['complete']:
-            result = Todo.find_all({"is_completed": True})
+        sort = vars(self.args)['sort']
+        order = {'order_by': self.SORT_ORDERS[sort]} if sort else {}
+        # The tasks of a status are in the id order without `--sort`, the
+        # planner may read them by any index on `list_id, is_completed`.
+        status_order = order.get('order_by', 'id')
+        condition = self.list_condition()
+        if vars(self.args)['tree']:
+            roots = Todo.find_all(
+                dict(condition, parent_id=Compare('IS', None)), order_by='id') or []
+            self._print_tree(Todo.subtasks.walk([r.id for r in roots]) if roots else [])
+
+        elif vars(self.args)['tag']:
+            if vars(self.args)['complete']:
+                condition['is_completed'] = True
+            elif vars(self.args)['incomplete']:
+                condition['is_completed'] = False
+            result = Todo.tags.find_all(
+                'name', vars(self.args)['tag'], condition,
+                order_by=status_order)
+            self._print_and_check_result(result)
+
+        elif vars(self.args)['complete']:
+            result = Todo.find_all(dict(condition, is_completed=True), order_by=status_order)
             self._print_and_check_result(result)
 
         elif vars(self.args)['incomplete']:
-            result = Todo.find_all({"is_completed": False})
+            result = Todo.find_all(dict(condition, is_completed=False), order_by=status_order)
             self._print_and_check_result(result)
 
         elif vars(self.args)['all']:
-            result = Todo.find_all()
+            # The open tasks first, so the index on `list_id, is_completed`
+            # and the sort columns returns the rows in order.
+            if order:
+                order['order_by'] = 'is_completed, ' + order['order_by']
+            result = Todo.find_all(condition, order_by=order.get('order_by', 'id'))
             self._print_and_check_result(result)
 
+    def _next_action(self):
+        """
+        Show the most urgent open tasks action
+
+        The tasks with a due date come first by due date and priority, then
+        the tasks without one by priority. Both are read in the order of an
+        index of `Todo`, so only the shown rows are read.
+        """
+        size = vars(self.args)['number']
+        condition = self.list_condition()
+        # NULL is stored first in an index, the range skips the tasks
+        # without a due date.
+        result = Todo.find_all(
+            dict(condition, is_completed=False, due_at=Compare('>', float('-inf'))),
+            order_by='due_at, priority', size=size) or []
+        if len(result) < size:
+            result += Todo.find_all(
+                dict(condition, is_completed=False, due_at=Compare('IS', None)),
+                order_by='priority', size=size - len(result)) or []
+        self._print_and_check_result(result)
+
+    def _remind_action(self):
+        """
+        Remind the due tasks action
+
+        Without `--daemon` it shows the open tasks which are due. The daemon
+        prints the number of the sent reminders and their wakeup latency
+        when it is interrupted.
+        """
+        args = vars(self.args)
+        condition = self.list_condition()
+        if not args['daemon']:
+            result = Todo.find_all(
+                dict(condition, is_completed=False, due_at=Compare('<=', time.time())),
+                order_by='due_at, priority')
+            self._print_and_check_result(result)
+            return
+        from .remind import Reminder
+        Storage.backend().require_change_feed('remind --daemon')
+        reminder = Reminder(Todo, args['sink'], args['interval'], condition=condition)
+        try:
+            reminder.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(reminder.summary(), file=sys.stderr)
+
+    def _completion_action(self):
+        """
+        Shell completion action
+        """
+        shell = vars(self.args)['completion-shell']
+        path = vars(self.args)['file_path']
+        if shell != 'ids':
+            print(script(shell, sorted(self.subparsers.choices), self.ID_SUBCOMMANDS, path),
+                  end='')
+            return
+        condition = self.list_condition()
+        try:
+            lines = write_cache(path, Todo, condition, vars(self.args)['list'])
+        except OSError:
+            # e.g. the database is on a read-only mount.
+            lines = cache_lines(Todo, condition)
+        for line in lines:
+            print(line)
+
     def _complete_action(self):
         """
         Complete todo action
         """
         id = vars(self.args)['complete-task-id']
-        result = Todo(id=id, is_completed=True, update_at=time.time()).update()
-        if result:
-            print('Task {} complete.'.format(id))
+        self._find_task(id)
+        if vars(self.args)['recursive']:
+            # A single recursive statement completes the whole subtree.
+            count = Todo.subtasks.update(id, {'is_completed': True, 'update_at': time.time()})
+            print('Task {} and {} subtasks complete.'.format(id, count - 1))
+            return
+        Todo(id=id, is_completed=True, update_at=time.time()).update()
+        print('Task {} complete.'.format(id))
+
+    def _tag_add_action(self):
+        """
+        Add tags to a task action
+        """
+        id = vars(self.args)['tag-task-id']
+        names = vars(self.args)['tag-names']
+        self._find_task(id)
+        with Todo.transaction():
+            for name in names:
+                Todo.tags.add(id, Tag.find_or_create({'name': name}).id)
+        print('Task {} is tagged {}.'.format(id, ', '.join(names)))
+
+    def _tag_rm_action(self):
+        """
+        Remove tags from a task action
+        """
+        id = vars(self.args)['tag-task-id']
+        self._find_task(id)
+        removed = []
+        with Todo.transaction():
+            for name in vars(self.args)['tag-names']:
+                tag = Tag.find_all({'name': name}, size=1)
+                if tag and Todo.tags.remove(id, tag[0].id):
+                    removed.append(name)
+        if removed:
+            print('Tags {} are removed from task {}.'.format(', '.join(removed), id))
         else:
-            raise RecordIsNotFoundError('This id of task not exist.')
+            raise RecordIsNotFoundError('This tag of task not exist.')
+
+    def _stats_action(self):
+        """
+        Show the task counters action
+
+        The open and the completed tasks of the list are both read from
+        the counters of `list_id` and `is_completed`, so no task is read.
+        """
+        list_id = self._list_id()
+        counts = Todo.counters(('list_id', 'is_completed'))
+        open_count = counts.get((list_id, False), 0)
+        completed = counts.get((list_id, True), 0)
+        print('Open: {}'.format(open_count))
+        print('Completed: {}'.format(completed))
+        print('Total: {}'.format(open_count + completed))
+
+    def _lists_action(self):
+        """
+        Show the lists action
+        """
+        totals = Todo.counters('list_id')
+        counts = Todo.counters(('list_id', 'is_completed'))
+        lists = [(0, self.DEFAULT_LIST)] + [
+            (l.id, l.name) for l in TodoList.find_all(order_by='id') or []]
+        for list_id, name in lists:
+            print('{} | Open: {}, Total: {}'.format(
+                name, counts.get((list_id, False), 0), totals.get(list_id, 0)))
+
+    def _report_action(self):
+        """
+        Analytics report action
+        """
+        from .report import Report, format_report
+        report = Report(
+            Todo, Storage.backend(), days=vars(self.args)['days'],
+            condition=self.list_condition()).run()
+        if vars(self.args)['json']:
+            print(json.dumps(report))
+        else:
+            print(format_report(report))
+
+    def _duplicate_index(self):
+        """
+        The index of the similar open tasks of the list, brought up to
+        date.
+        """
+        from .dedupe import DuplicateIndex
+        index = DuplicateIndex(
+            Todo, TodoSignature, 'todo_id', Checkpoint, vars(self.args)['threshold'],
+            self.list_condition())
+        index.refresh()
+        return index
+
+    def _dedupe_action(self):
+        """
+        Show the similar open tasks action
+        """
+        groups = self._duplicate_index().groups()
+        if not groups:
+            print('No similar tasks exist.')
+            return
+        for first, *others in groups:
+            print(self._task_line(first, ()))
+            self._print_similar(others, first.text, indent='    ')
+        print('Groups of similar tasks: {}'.format(len(groups)))
+
+    def _migrate_action(self):
+        """
+        Migrate the database action
+        """
+        Storage.backend().migrate(
+            MODELS, Todo.SCHEMA_VERSION,
+            batch_size=vars(self.args)['batch_size'], progress=print)
+
+    def _watch_action(self):
+        """
+        Watch the changes action
+
+        It sleeps until `PRAGMA data_version` moves, i.e. another connection
+        commits, and then reads only the changes after the last printed one.
+        """
+        args = vars(self.args)
+        backend = Storage.backend()
+        backend.require_change_feed('watch')
+        seq = args['since']
+        if seq is None:
+            seq = Todo.last_change_seq()
+        elif seq + 1 < Todo.first_change_seq():
+            raise ValueError('The changes up to {} are pruned, --since {} is too old.'.format(
+                Todo.first_change_seq() - 1, seq))
+        while True:
+            version = backend.data_version()
+            for change in Todo.changes_since(seq):
+                print(json.dumps({
+                    'seq': change.seq,
+                    'op': change.op,
+                    'id': change.primary_key,
+                    'columns': list(change.columns),
+                }), flush=True)
+                seq = change.seq
+            if args['once']:
+                return
+            while backend.data_version() == version:
+                time.sleep(args['interval'])
+
+    def _prune_action(self):
+        """
+        Prune the change feed action
+
+        The changes which an index has not read yet, after its `Checkpoint`,
+        are kept as well.
+        """
+        Storage.backend().require_change_feed('prune')
+        seq = Todo.last_change_seq() - vars(self.args)['keep']
+        checkpoints = Checkpoint.find_all() or []
+        if checkpoints:
+            seq = min(seq, min(c.seq for c in checkpoints))
+        count = Todo.prune_changes(seq)
+        print('Pruned {} changes, the change feed starts at {}.'.format(
+            count, Todo.first_change_seq()))
+
+    def _sync_action(self):
+        """
+        Sync two database files action
+        """
+        from .sync import Sync
+        local = Storage.backend()
+        if not isinstance(local, SQLiteBackend):
+            raise ValueError('sync needs a SQLite database file.')
+        path = vars(self.args)['other-file']
+        remote = SQLiteBackend(
+            Connection(path if path.startswith('file:') else 'file:' + path))
+        try:
+            # As for the local database, only `todo migrate` rebuilds a table.
+            if Migration(MODELS, Todo.SCHEMA_VERSION, remote).rebuilt_tables():
+                raise ValueError(
+                    'The other database has to rebuild its tables, run `todo -f {} migrate` '
+                    'first.'.format(path))
+            remote.migrate(MODELS, Todo.SCHEMA_VERSION, rebuild=False)
+            stats = Sync(Todo, local, remote, vars(self.args)['batch_size'],
+                         parent_column='parent_id', list_column='list_id',
+                         list_model=TodoList).run()
+        finally:
+            remote.close()
+        print('Pulled {pulled} tasks, pushed {pushed} tasks, deleted {deleted} tasks.'.format(
+            **stats))
+        if stats['renumbered']:
+            print('{} tasks got a new id because their id was taken.'.format(
+                stats['renumbered']))
+
+    def _http_action(self):
+        """
+        Serve the tasks over HTTP action
+        """
+        if not isinstance(Storage.backend(), SQLiteBackend):
+            raise ValueError('http needs a SQLite database file.')
+        from .server import TaskServer
+        server = TaskServer(
+            vars(self.args)['bind'], SQLConnection.PATH or SQLConnection.DEFAULT_PATH,
+            vars(self.args)['pool_size'], vars(self.args)['verbose'])
+        host, port = server.server_address[:2]
+        print('Serving the tasks on http://{}:{}/tasks'.format(host, port), flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
 
     def _print_and_check_result(self, result):
         """
@@ -179,16 +804,77 @@ class CmdLineParser(object):
         result : list(todo) or None
             A list of todo dict.
         """
-        if result:
-            for r in result:
-                print('{} | {} (Created At: {}, Updated At: {})'.format(
-                    str(r.id), r.text,
-                    convert_time_to_message(r.created_at),
-                    '' if r.update_at == 0.0 else convert_time_to_message(
-                        r.update_at)
-                ))
-        else:
-            print('No task exist.')
+        rows = len(result) if result else 0
+        with TRACER.span('render', rows=rows), PROFILER.phase('render', rows):
+            if result:
+                # The tags of every task are read by a single query.
+                tags = Todo.tags.load([r.id for r in result])
+                for r in result:
+                    print(self._task_line(r, tags.get(r.id, ())))
+            else:
+                print('No task exist.')
+
+    def _print_tree(self, nodes):
+        """
+        Print the tasks of a tree walk, a subtask is indented under its
+        parent task.
+
+        Parameters:
+        -----------
+        nodes : list(Node)
+            The nodes of `Tree.walk()`, depth first.
+        """
+        with TRACER.span('render', rows=len(nodes)), PROFILER.phase('render', len(nodes)):
+            if not nodes:
+                print('No task exist.')
+                return
+            tags = Todo.tags.load([n.record.id for n in nodes])
+            # The nodes are depth first, so a single pass prints every
+            # task right after its parent.
+            for node in nodes:
+                r = node.record
+                print('{}{}{}'.format(
+                    '    ' * node.depth,
+                    self._task_line(r, tags.get(r.id, ())),
+                    ' ({} of {} done)'.format(node.done, node.total) if node.total else ''))
+
+    def _print_similar(self, records, text, indent=''):
+        """
+        Print the tasks which are similar to a text with their similarity.
+
+        Parameters:
+        -----------
+        records : list(todo)
+            The similar tasks.
+        text : str
+            The text which the tasks are similar to.
+        indent : str
+            The prefix of the lines.
+        """
+        from .dedupe import shingles, similarity
+        grams = shingles(text)
+        for r in records:
+            print('{}{} ({:.0%} similar)'.format(
+                indent, self._task_line(r, ()), similarity(grams, shingles(r.text))))
+
+    def _task_line(self, r, tags):
+        """
+        The line of a task and its tags.
+        """
+        names = ' '.join('#' + t.name for t in tags)
+        urgency = []
+        if r.due_at is not None:
+            urgency.append('due ' + format_time(r.due_at))
+        if r.priority not in (None, 3):
+            urgency.append('priority {}'.format(r.priority))
+        return '{} | {} (Created At: {}, Updated At: {}){}{}'.format(
+            str(r.id), r.text,
+            convert_time_to_message(r.created_at),
+            '' if r.update_at == 0.0 else convert_time_to_message(
+                r.update_at),
+            ' [{}]'.format(', '.join(urgency)) if urgency else '',
+            ' ' + names if names else ''
+        )
 
     def generate_next_id(self):
         """
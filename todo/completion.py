@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+from .utility import SQLConnection
+import glob
+import os
+
+# The completion cache of a database file is stored next to it.
+CACHE_SUFFIX = '.completion'
+# The text of a task in the cache is cut to this width.
+TEXT_WIDTH = 40
+
+BASH_SCRIPT = r'''# bash completion of todo, load it with: source <(todo completion bash)
+_todo_ids() {
+    # Every list has its own cache.
+    local cache="$1.completion${2:+.$2}"
+    # The cache is stale when the database file, or its write-ahead log,
+    # has changed after it.
+    if [ ! "$cache" -nt "$1" ] || { [ -e "$1-wal" ] && [ ! "$cache" -nt "$1-wal" ]; }; then
+        todo -f "$1" ${2:+--list=$2} completion ids >/dev/null 2>&1
+    fi
+    [ -r "$cache" ] && cut -f1 "$cache"
+}
+
+_todo() {
+    local cur="${COMP_WORDS[COMP_CWORD]}" prev="${COMP_WORDS[COMP_CWORD-1]}"
+    local i command= list= db=@DATABASE@
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        case "${COMP_WORDS[i]}" in
+            -f|--file-path) db="${COMP_WORDS[i+1]}"; ((i++)) ;;
+            -l|--list) list="${COMP_WORDS[i+1]}"; ((i++)) ;;
+            -*) ;;
+            *) command="${COMP_WORDS[i]}"; break ;;
+        esac
+    done
+    db="${db#file:}"
+    db="${db%%\?*}"
+    case "$command" in
+        '') COMPREPLY=($(compgen -W "@SUBCOMMANDS@" -- "$cur")) ;;
+        tag)
+            if [ "$prev" = tag ]; then
+                COMPREPLY=($(compgen -W "add rm" -- "$cur"))
+            else
+                COMPREPLY=($(compgen -W "$(_todo_ids "$db" "$list")" -- "$cur"))
+            fi ;;
+        @ID_COMMANDS@) COMPREPLY=($(compgen -W "$(_todo_ids "$db" "$list")" -- "$cur")) ;;
+    esac
+}
+complete -F _todo todo
+'''
+
+ZSH_SCRIPT = r'''#compdef todo
+# zsh completion of todo, load it with: source <(todo completion zsh)
+_todo_ids() {
+    # Every list has its own cache.
+    local cache="$1.completion${2:+.$2}" line
+    local -a ids
+    # The cache is stale when the database file, or its write-ahead log,
+    # has changed after it.
+    [[ $cache -nt $1 && ( ! -e $1-wal || $cache -nt $1-wal ) ]] || todo -f "$1" ${2:+--list=$2} completion ids >/dev/null 2>&1
+    [[ -r $cache ]] || return 1
+    while IFS= read -r line; do
+        ids+=("${line%%$'\t'*}:${${line#*$'\t'}//:/\\:}")
+    done < "$cache"
+    _describe task ids
+}
+
+_todo() {
+    local i command list db=@DATABASE@
+    for ((i = 2; i < CURRENT; i++)); do
+        case $words[i] in
+            -f|--file-path) db=$words[i+1]; ((i++)) ;;
+            -l|--list) list=$words[i+1]; ((i++)) ;;
+            -*) ;;
+            *) command=$words[i]; break ;;
+        esac
+    done
+    db=${db#file:}
+    db=${db%%\?*}
+    case $command in
+        '') compadd -- @SUBCOMMANDS@ ;;
+        tag)
+            if [[ $words[CURRENT-1] == tag ]]; then
+                compadd -- add rm
+            else
+                _todo_ids $db $list
+            fi ;;
+        @ID_COMMANDS@) _todo_ids $db $list ;;
+    esac
+}
+compdef _todo todo
+'''
+
+FISH_SCRIPT = r'''# fish completion of todo, load it with: todo completion fish | source
+function __todo_ids
+    set -l db @DATABASE@
+    set -l list
+    set -l words (commandline -opc)
+    for i in (seq 2 (count $words))
+        if contains -- $words[(math $i - 1)] -f --file-path
+            set db $words[$i]
+        else if contains -- $words[(math $i - 1)] -l --list
+            set list $words[$i]
+        end
+    end
+    set db (string replace -r '^file:' '' -- $db | string replace -r '\?.*$' '')
+    # Every list has its own cache.
+    set -l cache $db.completion
+    set -l option
+    if test -n "$list"
+        set cache $cache.$list
+        set option --list=$list
+    end
+    # The cache is stale when the database file, or its write-ahead log,
+    # has changed after it.
+    if not command test $cache -nt $db; or begin
+            command test -e $db-wal; and not command test $cache -nt $db-wal
+        end
+        todo -f $db $option completion ids >/dev/null 2>&1
+    end
+    test -r $cache; and cat $cache
+end
+
+complete -c todo -f
+complete -c todo -n __fish_use_subcommand -a '@SUBCOMMANDS@'
+complete -c todo -n '__fish_seen_subcommand_from @ID_COMMANDS_LIST@' -a '(__todo_ids)'
+complete -c todo -n '__fish_seen_subcommand_from tag; and not __fish_seen_subcommand_from add rm' -a 'add rm'
+complete -c todo -n '__fish_seen_subcommand_from tag; and __fish_seen_subcommand_from add rm' -a '(__todo_ids)'
+'''
+
+SCRIPTS = {'bash': BASH_SCRIPT, 'zsh': ZSH_SCRIPT, 'fish': FISH_SCRIPT}
+
+
+def database_file(path):
+    """
+    The file of a SQLite database path.
+
+    Parameters
+    ----------
+    path : str or None
+        A path or a URI of the database, the default database if None.
+
+    Returns
+    -------
+    file : str or None
+        The path of the database file, None for the other backends.
+    """
+    path = path or SQLConnection.DEFAULT_PATH
+    if path == 'memory:' or path.startswith(('log:', 'shard:')):
+        return None
+    if path.startswith('file:'):
+        path = path[len('file:'):]
+    return path.split('?', 1)[0]
+
+
+def cache_file(path, name=None):
+    """
+    The completion cache file of a database path, or None.
+
+    Parameters
+    ----------
+    path : str or None
+        A path or a URI of the database.
+    name : str or None
+        The name of a list, the cache of the default list if None.
+    """
+    file = database_file(path)
+    if not file:
+        return None
+    return file + CACHE_SUFFIX + ('.' + name if name else '')
+
+
+def cache_lines(model, condition=None):
+    """
+    Lines of the id and the cut text of the open tasks of a condition,
+    e.g. ``{'list_id': 2}``, separated by a tab.
+    """
+    tasks = model.find_all(dict(condition or {}, is_completed=False), order_by='id') or []
+    return [
+        '{}\t{}'.format(t.id, ' '.join((t.text or '').split())[:TEXT_WIDTH])
+        for t in tasks
+    ]
+
+
+def write_cache(path, model, condition=None, name=None):
+    """
+    Write the completion cache of the open tasks of a list of a database,
+    the tasks of the condition of the list named `name`.
+
+    The cache is written to a temporary file which replaces it, so a
+    completion never reads a half written cache. It is written after the
+    database, the shell scripts use it while it is newer than the file.
+
+    Returns
+    -------
+    lines : list(str)
+        The lines of the cache.
+    """
+    lines = cache_lines(model, condition)
+    file = cache_file(path, name)
+    if file:
+        temporary = '{}.{}'.format(file, os.getpid())
+        with open(temporary, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+        os.replace(temporary, file)
+    return lines
+
+
+def remove_caches(path):
+    """
+    Remove the completion caches of every list of a database, a write
+    removes them instead of rewriting them and the next completion
+    rewrites the cache of its list with `todo completion ids`.
+    """
+    file = cache_file(path)
+    if not file:
+        return
+    for cache in [file] + glob.glob(glob.escape(file) + '.*'):
+        try:
+            os.remove(cache)
+        except FileNotFoundError:
+            pass
+
+
+def script(shell, subcommands, id_subcommands, database=None):
+    """
+    Completion script of a shell.
+
+    Parameters
+    ----------
+    shell : str
+        'bash', 'zsh' or 'fish'.
+    subcommands : list(str)
+        The subcommands of todo.
+    id_subcommands : list(str)
+        The subcommands which take a task id.
+    database : str or None
+        The database path when the command line has no `-f`.
+    """
+    return (SCRIPTS[shell]
+            .replace('@DATABASE@', database_file(database) or '')
+            .replace('@SUBCOMMANDS@', ' '.join(subcommands))
+            .replace('@ID_COMMANDS@', '|'.join(id_subcommands))
+            .replace('@ID_COMMANDS_LIST@', ' '.join(id_subcommands)))
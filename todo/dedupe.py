@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+from functools import lru_cache
+from hashlib import shake_128
+from struct import Struct
+from .storage import Compare, Storage
+
+# The MinHash signature of a text has `BANDS` bands of `ROWS` values. Two
+# texts whose trigram sets have the Jaccard similarity s share a band with
+# the probability 1 - (1 - s ** ROWS) ** BANDS: 0.997 for 0.8, 0.86 for
+# 0.6 and 0.66 for 0.5, so a threshold below 0.5 misses many duplicates.
+BANDS = 8
+ROWS = 3
+HASHES = BANDS * ROWS
+# The hash functions of a trigram are the 32 bit words of its digest.
+_UNPACK = Struct('<{}I'.format(HASHES)).unpack
+# The buckets are stored as signed 64 bit integers.
+BUCKET_RANGE = 1 << 64
+BUCKET_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def shingles(text):
+    """
+    The set of the character trigrams of a text, in lower case and with
+    the whitespace collapsed, e.g. {' ab', 'ab '} for 'AB'.
+    """
+    text = ' {} '.format(' '.join((text or '').lower().split()))
+    return {text[i:i + 3] for i in range(len(text) - 2)} if text.strip() else set()
+
+
+@lru_cache(maxsize=1 << 14)
+def _hashes(gram):
+    # Texts share most of their trigrams, so the hashes are cached.
+    return _UNPACK(shake_128(gram.encode()).digest(4 * HASHES))
+
+
+def signature(grams):
+    """
+    MinHash signature of a set of trigrams.
+
+    The signature keeps the smallest value of every one of the `HASHES`
+    hash functions over the trigrams, two sets have the same value of a
+    function with the probability of their Jaccard similarity.
+
+    Returns
+    -------
+    signature : list(int) or None
+        The smallest value of every function, None for an empty set.
+    """
+    if not grams:
+        return None
+    return list(map(min, zip(*map(_hashes, grams))))
+
+
+def buckets(grams):
+    """
+    The bucket of every band of the signature of a set of trigrams, as
+    signed 64 bit integers, an empty list for an empty set.
+    """
+    values = signature(grams)
+    if values is None:
+        return []
+    result = []
+    for band in range(BANDS):
+        # A polynomial hash of the band number and its values.
+        bucket = band
+        for value in values[band * ROWS:(band + 1) * ROWS]:
+            bucket = (bucket * BUCKET_MULTIPLIER + value) % BUCKET_RANGE
+        result.append(bucket - BUCKET_RANGE if bucket >= BUCKET_RANGE >> 1 else bucket)
+    return result
+
+
+def similarity(grams, other):
+    """
+    Jaccard similarity of two sets of trigrams.
+    """
+    if not grams or not other:
+        return 0.0
+    common = len(grams & other)
+    return common / (len(grams) + len(other) - common)
+
+
+class DuplicateIndex(object):
+    """
+    Index of the open tasks which finds the tasks whose text is similar
+    to a text.
+
+    The index stores a row per band of the MinHash signature of every
+    open task (`signatures`), so the tasks which may be similar to a text
+    are read by its buckets, and only these candidates are compared by the
+    Jaccard similarity of their trigrams with the `threshold`.
+
+    The index follows the change feed of the tasks: `refresh()` indexes the
+    tasks changed after the sequence number stored in `checkpoints` again,
+    so it costs the changes since the last refresh, whichever command or
+    connection wrote them. A database without a checkpoint, or whose
+    change feed went back or is pruned after the checkpoint, is indexed
+    from scratch. A backend without a change feed can not keep the index.
+
+    Example
+    -------
+    >>> index = DuplicateIndex(Todo, TodoSignature, 'todo_id', Checkpoint)
+    >>> index.refresh()
+    >>> index.similar('Reply to the email of Bob')
+    [({'id': 4, 'text': 'reply to the email of bob!', ...}, 0.92)]
+    """
+    THRESHOLD = 0.8
+    BATCH_SIZE = 1000
+    # The tasks which are indexed, the completed tasks are not duplicates.
+    CONDITION = {'is_completed': False}
+
+    def __init__(self, model, signatures, key, checkpoints, threshold=None, condition=None):
+        """
+        Parameters
+        ----------
+        model : type
+            The model class of the tasks, it has a `text` column.
+        signatures : type
+            The model class of the index, with a `bucket` column and the
+            `key` column which stores the primary key of a task.
+        key : str
+            The column of `signatures` which stores the primary key.
+        checkpoints : type
+            The model class of the change feed positions, with the `name`
+            and `seq` columns.
+        threshold : float or None
+            The lowest similarity of a duplicate from 0 to 1, `THRESHOLD`
+            if None.
+        condition : dict or None
+            Column names with the values of the tasks which `similar()` and
+            `groups()` return, e.g. ``{'list_id': 2}``, every indexed task
+            if None.
+        """
+        threshold = self.THRESHOLD if threshold is None else threshold
+        if not 0 < threshold <= 1:
+            raise ValueError('The similarity threshold should be in (0, 1].')
+        self.model = model
+        self.signatures = signatures
+        self.key = key
+        self.checkpoints = checkpoints
+        self.threshold = threshold
+        self.condition = condition or {}
+
+    def _index(self, records):
+        # The rows go to the backend as tuples, not as model instances.
+        primary_key = self.model.PRIMARY_KEY
+        rows = [
+            (bucket, r[primary_key]) for r in records for bucket in buckets(shingles(r.text))]
+        if self.signatures.COLUMNS[0] != 'bucket':
+            rows = [row[::-1] for row in rows]
+        Storage.backend().upsert(self.signatures, rows, 'ignore', self.BATCH_SIZE)
+
+    def _unindex(self, primary_key):
+        for row in self.signatures.find_all({self.key: primary_key}) or []:
+            row.remove()
+
+    def _find(self, primary_key):
+        # The task of the primary key if it matches the condition.
+        record = self.model.find(primary_key)
+        if record and all(record[0][k] == v for k, v in self.condition.items()):
+            return record[0]
+        return None
+
+    def _checkpoint(self, seq):
+        self.checkpoints(name=self.signatures.TABLE_NAME, seq=seq).upsert()
+
+    def rebuild(self):
+        """
+        Index every open task from scratch.
+
+        Returns
+        -------
+        count : int
+            The number of the indexed tasks.
+        """
+        backend = Storage.backend()
+        primary_key = self.model.PRIMARY_KEY
+        count = 0
+        backend.require_change_feed('The index of the similar tasks')
+        with backend.transaction():
+            seq = self.model.last_change_seq()
+            backend.drop_table(self.signatures)
+            backend.create_table(self.signatures)
+            last = None
+            while True:
+                condition = dict(self.CONDITION)
+                if last is not None:
+                    condition[primary_key] = Compare('>', last)
+                records = self.model.find_all(
+                    condition, order_by=primary_key, size=self.BATCH_SIZE)
+                if not records:
+                    break
+                self._index(records)
+                count += len(records)
+                last = records[-1][primary_key]
+            self._checkpoint(seq)
+        return count
+
+    def refresh(self):
+        """
+        Index the tasks which have changed since the last refresh.
+
+        Returns
+        -------
+        count : int
+            The number of the tasks which are indexed again.
+        """
+        Storage.backend().require_change_feed('The index of the similar tasks')
+        with self.model.transaction():
+            checkpoint = self.checkpoints.find(self.signatures.TABLE_NAME)
+            if not checkpoint:
+                return self.rebuild()
+            seq = checkpoint[0].seq
+            if self.model.last_change_seq() < seq or seq + 1 < self.model.first_change_seq():
+                return self.rebuild()
+            count = 0
+            while True:
+                changes = self.model.changes_since(seq, self.BATCH_SIZE)
+                if not changes:
+                    break
+                changed = {
+                    c.primary_key for c in changes
+                    if c.op != 'update' or 'text' in c.columns or
+                    any(k in c.columns for k in self.CONDITION)}
+                records = []
+                for primary_key in sorted(changed):
+                    self._unindex(primary_key)
+                    record = self.model.find(primary_key)
+                    if record and all(record[0][k] == v for k, v in self.CONDITION.items()):
+                        records.append(record[0])
+                self._index(records)
+                count += len(changed)
+                seq = changes[-1].seq
+            if seq != checkpoint[0].seq:
+                self._checkpoint(seq)
+        return count
+
+    def similar(self, text, exclude=None):
+        """
+        The open tasks whose text is similar to a text.
+
+        Parameters
+        ----------
+        text : str
+            The text of a candidate task.
+        exclude : Filed object default type or None
+            The primary key of a task which is not returned, e.g. the
+            candidate task itself.
+
+        Returns
+        -------
+        similar : list(tuple)
+            The tasks with their similarity, the most similar first.
+        """
+        grams = shingles(text)
+        candidates = set()
+        for bucket in buckets(grams):
+            candidates.update(
+                row[self.key] for row in self.signatures.find_all({'bucket': bucket}) or [])
+        candidates.discard(exclude)
+        result = []
+        for primary_key in sorted(candidates):
+            record = self._find(primary_key)
+            if record:
+                score = similarity(grams, shingles(record.text))
+                if score >= self.threshold:
+                    result.append((record, score))
+        result.sort(key=lambda item: -item[1])
+        return result
+
+    def groups(self):
+        """
+        The groups of the open tasks which are similar to each other.
+
+        The tasks which share a bucket are compared, and a task joins the
+        group of a task it is similar to, so a group may chain tasks which
+        are each similar to the next one.
+
+        Returns
+        -------
+        groups : list(list(object))
+            The tasks of every group of two or more tasks, by primary key.
+        """
+        records = {}
+        grams = {}
+        parent = {}
+
+        def root(primary_key):
+            while parent.get(primary_key, primary_key) != primary_key:
+                primary_key = parent[primary_key]
+            return primary_key
+
+        def grams_of(primary_key):
+            if primary_key not in grams:
+                record = self._find(primary_key)
+                records[primary_key] = record
+                grams[primary_key] = shingles(record.text) if record else set()
+            return grams[primary_key]
+
+        for members in Storage.backend().collisions(self.signatures, 'bucket', self.key):
+            # A member is compared with a task of every group which the
+            # bucket has met, not with every member, so a bucket of many
+            # equal texts costs a comparison per member.
+            roots = []
+            for member in sorted(members):
+                if not grams_of(member):
+                    # A removed task or a task out of the condition.
+                    continue
+                member_root = root(member)
+                for other in roots:
+                    if root(other) == member_root:
+                        break
+                    if similarity(grams_of(member), grams_of(other)) >= self.threshold:
+                        # The group is named by its lowest primary key.
+                        first, second = sorted((member_root, root(other)))
+                        parent[second] = first
+                        break
+                else:
+                    roots.append(member)
+        groups = {}
+        for primary_key in parent:
+            groups.setdefault(root(primary_key), [root(primary_key)]).append(primary_key)
+        return [
+            [records[k] for k in sorted(group)]
+            for _, group in sorted(groups.items())]
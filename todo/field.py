@@ -1,9 +1,39 @@
 # -*- coding: utf-8 -*-
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # The texts are compressed by zlib only.
+    zstandard = None
+
+# The first byte of a compressed text tells its codec.
+MARKERS = {'zlib': b'\x01', 'zstd': b'\x02'}
+
+
+def decompress(value):
+    """
+    Decompress a text which `CompressedTextField` has stored as a marker
+    byte and the compressed UTF-8 bytes.
+    """
+    marker, data = value[:1], value[1:]
+    if marker == MARKERS['zlib']:
+        return zlib.decompress(data).decode()
+    if marker == MARKERS['zstd']:
+        if zstandard is None:
+            raise ValueError('The text is compressed by zstd, install zstandard to read it.')
+        return zstandard.ZstdDecompressor().decompress(data).decode()
+    raise ValueError('{!r} is not the marker of a compressed text.'.format(marker))
+
 
 class Field(object):
     """
     Base class of SQL column type class.
+
+    `python_type` converts the values read from the database, None keeps
+    the values as sqlite3 returns them.
     """
+    python_type = None
 
     def __init__(self, column_type, primary_key, default):
         """
@@ -85,6 +115,8 @@ class BooleanField(Field):
     """
     Class of BOOLEAN column type.
     """
+    python_type = bool
+
     def __init__(self, column_type='BOOLEAN', default=False, primary_key=False):
         """
         Parameters
@@ -116,3 +148,53 @@ class FloatField(Field):
             The default value of column
         """
         super(FloatField, self).__init__(column_type, primary_key, default)
+
+
+class CompressedTextField(TextField):
+    """
+    Class of TEXT column type whose long values are stored compressed.
+
+    A text of `threshold` characters or more is stored as a BLOB of a
+    marker byte and its compressed UTF-8 bytes when that is shorter, the
+    other texts as TEXT, so the column type does not change and the rows
+    of the short texts are read as before. The SQLite backend compresses
+    the texts which it writes, and a record read from it keeps the BLOB
+    until the text is read, see `CompressedTexts`. A condition on the
+    column would not match the compressed texts, the queries reject it.
+    """
+    def __init__(self, column_type='TEXT', default=None, primary_key=False,
+                 threshold=512, codec='zlib'):
+        """
+        Parameters
+        ---–––––––
+        column_type : str
+            Type of column type.
+        primary_key : bool
+            Whether column type is primary key
+        default : str or None
+            The default value of column
+        threshold : int
+            The length of the shortest text which is compressed.
+        codec : str
+            'zlib' or 'zstd', zstd needs the `zstandard` package.
+        """
+        super(CompressedTextField, self).__init__(column_type, default, primary_key)
+        if codec not in MARKERS:
+            raise ValueError('The codec of a compressed text is zlib or zstd.')
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('The zstd codec needs the zstandard package.')
+        self.threshold = threshold
+        self.codec = codec
+
+    def compress(self, value):
+        """
+        The value to store of a text, a BLOB if it is compressed.
+        """
+        if value.__class__ is not str or len(value) < self.threshold:
+            return value
+        data = value.encode()
+        if self.codec == 'zstd':
+            packed = MARKERS['zstd'] + zstandard.ZstdCompressor().compress(data)
+        else:
+            packed = MARKERS['zlib'] + zlib.compress(data)
+        return packed if len(packed) < len(data) else value
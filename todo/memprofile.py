@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager, nullcontext
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows has no `resource`, the peak RSS is not reported there.
+    resource = None
+
+
+def peak_rss():
+    """
+    The peak resident set size of the process in bytes, or None.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryProfiler(object):
+    """
+    Memory profile of the phases of a call with `tracemalloc`.
+
+    A phase, e.g. 'fetch', 'convert' or 'render', takes a snapshot of the
+    traced allocations when it starts and when it ends. The report lists
+    the bytes every phase has allocated and still holds, the peak inside
+    it and the bytes per row, and the code lines which have allocated the
+    most in the phases.
+
+    Example
+    -------
+    >>> PROFILER.enable()
+    >>> with PROFILER.phase('fetch') as phase:
+    ...     result = Todo.find_all()
+    ...     phase['rows'] = len(result)
+    >>> print(PROFILER.report())
+    """
+    NULL_PHASE = nullcontext()
+    # The allocations of the profiler itself are not reported.
+    FILTERS = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    )
+
+    def __init__(self, top=10):
+        """
+        Parameters
+        ----------
+        top : int
+            The number of the allocation sites in the report.
+        """
+        self.top = top
+        self.enabled = False
+        self.phases = []
+
+    def enable(self):
+        """
+        Start tracing the allocations.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop tracing the allocations.
+        """
+        tracemalloc.stop()
+        self.enabled = False
+
+    def phase(self, name, rows=None):
+        """
+        A context manager which profiles the block as a phase.
+
+        The block gets a dict of the phase, or None if the profiler is not
+        enabled, the rows of the phase can be set to its 'rows' item.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase.
+        rows : int or None
+            The number of the rows which the phase handles.
+        """
+        if not self.enabled:
+            return self.NULL_PHASE
+        return self._phase(name, rows)
+
+    @contextmanager
+    def _phase(self, name, rows):
+        phase = {'name': name, 'rows': rows}
+        before = tracemalloc.take_snapshot()
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield phase
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            phase['allocated'] = current - start
+            phase['peak'] = peak - start
+            # The snapshots are filtered after they are taken, the filters
+            # allocate too.
+            phase['sites'] = after.filter_traces(self.FILTERS).compare_to(
+                before.filter_traces(self.FILTERS), 'lineno')[:self.top]
+            self.phases.append(phase)
+
+    def bytes_per_row(self, name):
+        """
+        The bytes which the phases of a name hold per row, or None.
+        """
+        phases = [p for p in self.phases if p['name'] == name and p['rows']]
+        if not phases:
+            return None
+        return sum(p['allocated'] for p in phases) / sum(p['rows'] for p in phases)
+
+    def report(self):
+        """
+        Text report of the phases, the peak RSS and the top allocation sites.
+        """
+        lines = ['{:<10} {:>10} {:>14} {:>10} {:>10}'.format(
+            'phase', 'rows', 'allocated KiB', 'peak KiB', 'bytes/row')]
+        for phase in self.phases:
+            rows = phase['rows']
+            lines.append('{:<10} {:>10} {:>14.1f} {:>10.1f} {:>10}'.format(
+                phase['name'], '' if rows is None else rows,
+                phase['allocated'] / 1024, phase['peak'] / 1024,
+                '{:.1f}'.format(phase['allocated'] / rows) if rows else ''))
+        rss = peak_rss()
+        if rss is not None:
+            lines.append('Peak RSS: {:.1f} MiB'.format(rss / 1024 / 1024))
+        sites = {}
+        for phase in self.phases:
+            for stat in phase['sites']:
+                frame = stat.traceback[0]
+                key = '{}:{}'.format(frame.filename, frame.lineno)
+                size, count = sites.get(key, (0, 0))
+                sites[key] = (size + stat.size_diff, count + stat.count_diff)
+        top = sorted(sites.items(), key=lambda item: -item[1][0])[:self.top]
+        if top:
+            lines.append('Top allocation sites:')
+            for key, (size, count) in top:
+                lines.append('  {}: {:.1f} KiB in {} blocks'.format(key, size / 1024, count))
+        return '\n'.join(lines)
+
+
+# The memory profiler of the process.
+PROFILER = MemoryProfiler()
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+import re
+
+# The constraints which may follow the type name of a column definition.
+CONSTRAINT = re.compile(
+    r'\s+(NOT\s+NULL|NULL|DEFAULT|UNIQUE|CHECK|REFERENCES|COLLATE|PRIMARY)\b',
+    re.IGNORECASE)
+
+
+def parse_column_type(column_type):
+    """
+    Split a column definition into its type name and NOT NULL flag.
+
+    Parameters
+    ----------
+    column_type : str
+        The column type of a `Field`, e.g. 'TEXT NOT NULL'.
+
+    Returns
+    -------
+    type_name : str
+        The upper case type name, e.g. 'TEXT'.
+    not_null : bool
+        Whether the column has a NOT NULL constraint.
+    """
+    match = CONSTRAINT.search(column_type)
+    type_name = column_type[:match.start()] if match else column_type
+    not_null = bool(re.search(r'NOT\s+NULL', column_type, re.IGNORECASE))
+    return type_name.strip().upper(), not_null
+
+
+def type_affinity(type_name):
+    """
+    SQLite type affinity of a type name, the target of CAST expressions.
+    """
+    if 'INT' in type_name:
+        return 'INTEGER'
+    if 'CHAR' in type_name or 'CLOB' in type_name or 'TEXT' in type_name:
+        return 'TEXT'
+    if not type_name or 'BLOB' in type_name:
+        return 'BLOB'
+    if 'REAL' in type_name or 'FLOA' in type_name or 'DOUB' in type_name:
+        return 'REAL'
+    return 'NUMERIC'
+
+
+def sql_literal(value):
+    """
+    SQL literal of a default value.
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+class Migration(object):
+    """
+    Versioned schema migration of the tables of models.
+
+    The schema version of a database is stored in `PRAGMA user_version`.
+    When it is older than the version of the models, every table is
+    compared with the `COLUMN_TO_FILED` metadata of its model:
+
+    - a missing table is left to ``create_table()``
+    - new columns which need no rewrite are added with 'ALTER TABLE ADD
+      COLUMN'
+    - dropped columns and columns whose type, NOT NULL constraint or
+      primary key changed make the table be rebuilt
+    - the indexes which are no longer in the `INDEXES` or `UNIQUE_INDEXES`
+      of the model are dropped, ``create_table()`` creates the new ones
+
+    A rebuild copies the table into a new one in batches of `batch_size`
+    rows, each in its own short transaction, while triggers mirror the
+    writes to the rows already copied. The progress is recorded in the
+    `_migration` table, so a rebuild which is interrupted resumes where
+    it stopped. The new table replaces the old one, with its indexes and
+    triggers, in a single short transaction and the old rows are deleted
+    in batches afterwards.
+
+    The triggers which other code has put on a table, e.g. the tombstone
+    trigger of `Sync`, are kept, a rebuilt table gets them again.
+
+    Without `rebuild` only the columns are added and the indexes dropped,
+    a migration which has to rebuild or clean up a table raises ValueError.
+    """
+    STATE_TABLE = '_migration'
+
+    def __init__(self, models, version, backend, batch_size=1000, progress=None,
+                 rebuild=True):
+        """
+        Parameters
+        ----------
+        models : list(type)
+            The model classes.
+        version : int
+            The schema version of the models.
+        backend : SQLiteBackend
+            The backend of the database.
+        batch_size : int
+            The number of rows copied or deleted per transaction.
+        progress : function or None
+            Called with a message about every step of the migration.
+        rebuild : bool
+            Whether the tables may be rebuilt, otherwise only additive
+            changes are applied.
+        """
+        self.models = models
+        self.version = version
+        self.backend = backend
+        self.connection = backend.connection
+        self.batch_size = batch_size
+        self.progress = progress
+        self.rebuild_tables = rebuild
+
+    def _report(self, message):
+        if self.progress:
+            self.progress(message)
+
+    def _query(self, sql, args=()):
+        cursor = self.connection.execute(sql, args, autocommit=False)
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
+    def current_version(self):
+        """
+        Return the schema version of the database.
+        """
+        return self._query('PRAGMA user_version')[0][0]
+
+    def table_columns(self, table):
+        """
+        Return the columns of a table.
+
+        Returns
+        -------
+        columns : dict
+            Column names with their (type name, not null, primary key).
+        """
+        columns = dict()
+        for _, name, type_name, not_null, _, pk in self._query(
+                'PRAGMA table_info({})'.format(table)):
+            columns[name] = (type_name.upper(), bool(not_null), bool(pk))
+        return columns
+
+    def plan(self, model):
+        """
+        Compare the table of a model with its fields.
+
+        Returns
+        -------
+        operation : str or None
+            'rebuild', 'add' or None when the table is missing or up to date.
+        columns : list(str)
+            The columns to add of the 'add' operation.
+        """
+        existing = self.table_columns(model.TABLE_NAME)
+        if not existing:
+            return None, []
+        added = []
+        for name, field in model.COLUMN_TO_FILED.items():
+            type_name, not_null = parse_column_type(field.column_type)
+            if name not in existing:
+                if field.primary_key or (not_null and field.default is None) \
+                        or callable(field.default):
+                    return 'rebuild', []
+                added.append(name)
+            elif existing[name] != (type_name, not_null, field.primary_key):
+                return 'rebuild', []
+        if set(existing) - set(model.COLUMN_TO_FILED):
+            return 'rebuild', []
+        return ('add', added) if added else (None, [])
+
+    def migrate(self):
+        """
+        Migrate the tables when the database is older than the models.
+
+        Returns
+        -------
+        migrated : bool
+            Whether the database is migrated.
+        """
+        self._create_state_table()
+        if self.current_version() >= self.version and not self._pending():
+            return False
+        if not self.rebuild_tables:
+            tables = self.rebuilt_tables()
+            if tables:
+                raise ValueError(
+                    'The database has to rebuild the table(s) {} of the schema version {}, '
+                    'run `todo migrate` first.'.format(', '.join(tables), self.version))
+        for model in self.models:
+            operation, columns = self.plan(model)
+            if operation == 'add':
+                self.add_columns(model, columns)
+            elif operation == 'rebuild' or self._pending(model.TABLE_NAME):
+                self.rebuild(model)
+            self._drop_old_table(model)
+            self._drop_old_indexes(model)
+        # The version is written once the new indexes are created, e.g. a
+        # unique index which the stored records violate.
+        for model in self.models:
+            self.backend.create_table(model)
+        with self.connection.transaction():
+            self.connection.execute(
+                'PRAGMA user_version = {}'.format(int(self.version))).close()
+        self._report('Schema version is {}.'.format(self.version))
+        return True
+
+    def rebuilt_tables(self):
+        """
+        Return the names of the tables which the migration rebuilds or
+        whose rebuild it finishes, empty if the database is up to date.
+        """
+        self._create_state_table()
+        if self.current_version() >= self.version and not self._pending():
+            return []
+        return [model.TABLE_NAME for model in self.models
+                if self.plan(model)[0] == 'rebuild' or self._pending(model.TABLE_NAME)
+                or self._old_table_exists(model)]
+
+    def _create_state_table(self):
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS {} (table_name TEXT PRIMARY KEY, '
+            'last_rowid INTEGER NOT NULL)'.format(self.STATE_TABLE)).close()
+
+    def _pending(self, table=None):
+        """
+        Whether a rebuild of the table (of any table if None) is unfinished.
+        """
+        if table is None:
+            return bool(self._query('SELECT 1 FROM {}'.format(self.STATE_TABLE)))
+        return bool(self._query(
+            'SELECT 1 FROM {} WHERE table_name=?'.format(self.STATE_TABLE), [table]))
+
+    def add_columns(self, model, columns):
+        """
+        Add the columns to the table of the model.
+
+        The triggers of the model are dropped, ``create_table()`` creates
+        them again with the new columns.
+        """
+        with self.connection.transaction():
+            self._drop_triggers(model)
+            for name in columns:
+                field = model.COLUMN_TO_FILED[name]
+                sql = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    model.TABLE_NAME, name, field.column_type)
+                if field.default is not None and \
+                        not re.search(r'\bDEFAULT\b', field.column_type, re.IGNORECASE):
+                    sql += ' DEFAULT {}'.format(sql_literal(field.default))
+                self.connection.execute(sql).close()
+                self._report('Added column {}.{}.'.format(model.TABLE_NAME, name))
+
+    def _expressions(self, model, existing, prefix=''):
+        """
+        Expressions of the new columns computed from the old row.
+        """
+        expressions = []
+        for name, field in model.COLUMN_TO_FILED.items():
+            if name not in existing:
+                default = None if callable(field.default) else field.default
+                expressions.append(sql_literal(default))
+                continue
+            type_name, _ = parse_column_type(field.column_type)
+            expression = prefix + name
+            if type_affinity(type_name) != type_affinity(existing[name][0]):
+                expression = 'CAST({} AS {})'.format(
+                    expression, type_affinity(type_name))
+            expressions.append(expression)
+        return expressions
+
+    def rebuild(self, model):
+        """
+        Rebuild the table of the model with a batched and resumable copy.
+        """
+        table = model.TABLE_NAME
+        new_table = '{}__migrate'.format(table)
+        columns = ', '.join(model.COLUMNS)
+        if not self._pending(table):
+            existing = self.table_columns(table)
+            self._start_rebuild(model, new_table, existing)
+        existing = self.table_columns(table)
+        select = ', '.join(self._expressions(model, existing))
+        copied = 0
+        while True:
+            with self.connection.transaction():
+                last_rowid = self._query(
+                    'SELECT last_rowid FROM {} WHERE table_name=?'.format(
+                        self.STATE_TABLE), [table])[0][0]
+                rowid = self._query(
+                    'SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM {} '
+                    'WHERE rowid > ? ORDER BY rowid LIMIT ?)'.format(table),
+                    [last_rowid, self.batch_size])[0]
+                if not rowid[1]:
+                    break
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO {} ({}) SELECT {} FROM {} '
+                    'WHERE rowid > ? AND rowid <= ?'.format(
+                        new_table, columns, select, table),
+                    [last_rowid, rowid[0]]).close()
+                self.connection.execute(
+                    'UPDATE {} SET last_rowid=? WHERE table_name=?'.format(
+                        self.STATE_TABLE), [rowid[0], table]).close()
+            copied += rowid[1]
+            self._report('Copied {} rows of {}.'.format(copied, table))
+        self._swap(model, new_table)
+
+    def _start_rebuild(self, model, new_table, existing):
+        """
+        Create the new table and the triggers which mirror the writes.
+        """
+        table = model.TABLE_NAME
+        columns = ', '.join(model.COLUMNS)
+        old_values = self._expressions(model, existing, 'OLD.')
+        key = ' AND '.join(
+            '{} = {}'.format(k, old_values[model.COLUMNS.index(k)])
+            for k in model.PRIMARY_KEYS)
+        new_values = ', '.join(self._expressions(model, existing, 'NEW.'))
+        copied = '(SELECT last_rowid FROM {} WHERE table_name={})'.format(
+            self.STATE_TABLE, sql_literal(table))
+        delete = 'DELETE FROM {} WHERE {};'.format(new_table, key)
+        insert = 'INSERT OR REPLACE INTO {} ({}) VALUES ({});'.format(
+            new_table, columns, new_values)
+        with self.connection.transaction():
+            self.connection.execute('DROP TABLE IF EXISTS {}'.format(new_table)).close()
+            self.connection.execute(self.backend.table_sql(model, new_table)).close()
+            self.connection.execute(
+                'INSERT INTO {} (table_name, last_rowid) VALUES (?, 0)'.format(
+                    self.STATE_TABLE), [table]).close()
+            triggers = [
+                ('insert', 'AFTER INSERT', 'NEW.rowid <= ' + copied, insert),
+                ('update', 'AFTER UPDATE', 'OLD.rowid <= ' + copied, delete + ' ' + insert),
+                ('delete', 'AFTER DELETE', 'OLD.rowid <= ' + copied, delete),
+            ]
+            for suffix, event, when, body in triggers:
+                self.connection.execute(
+                    'CREATE TRIGGER {0}_migrate_{1} {2} ON {0} WHEN {3} '
+                    'BEGIN {4} END'.format(table, suffix, event, when, body)).close()
+        self._report('Rebuilding table {}.'.format(table))
+
+    def _triggers(self, table):
+        return self._query(
+            "SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name=?",
+            [table])
+
+    def _owns_trigger(self, model, name):
+        """
+        Whether a trigger is one of the counters, the change feed or the
+        rebuild of the model, they are named after the table and a column
+        or 'changes' or 'migrate'.
+        """
+        words = {'changes', 'migrate'} | set(model.COLUMNS) | set(
+            self.table_columns(model.TABLE_NAME))
+        return any(name.startswith('{}_{}_'.format(model.TABLE_NAME, w)) for w in words)
+
+    def _drop_triggers(self, model):
+        """
+        Drop the triggers which the model owns, see `_owns_trigger()`.
+        """
+        for name, _ in self._triggers(model.TABLE_NAME):
+            if self._owns_trigger(model, name):
+                self.connection.execute('DROP TRIGGER {}'.format(name)).close()
+
+    def _drop_old_indexes(self, model):
+        """
+        Drop the indexes of the table which the model no longer lists.
+        """
+        names = {self.backend.index_name(model, columns) for columns in model.INDEXES}
+        names.update(self.backend.index_name(model, columns, unique=True)
+                     for columns in model.UNIQUE_INDEXES)
+        with self.connection.transaction():
+            for (name,) in self._query(
+                    "SELECT name FROM sqlite_master WHERE type='index' "
+                    "AND tbl_name=? AND sql IS NOT NULL", [model.TABLE_NAME]):
+                if name not in names:
+                    self.connection.execute('DROP INDEX {}'.format(name)).close()
+                    self._report('Dropped index {}.'.format(name))
+
+    def _swap(self, model, new_table):
+        """
+        Replace the table by the rebuilt one in a single transaction.
+
+        The indexes, counter and change feed triggers of the table are
+        created in the same transaction, so no write is left uncounted or
+        out of the change feed and no read scans an unindexed table. The
+        other triggers of the old table are created again on the new one.
+        """
+        table = model.TABLE_NAME
+        with self.connection.transaction():
+            self._drop_triggers(model)
+            others = self._triggers(table)
+            for name, _ in others:
+                self.connection.execute('DROP TRIGGER {}'.format(name)).close()
+            for (name,) in self._query(
+                    "SELECT name FROM sqlite_master WHERE type='index' "
+                    "AND tbl_name=? AND sql IS NOT NULL", [table]):
+                self.connection.execute('DROP INDEX {}'.format(name)).close()
+            self.connection.execute(
+                'ALTER TABLE {0} RENAME TO {0}__old'.format(table)).close()
+            self.connection.execute(
+                'ALTER TABLE {} RENAME TO {}'.format(new_table, table)).close()
+            self.backend.create_table(model)
+            for _, sql in others:
+                self.connection.execute(sql).close()
+            self.connection.execute(
+                'DELETE FROM {} WHERE table_name=?'.format(self.STATE_TABLE),
+                [table]).close()
+        self._report('Rebuilt table {}.'.format(table))
+
+    def _old_table_exists(self, model):
+        """
+        Whether the replaced table of a rebuild is not dropped yet.
+        """
+        return bool(self._query(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            ['{}__old'.format(model.TABLE_NAME)]))
+
+    def _drop_old_table(self, model):
+        """
+        Delete the rows of the replaced table in batches and drop it.
+        """
+        if not self._old_table_exists(model):
+            return
+        old_table = '{}__old'.format(model.TABLE_NAME)
+        while True:
+            with self.connection.transaction():
+                cursor = self.connection.execute(
+                    'DELETE FROM {0} WHERE rowid IN '
+                    '(SELECT rowid FROM {0} LIMIT ?)'.format(old_table),
+                    [self.batch_size])
+                count = cursor.rowcount
+                cursor.close()
+            if not count:
+                break
+        with self.connection.transaction():
+            self.connection.execute('DROP TABLE {}'.format(old_table)).close()
+
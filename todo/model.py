@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
-from .field import Field
-from .utility import SQLConnection
+from .field import CompressedTextField, Field, decompress
+from .memprofile import PROFILER
+from .storage import Compare, Storage
+from sqlite3 import IntegrityError
 
 class ModelMetaclass(type):
     """
@@ -16,10 +18,21 @@ class ModelMetaclass(type):
         Definition Class Attributes:
         ----------------------------
             PRIMARY_KEY : Store the attribute name which is belong to
-                        `Field` object with set argument (primary_key = True)
+                        `Field` object with set argument (primary_key = True),
+                        a tuple of the names if several fields set it (a
+                        composite primary key, e.g. of a join model).
+            PRIMARY_KEYS : A tuple of the primary key attribute names.
             COLUMN_TO_FILED : A dict which storing the relationship of the class
                        attribute name and it's bounded `Field` object. 
             TABLE_NAME : The name of table which be took from the class name.
+            COLUMNS : A tuple of the column names, the order of the columns
+                       of the 'SELECT' statement and of the stored records.
+            ROW_FACTORY : A function compiled for the class which builds an
+                       instance from a record tuple, it has the signature of
+                       the `row_factory` of `sqlite3.Cursor`.
+            COMPRESSED_COLUMNS : A dict of the attribute names of the
+                       `CompressedTextField` objects and the objects, a
+                       class which has some also inherits `CompressedTexts`.
 
         Parametes:
         ----------
@@ -39,20 +52,17 @@ class ModelMetaclass(type):
         if name == 'Model':
             return type.__new__(cls, name, bases, attrs)
         table_name = name
-        primary_key = None
+        primary_keys = []
         fields = []
         column_to_filed = dict()
         for k, v in attrs.items():
             if isinstance(v, Field):
                 column_to_filed[k] = v
                 if v.primary_key:
-                    if primary_key:
-                        raise NameError('Primary key should only be one.')
-                    else:
-                        primary_key = k
+                    primary_keys.append(k)
                 else:
                     fields.append(k)
-        if primary_key is None:
+        if not primary_keys:
             raise NameError('Primary key not found.')
         # Delete the class attributes which is belong to `Field` object.
         # Because the class attributes may be overide by the same name of 
@@ -60,10 +70,60 @@ class ModelMetaclass(type):
         for key in column_to_filed:
             attrs.pop(key)
 
-        attrs['PRIMARY_KEY'] = primary_key
+        attrs['PRIMARY_KEY'] = (
+            primary_keys[0] if len(primary_keys) == 1 else tuple(primary_keys))
+        attrs['PRIMARY_KEYS'] = tuple(primary_keys)
         attrs['COLUMN_TO_FILED'] = column_to_filed
         attrs['TABLE_NAME'] = table_name
-        return type.__new__(cls, name, bases, attrs)
+        attrs['COLUMNS'] = tuple(column_to_filed)
+        attrs['COMPRESSED_COLUMNS'] = {
+            k: v for k, v in column_to_filed.items() if isinstance(v, CompressedTextField)}
+        if attrs['COMPRESSED_COLUMNS'] and not any(
+                issubclass(b, CompressedTexts) for b in bases):
+            bases = (CompressedTexts,) + bases
+        new_class = type.__new__(cls, name, bases, attrs)
+        new_class.ROW_FACTORY = cls.compile_row_factory(new_class)
+        return new_class
+
+    @staticmethod
+    def compile_row_factory(model):
+        """
+        Compile the function which builds an instance of the model from a
+        record tuple.
+
+        The generated function assigns every item of the tuple to its
+        column name directly, without building intermediate dicts of
+        keyword arguments, and converts the values of the fields which
+        have a `python_type`, e.g. SQLite 0/1 to `bool` for `BooleanField`.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+
+        Returns
+        -------
+        row_factory : function
+            A function of ``(cursor, row)`` which returns the instance.
+        """
+        namespace = {'_new': dict.__new__, '_model': model}
+        lines = ['def row_factory(cursor, row):', '    self = _new(_model)']
+        for i, column in enumerate(model.COLUMNS):
+            python_type = model.COLUMN_TO_FILED[column].python_type
+            if python_type is None:
+                lines.append('    self[{!r}] = row[{}]'.format(column, i))
+            else:
+                namespace['_type_{}'.format(i)] = python_type
+                lines.append('    value = row[{}]'.format(i))
+                lines.append(
+                    '    self[{!r}] = value if value is None else _type_{}(value)'.format(
+                        column, i))
+        lines.append('    return self')
+        # The file name tells the lines of the function in tracebacks and
+        # in the allocation sites of `--memprofile`.
+        exec(compile('\n'.join(lines), '<{}.ROW_FACTORY>'.format(model.__name__), 'exec'),
+             namespace)
+        return namespace['row_factory']
 
 
 class Model(dict, metaclass=ModelMetaclass):
@@ -84,6 +144,9 @@ class Model(dict, metaclass=ModelMetaclass):
     For that the `COLUMN_TO_FILED` attribute what create a `ModelMetaclass`
     will storing the relationship of attribute with it's `Field` object
 
+    The records are stored in the backend which `Storage.backend()`
+    returns, the SQLite database of `SQLConnection` by default.
+
     Class Methods for DB Manipulation
     ---------------------------------
 
@@ -92,6 +155,15 @@ class Model(dict, metaclass=ModelMetaclass):
                             'WHERE' statement
     - ``Model.drop_table()``:  issues 'DROP TABLE' statement
     - ``Model.find()``: issues 'SELECT' and 'WHERE' statement with primary key.
+    - ``Model.count()``, ``Model.min()``, ``Model.max()``: issues aggregate
+                            'SELECT' statement with optional 'WHERE'
+    - ``Model.group_count()``: issues 'SELECT COUNT(*) ... GROUP BY' statement
+    - ``Model.counters()``: reads the trigger maintained counter rows of
+                            a column listed in `COUNTER_COLUMNS`
+    - ``Model.transaction()``: groups the statements of a block in a
+                            transaction
+    - ``Model.changes_since()``: reads the change feed of the table
+    - ``Model.prune_changes()``: deletes the old changes of the feed
 
     Instance Methods for DB Manipulation
     ------------------------------------
@@ -99,7 +171,76 @@ class Model(dict, metaclass=ModelMetaclass):
     - ``instance.update()``: issues 'UPDATE' statement
     - ``instance.save()``: issues 'INSERT' statement
     - ``instance.remove()``: issues 'DELETE' statement
+    - ``instance.upsert()``, ``Model.bulk_upsert()``: issue
+                            'INSERT ... ON CONFLICT' statement
+
+    Counter Columns
+    ---------------
+
+    The columns listed in the `COUNTER_COLUMNS` class attribute get a row
+    per distinct value which the storage backend keeps up to date on every
+    write (the SQLite backend uses triggers and a `<TABLE_NAME>Counter`
+    table), so reading how many records hold a value does not depend on
+    the size of the table. A tuple of columns, e.g.
+    ``('list_id', 'is_completed')``, gets a row per distinct tuple of
+    their values.
+
+    Change Feed
+    -----------
+
+    Every write is also appended to the change feed of the table, which
+    `changes_since()` reads, unless the model sets ``CHANGE_FEED = False``,
+    e.g. an index table which is derived from another table. The feed is
+    kept until `prune_changes()` deletes its old changes, a consumer whose
+    last sequence number is below ``first_change_seq() - 1`` has to read
+    the table again.
+
+    Indexes
+    -------
+
+    `INDEXES` lists the secondary indexes of the table as tuples of column
+    names, e.g. ``INDEXES = (('is_completed', 'created_at'),)``, a column
+    may carry its order like 'created_at DESC' or be an expression of the
+    columns like 'update_at - created_at'. `UNIQUE_INDEXES` lists the
+    columns which no two records may share, e.g. ``(('name',),)``, the
+    SQLite backend creates a unique index of them and `find_or_create()`
+    adds a record of them at most once.
+
+    Upserts
+    -------
+
+    `upsert()` and `bulk_upsert()` store records which may already exist.
+    The 'update-newer' conflict mode overwrites a stored record only when
+    the `VERSION_COLUMN` of the new record is greater, e.g.
+    ``VERSION_COLUMN = 'update_at'``, so a feed replayed out of order
+    keeps the newest version.
+
+    Compressed Texts
+    ----------------
+
+    A `CompressedTextField` column stores its long texts compressed in
+    the SQLite backend. The records read from it keep the compressed
+    bytes until the text is first read, ``record.text``, ``record['text']``,
+    ``dict(record)`` and ``json.dumps(record)`` all read the decompressed
+    text, see `CompressedTexts`. The column can not be compared in a
+    query, a condition on it raises ValueError.
+
+    Relations
+    ---------
+
+    Several fields with ``primary_key=True`` make a composite primary key,
+    its value is the tuple of their values, e.g. ``TodoTag.find((1, 2))``.
+    A join model with a composite key relates two models by a
+    `ManyToMany` attribute, and a column which stores the primary key of
+    a parent record makes the records a `Tree`.
     """
+    COUNTER_COLUMNS = ()
+    INDEXES = ()
+    UNIQUE_INDEXES = ()
+    VERSION_COLUMN = None
+    CHANGE_FEED = True
+    COMPRESSED_COLUMNS = {}
+
     def __init__(self, **kwargs):
         """
         Inherit dict object.
@@ -162,42 +303,120 @@ class Model(dict, metaclass=ModelMetaclass):
         SELECT SQL statement
         """
         return 'SELECT {} FROM {}'.format(
-            ', '.join([key for key in cls.COLUMN_TO_FILED]),
+            ', '.join(cls.COLUMNS),
             cls.TABLE_NAME
         )
 
+    @classmethod
+    def _primary_key_of(cls, values):
+        """
+        The primary key of a record tuple, a tuple for a composite key.
+        """
+        if len(cls.PRIMARY_KEYS) == 1:
+            return values[cls.COLUMNS.index(cls.PRIMARY_KEY)]
+        return tuple(values[cls.COLUMNS.index(k)] for k in cls.PRIMARY_KEYS)
+
+    def _primary_key_value(self):
+        """
+        The primary key of the instance, a tuple for a composite key.
+        """
+        if len(self.PRIMARY_KEYS) == 1:
+            return self._get_value_or_default(self.PRIMARY_KEY)
+        return tuple(self._get_value_or_default(k) for k in self.PRIMARY_KEYS)
+
     @classmethod
     def _delete(cls):
         """
         DELETE SQL statement
         """
-        return 'DELETE FROM {} WHERE {}=?'.format(
+        return 'DELETE FROM {} WHERE {}'.format(
             cls.TABLE_NAME,
-            cls.PRIMARY_KEY
+            ' AND '.join('{}=?'.format(k) for k in cls.PRIMARY_KEYS)
         )
 
+    @classmethod
+    def _check_columns(cls, columns):
+        """
+        Raise ValueError if a query compares a `CompressedTextField`
+        column, its compressed texts would never match.
+        """
+        for column in columns or ():
+            if column in cls.COMPRESSED_COLUMNS:
+                raise ValueError(
+                    'The compressed column {}.{} can not be compared in a query.'.format(
+                        cls.TABLE_NAME, column))
+
+    @classmethod
+    def _where(cls, condition):
+        """
+        WHERE SQL statement and its arguments
+
+        Parameters
+        ----------
+        condition : dict or None
+            Column names with condition value, a `Compare` value compares
+            the column with its operator.
+
+        Returns
+        -------
+        sql : str
+            The 'WHERE' statement or an empty string.
+        args : list
+            The arguments of the statement.
+        """
+        if not condition:
+            return '', []
+        terms = []
+        args = []
+        for key, value in condition.items():
+            if isinstance(value, Compare):
+                terms.append('{} {} ?'.format(key, value.op))
+                args.append(value.value)
+            else:
+                terms.append('{}=?'.format(key))
+                args.append(value)
+        return 'WHERE {}'.format(' AND '.join(terms)), args
+
+    @classmethod
+    def _counter_table(cls):
+        """
+        Name of the table storing the counters of `COUNTER_COLUMNS`.
+        """
+        return '{}Counter'.format(cls.TABLE_NAME)
+
+    @classmethod
+    def _changes_table(cls):
+        """
+        Name of the table storing the change feed of the model.
+        """
+        return '{}Changes'.format(cls.TABLE_NAME)
+
     @classmethod
     def create_table(cls):
         """
-        Execute create table SQL statement.
+        Create the table of the model in the storage backend.
         """
-        values = []
-        for key, field in cls.COLUMN_TO_FILED.items():
-            sql = ' '.join(
-                [key, field.column_type, 'PRIMARY KEY' if field.primary_key else ''])
-            values.append(sql)
-        sql = 'CREATE TABLE IF NOT EXISTS {} ({})'.format(cls.TABLE_NAME, ','.join(values))
-        cursor = SQLConnection().execute(sql)
-        cursor.close()
+        Storage.backend().create_table(cls)
 
     @classmethod
     def drop_table(cls):
         """
-        Execute drop table SQL statement.
+        Drop the table of the model in the storage backend.
+        """
+        Storage.backend().drop_table(cls)
+
+    @classmethod
+    def transaction(cls):
+        """
+        Return a context manager which runs the block in a transaction.
+
+        Example
+        -------
+        >>> with Todo.transaction():
+        ...     Todo(id=1).remove()
+        ...     Todo(id=2).remove()
         """
-        sql = 'DROP TABLE {}'.format(cls.TABLE_NAME)
-        cursor = SQLConnection().execute(sql)
-        cursor.close()
+        return Storage.backend().transaction()
 
     @classmethod
     def find_all(cls, condition=None, size=None, **kwargs):
@@ -234,23 +453,10 @@ class Model(dict, metaclass=ModelMetaclass):
         [{'id': 2, 'text': 'Hello japan', 'is_completed': False },
          {'id': 1, 'text': 'Hello world', 'is_completed': True }]
         """
-        sql = [cls._select()]
-        args = []
-        if condition:
-            for key, value in condition.items():
-                sql.append('WHERE {}=?'.format(key))
-                args.append(value)
-        order_by = kwargs.get('order_by')
-        if order_by:
-            sql.append('ORDER BY')
-            sql.append(order_by)
-        cursor = SQLConnection().execute(' '.join(sql), args)
-        if size:
-            result = cursor.fetchmany(size)
-        else:
-            result = cursor.fetchall()
-        cursor.close()
-        return cls.convert_result_to_object(result)
+        cls._check_columns(condition)
+        result = Storage.backend().scan(
+            cls, condition, kwargs.get('order_by'), size)
+        return result if result else None
 
     @classmethod
     def find(cls, primary_key):
@@ -259,8 +465,9 @@ class Model(dict, metaclass=ModelMetaclass):
 
         Parameters
         ----------
-        primary_key : Filed object default type
-            The value of primary key
+        primary_key : Filed object default type or tuple
+            The value of primary key, a tuple of the values of a composite
+            primary key.
 
         Returns
         -------
@@ -272,11 +479,193 @@ class Model(dict, metaclass=ModelMetaclass):
         >>> Todo.find(1)
         [{'id': 1, 'text': 'Hello world', 'is_completed': True }]
         """
-        sql = '{} WHERE {} = ?'.format(cls._select(), cls.PRIMARY_KEY)
-        cursor = SQLConnection().execute(sql, [primary_key])
-        result = cursor.fetchmany(1)
-        cursor.close()
-        return cls.convert_result_to_object(result)
+        result = Storage.backend().get(cls, primary_key)
+        return result if result else None
+
+    @classmethod
+    def count(cls, condition=None):
+        """
+        DB Manipulation of 'SELECT COUNT(*)' statement with optional 'WHERE'
+
+        Parameters
+        ----------
+        condition : dict or None
+            Column names with condition value.
+
+        Returns
+        -------
+        count : int
+            The number of records which match the condition.
+
+        Example
+        -------
+        >>> Todo.count({'is_completed': False})
+        2
+        """
+        cls._check_columns(condition)
+        return Storage.backend().aggregate(cls, 'COUNT', '*', condition)
+
+    @classmethod
+    def min(cls, column, condition=None):
+        """
+        DB Manipulation of 'SELECT MIN(column)' statement with optional 'WHERE'
+
+        Parameters
+        ----------
+        column : str
+            The column name.
+        condition : dict or None
+            Column names with condition value.
+
+        Returns
+        -------
+        value : Filed object default type or None
+            The smallest value of the column, None if no record matches.
+
+        Example
+        -------
+        >>> Todo.min('created_at')
+        1530000000.0
+        """
+        cls._check_columns([column] + list(condition or ()))
+        return Storage.backend().aggregate(cls, 'MIN', column, condition)
+
+    @classmethod
+    def max(cls, column, condition=None):
+        """
+        DB Manipulation of 'SELECT MAX(column)' statement with optional 'WHERE'
+
+        Parameters
+        ----------
+        column : str
+            The column name.
+        condition : dict or None
+            Column names with condition value.
+
+        Returns
+        -------
+        value : Filed object default type or None
+            The largest value of the column, None if no record matches.
+
+        Example
+        -------
+        >>> Todo.max('created_at', {'is_completed': True})
+        1530000000.0
+        """
+        cls._check_columns([column] + list(condition or ()))
+        return Storage.backend().aggregate(cls, 'MAX', column, condition)
+
+    @classmethod
+    def group_count(cls, column, condition=None):
+        """
+        DB Manipulation of 'SELECT COUNT(*) ... GROUP BY column' statement
+
+        Parameters
+        ----------
+        column : str
+            The column name to group by.
+        condition : dict or None
+            Column names with condition value.
+
+        Returns
+        -------
+        counts : dict
+            The number of records of every value of the column.
+
+        Example
+        -------
+        >>> Todo.group_count('is_completed')
+        {0: 2, 1: 1}
+        """
+        cls._check_columns([column] + list(condition or ()))
+        return Storage.backend().group_count(cls, column, condition)
+
+    @classmethod
+    def counters(cls, column):
+        """
+        Read the trigger maintained counters of a column.
+
+        Unlike ``Model.group_count()`` this does not scan the table, the
+        column should be listed in `COUNTER_COLUMNS`.
+
+        Parameters
+        ----------
+        column : str or tuple
+            The column name, or the tuple of the column names of a counter
+            of several columns.
+
+        Returns
+        -------
+        counts : dict
+            The number of records of every value of the column, keyed by
+            the tuple of the values for a tuple of columns.
+
+        Example
+        -------
+        >>> Todo.counters('is_completed')
+        {0: 2, 1: 1}
+        >>> Todo.counters(('list_id', 'is_completed'))
+        {(0, 0): 2, (0, 1): 1}
+        """
+        if column not in cls.COUNTER_COLUMNS:
+            raise NameError('Column {} has no counter.'.format(column))
+        return Storage.backend().counters(cls, column)
+
+    @classmethod
+    def changes_since(cls, seq=0, size=None):
+        """
+        Read the change feed of the model after a sequence number.
+
+        Every 'INSERT', 'UPDATE' and 'DELETE' of a record appends a change
+        with a growing sequence number, so a consumer which remembers the
+        last `seq` it has seen reads only the new changes.
+
+        Parameters
+        ----------
+        seq : int
+            The last sequence number which is already consumed.
+        size : int or None
+            The maximum number of changes.
+
+        Returns
+        -------
+        changes : list(Change)
+            Named tuples of (seq, op, primary_key, columns).
+
+        Example
+        -------
+        >>> Todo.changes_since(0)
+        [Change(seq=1, op='insert', primary_key=1, columns=('id', 'text', ...))]
+        """
+        return Storage.backend().changes_since(cls, seq, size)
+
+    @classmethod
+    def last_change_seq(cls):
+        """
+        Return the sequence number of the latest change of the model.
+        """
+        return Storage.backend().last_change_seq(cls)
+
+    @classmethod
+    def first_change_seq(cls):
+        """
+        Return the sequence number of the oldest change of the model which
+        is kept, 0 if none.
+        """
+        return Storage.backend().first_change_seq(cls)
+
+    @classmethod
+    def prune_changes(cls, seq):
+        """
+        Delete the changes of the model up to a sequence number, the latest
+        change is kept.
+
+        Returns
+        -------
+        count : int
+            The number of the deleted changes.
+        """
+        return Storage.backend().prune_changes(cls, seq)
 
     def remove(self):
         """
@@ -292,12 +681,8 @@ class Model(dict, metaclass=ModelMetaclass):
         >>> Todo(id=1).remove()
         True
         """
-        cursor = SQLConnection().execute(
-            self._delete(), [self._get_value_or_default(self.PRIMARY_KEY)])
-        count = cursor.rowcount
-        result = True if count == 1 else False
-        cursor.close()
-        return result
+        return Storage.backend().delete(
+            self.__class__, self._primary_key_value())
 
     def update(self):
         """
@@ -313,18 +698,9 @@ class Model(dict, metaclass=ModelMetaclass):
         >>> Todo(id=1, is_completed= True).update()
         True
         """
-        sql = 'UPDATE {} SET  {} where {}=?'.format(
-           self.TABLE_NAME,
-           ', '.join(map(lambda f: '{}=?'.format(f), self)),
-           self.PRIMARY_KEY
-        )
-        args = list(map(self._get_value_or_default, self))
-        args.append(self._get_value_or_default(self.PRIMARY_KEY))
-        cursor = SQLConnection().execute(sql, args)
-        count = cursor.rowcount
-        result = True if count == 1 else False
-        cursor.close()
-        return result
+        values = {key: self._get_value_or_default(key) for key in list(self)}
+        return Storage.backend().update(
+            self.__class__, values, self._primary_key_value())
 
     def save(self):
         """
@@ -340,18 +716,98 @@ class Model(dict, metaclass=ModelMetaclass):
         >>> Todo(id=1, text='Hello', is_completed=True).save()
         True
         """
-        args = list(map(self._get_value_or_default, self.COLUMN_TO_FILED))
-        columns = list(map(lambda k: k, self.COLUMN_TO_FILED))
-        sql =  'INSERT INTO {} ({}) VALUES({})'.format(
-            self.TABLE_NAME,
-            ', '.join(columns),
-            ','.join('?'*len(columns))
-        )
-        cursor = SQLConnection().execute(sql, args)
-        count = cursor.rowcount
-        result = True if count == 1 else False
-        cursor.close()
-        return result
+        args = list(map(self._get_value_or_default, self.COLUMNS))
+        return Storage.backend().insert(self.__class__, args)
+
+    def upsert(self, conflict='replace'):
+        """
+        DB Manipulation of 'INSERT ... ON CONFLICT' statement
+
+        Parameters
+        ----------
+        conflict : str
+            'replace', 'ignore' or 'update-newer', see `bulk_upsert()`.
+
+        Returns:
+        --------
+        is_completed: bool
+            True if the record is inserted or overwritten.
+
+        Example:
+        -------
+        >>> Todo(id=1, text='Hello', update_at=time.time()).upsert('update-newer')
+        True
+        """
+        return self.__class__.bulk_upsert([self], conflict) == 1
+
+    @classmethod
+    def bulk_upsert(cls, rows, conflict='replace', batch_size=500):
+        """
+        Store records which may already exist.
+
+        Parameters
+        ----------
+        rows : iterable(object or dict)
+            Instances of the model, or dicts of their column values. A
+            missing column gets the default of its field.
+        conflict : str
+            What to do with a record whose primary key is stored:
+            'replace' overwrites it, 'ignore' keeps it and 'update-newer'
+            overwrites it only when the `VERSION_COLUMN` of the new record
+            is greater.
+        batch_size : int
+            The number of the records sent to the database at once.
+
+        Returns
+        -------
+        count : int
+            The number of the inserted or overwritten records.
+
+        Example
+        -------
+        >>> Todo.bulk_upsert([{'id': 1, 'text': 'Hello'}], 'ignore')
+        1
+        """
+        def values(row):
+            if not isinstance(row, cls):
+                row = cls(**row)
+            return list(map(row._get_value_or_default, cls.COLUMNS))
+        return Storage.backend().upsert(
+            cls, map(values, rows), conflict, batch_size)
+
+    @classmethod
+    def find_or_create(cls, values):
+        """
+        Find the record of the values of `UNIQUE_INDEXES` columns, or add
+        it with the next integer primary key.
+
+        The record is added by 'INSERT ... ON CONFLICT DO NOTHING' and read
+        again, so of the calls which add the same values at once every one
+        returns the record which is stored.
+
+        Parameters
+        ----------
+        values : dict
+            Column names with their value.
+
+        Returns
+        -------
+        object : object
+            The stored record.
+
+        Example
+        -------
+        >>> TodoList.find_or_create({'name': 'ops'})
+        {'id': 1, 'name': 'ops'}
+        """
+        with cls.transaction():
+            record = cls.find_all(values, size=1)
+            if record:
+                return record[0]
+            record = cls(**values)
+            record[cls.PRIMARY_KEY] = (cls.max(cls.PRIMARY_KEY) or 0) + 1
+            cls.bulk_upsert([record], 'ignore')
+            return cls.find_all(values, size=1)[0]
 
     @classmethod
     def convert_result_to_object(cls, result):
@@ -368,8 +824,272 @@ class Model(dict, metaclass=ModelMetaclass):
         object : list(dict) or None
             A list of object dict.
         """
-        keys = cls.COLUMN_TO_FILED
         if len(result) == 0:
             return None
         else:
-            return [cls(**dict(zip(keys, r))) for r in result]
+            row_factory = cls.ROW_FACTORY
+            with PROFILER.phase('convert', len(result)):
+                return [row_factory(None, r) for r in result]
+
+
+class CompressedTexts(object):
+    """
+    Mixin of the models which have `CompressedTextField` columns, the
+    metaclass adds it to their bases.
+
+    A record read from the SQLite backend holds the compressed bytes of a
+    long text until the text is first read, by the attribute, the item,
+    ``get()``, ``values()``, ``items()``, ``copy()`` or a comparison,
+    which store the decompressed text in the record. ``__iter__`` is
+    defined only so that ``dict(record)`` and ``{**record}`` copy the
+    record item by item instead of its raw dict.
+    """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value.__class__ is bytes and key in self.COMPRESSED_COLUMNS:
+            value = decompress(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def _decompress(self):
+        """
+        Decompress every compressed text of the record.
+        """
+        for key in self.COMPRESSED_COLUMNS:
+            if key in self:
+                self[key]
+        return self
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def values(self):
+        return dict.values(self._decompress())
+
+    def items(self):
+        return dict.items(self._decompress())
+
+    def copy(self):
+        return dict.copy(self._decompress())
+
+    def __eq__(self, other):
+        if isinstance(other, CompressedTexts):
+            other._decompress()
+        return dict.__eq__(self._decompress(), other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+
+class ManyToMany(object):
+    """
+    Many-to-many relation of a model to another model through a join model.
+
+    The join model has a composite primary key of (`key`, `other_key`) and
+    should list ``(other_key, key)`` in its `INDEXES`, so the relation is
+    read by index in both directions.
+
+    Example
+    -------
+    >>> class TodoTag(Model):
+    ...     todo_id = IntegerField(primary_key=True)
+    ...     tag_id = IntegerField(primary_key=True)
+    ...     INDEXES = (('tag_id', 'todo_id'),)
+    >>> class Todo(Model):
+    ...     tags = ManyToMany(TodoTag, 'todo_id', 'tag_id', Tag)
+    >>> Todo.tags.add(1, 2)
+    True
+    >>> Todo.tags.load([1])
+    {1: [{'id': 2, 'name': 'urgent'}]}
+    """
+
+    def __init__(self, through, key, other_key, model):
+        """
+        Parameters
+        ----------
+        through : type
+            The join model class.
+        key : str
+            The column of the join model which stores the primary key of
+            the owner model.
+        other_key : str
+            The column of the join model which stores the primary key of
+            the related model.
+        model : type
+            The related model class.
+        """
+        self.through = through
+        self.key = key
+        self.other_key = other_key
+        self.model = model
+        self.owner = None
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+
+    def _link(self, key, other_key):
+        return self.through(**{self.key: key, self.other_key: other_key})
+
+    def add(self, key, other_key):
+        """
+        Relate a record of the owner model to a related record.
+
+        Returns
+        -------
+        added : bool
+            False if the records are already related.
+        """
+        try:
+            return self._link(key, other_key).save()
+        except IntegrityError:
+            return False
+
+    def remove(self, key, other_key):
+        """
+        Remove the relation of a record to a related record.
+        """
+        return self._link(key, other_key).remove()
+
+    def clear(self, key):
+        """
+        Remove every relation of a record of the owner model.
+        """
+        backend = Storage.backend()
+        with backend.transaction():
+            for link in backend.scan(self.through, {self.key: key}) or []:
+                backend.delete(self.through, link._primary_key_value())
+
+    def load(self, keys):
+        """
+        Load the related records of several records at once.
+
+        Parameters
+        ----------
+        keys : list
+            The primary keys of the records of the owner model.
+
+        Returns
+        -------
+        related : dict
+            The list of the related records of every key.
+        """
+        return Storage.backend().load_related(self, list(keys))
+
+    def find_all(self, column, values, condition=None, order_by=None, size=None):
+        """
+        Records of the owner model which are related to a record of every
+        value of a column of the related model.
+
+        Parameters
+        ----------
+        column : str
+            The column of the related model, e.g. 'name'.
+        values : list
+            The values of the column which all have to be related.
+        condition : dict or None
+            Column names of the owner model with condition value.
+        order_by : str or None
+            The 'ORDER BY' clause.
+        size : int or None
+            The maximum number of records.
+
+        Returns
+        -------
+        object : list(object) or None
+            A list of object dict.
+
+        Example
+        -------
+        >>> Todo.tags.find_all('name', ['home', 'urgent'], {'is_completed': False})
+        """
+        if not values:
+            return self.owner.find_all(condition, size=size, order_by=order_by)
+        self.owner._check_columns(condition)
+        self.model._check_columns([column])
+        result = Storage.backend().scan_related(
+            self, column, list(values), condition, order_by, size)
+        return result if result else None
+
+
+class Tree(object):
+    """
+    Hierarchy of the records of a model by a column which stores the
+    primary key of the parent record, None for a top-level record.
+
+    A subtree is read or updated by a single recursive query instead of a
+    query per level, the column should be listed in the `INDEXES` of the
+    model so every level is read by index. The parent links must not make
+    a cycle.
+
+    Example
+    -------
+    >>> class Todo(Model):
+    ...     parent_id = IntegerField()
+    ...     INDEXES = (('parent_id',),)
+    ...     subtasks = Tree('parent_id', rollup='is_completed')
+    >>> Todo.subtasks.walk([1])
+    [Node(record={'id': 1, ...}, depth=0, done=1, total=2), ...]
+    >>> Todo.subtasks.update(1, {'is_completed': True})
+    3
+    """
+
+    def __init__(self, key, rollup=None):
+        """
+        Parameters
+        ----------
+        key : str
+            The column which stores the primary key of the parent record.
+        rollup : str or None
+            A boolean column which is counted over the descendants of every
+            record, e.g. 'is_completed' for "x of y done".
+        """
+        self.key = key
+        self.rollup = rollup
+        self.owner = None
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+
+    def walk(self, roots=None):
+        """
+        Read the subtrees of the roots depth first.
+
+        Parameters
+        ----------
+        roots : list or None
+            The primary keys of the roots, every top-level record if None.
+
+        Returns
+        -------
+        nodes : list(Node)
+            The records with their depth below the root and the rollup of
+            their descendants.
+        """
+        return Storage.backend().walk_tree(self, None if roots is None else list(roots))
+
+    def update(self, root, values):
+        """
+        Update the columns of a record and of all its descendants.
+
+        Parameters
+        ----------
+        root : Filed object default type
+            The primary key of the record.
+        values : dict
+            Column names with their new value.
+
+        Returns
+        -------
+        count : int
+            The number of the updated records, 0 if the record does not
+            exist.
+        """
+        return Storage.backend().update_tree(self, root, values)
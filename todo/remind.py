@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+from .storage import Compare, Storage
+from .utility import format_time
+import heapq
+import os
+import shlex
+import subprocess
+import time
+
+
+def stdout_sink(reminder):
+    """
+    Print a reminder.
+    """
+    print(reminder['message'], flush=True)
+
+
+class FileSink(object):
+    """
+    Append the reminders to a file, a line per reminder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, reminder):
+        with open(self.path, 'a') as f:
+            f.write(reminder['message'] + '\n')
+
+
+class CommandSink(object):
+    """
+    Run a command per reminder with the message as its last argument and
+    the task in the `TODO_TASK_ID`, `TODO_TASK_TEXT` and `TODO_DUE_AT`
+    environment variables, e.g. ``notify-send Todo``.
+    """
+
+    def __init__(self, command):
+        self.args = shlex.split(command)
+
+    def __call__(self, reminder):
+        env = dict(os.environ, TODO_TASK_ID=str(reminder['id']),
+                   TODO_TASK_TEXT=reminder['text'], TODO_DUE_AT=str(reminder['due_at']))
+        subprocess.run(self.args + [reminder['message']], env=env, check=False)
+
+
+def open_sink(spec):
+    """
+    Create the sink of a spec.
+
+    Parameters
+    ----------
+    spec : str
+        'stdout', ``file:<path>`` or ``command:<command line>``.
+
+    Returns
+    -------
+    sink : callable
+        A callable which takes a reminder dict.
+    """
+    if spec == 'stdout':
+        return stdout_sink
+    if spec.startswith('file:'):
+        return FileSink(spec[len('file:'):])
+    if spec.startswith('command:'):
+        return CommandSink(spec[len('command:'):])
+    raise ValueError('{!r} is not a sink, use stdout, file:PATH or command:CMD.'.format(spec))
+
+
+class Reminder(object):
+    """
+    Send a reminder when an open task is due.
+
+    The due times of the open tasks after the start are read by a range of
+    the `(list_id, is_completed, due_at, priority)` index into a min-heap,
+    and the daemon sleeps until the earliest one. It wakes up every
+    `interval` seconds only to read ``PRAGMA data_version``, when another
+    connection has committed it reads the change feed and refreshes the
+    heap entries of the changed tasks only.
+
+    The heap entries of a changed task are not removed: `due_times` has the
+    current due time of every task in the heap, an entry which differs is
+    skipped when it is popped.
+    """
+
+    def __init__(self, model, sink, interval=5.0, clock=time.time, sleep=time.sleep,
+                 condition=None):
+        """
+        Parameters
+        ----------
+        model : type
+            The model class of the tasks, it has `due_at` and `is_completed`.
+        sink : callable
+            Called with a dict of the 'id', 'text', 'due_at', 'latency' and
+            'message' of every reminder.
+        interval : float
+            The maximum seconds between the checks of the database.
+        clock : callable
+            Returns the current epoch time.
+        sleep : callable
+            Sleeps for seconds.
+        condition : dict or None
+            Column names with the values of the reminded tasks, e.g.
+            ``{'list_id': 2}``, every task if None.
+        """
+        self.model = model
+        self.sink = sink
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.condition = condition or {}
+        self.heap = []
+        self.due_times = {}
+        self.seq = 0
+        self.version = None
+        self.latencies = []
+
+    def _version(self):
+        try:
+            return Storage.backend().data_version()
+        except NotImplementedError:
+            return self.model.last_change_seq()
+
+    def _schedule(self, task, now):
+        """
+        Put an open task which is due after now into the heap.
+        """
+        if task.is_completed or task.due_at is None or task.due_at <= now or \
+                any(task[k] != v for k, v in self.condition.items()):
+            self.due_times.pop(task.id, None)
+            return
+        if self.due_times.get(task.id) != task.due_at:
+            self.due_times[task.id] = task.due_at
+            heapq.heappush(self.heap, (task.due_at, task.id))
+
+    def load(self, now=None):
+        """
+        Read the open tasks which are due after now.
+        """
+        now = self.clock() if now is None else now
+        self.seq = self.model.last_change_seq()
+        self.version = self._version()
+        self.heap = []
+        self.due_times = {}
+        tasks = self.model.find_all(
+            dict(self.condition, is_completed=False, due_at=Compare('>', now)),
+            order_by='due_at, priority') or []
+        for task in tasks:
+            self._schedule(task, now)
+
+    def refresh(self, now=None):
+        """
+        Apply the changes committed since the last check.
+
+        Returns
+        -------
+        changed : int
+            The number of the changed tasks.
+        """
+        version = self._version()
+        if version == self.version:
+            return 0
+        self.version = version
+        now = self.clock() if now is None else now
+        if self.seq + 1 < self.model.first_change_seq():
+            # The changes since the last check are pruned.
+            self.load(now)
+            return len(self.due_times)
+        changes = self.model.changes_since(self.seq)
+        if not changes:
+            return 0
+        self.seq = changes[-1].seq
+        keys = {c.primary_key for c in changes}
+        for key in keys:
+            task = self.model.find(key)
+            if task:
+                self._schedule(task[0], now)
+            else:
+                self.due_times.pop(key, None)
+        return len(keys)
+
+    def next_due(self):
+        """
+        The earliest due time in the heap, or None.
+        """
+        while self.heap and self.due_times.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def fire(self, now):
+        """
+        Send the reminders of the tasks which are due at now.
+
+        Returns
+        -------
+        reminders : list(dict)
+            The sent reminders.
+        """
+        reminders = []
+        while True:
+            due_at = self.next_due()
+            if due_at is None or due_at > now:
+                return reminders
+            _, key = heapq.heappop(self.heap)
+            del self.due_times[key]
+            task = self.model.find(key)
+            if not task:
+                continue
+            task = task[0]
+            latency = now - due_at
+            self.latencies.append(latency)
+            reminder = {
+                'id': task.id,
+                'text': task.text,
+                'due_at': due_at,
+                'latency': latency,
+                'message': 'Task {} is due: {} (due {}, woke up {:.1f} ms late)'.format(
+                    task.id, task.text, format_time(due_at), latency * 1000),
+            }
+            self.sink(reminder)
+            reminders.append(reminder)
+
+    def run(self, count=None):
+        """
+        Send the reminders until interrupted or `count` reminders are sent.
+        """
+        self.load()
+        sent = 0
+        while count is None or sent < count:
+            self.refresh()
+            sent += len(self.fire(self.clock()))
+            due_at = self.next_due()
+            timeout = self.interval
+            if due_at is not None:
+                timeout = min(timeout, due_at - self.clock())
+            if timeout > 0 and (count is None or sent < count):
+                self.sleep(timeout)
+
+    def summary(self):
+        """
+        A line about the sent reminders and their wakeup latency.
+        """
+        if not self.latencies:
+            return 'Sent 0 reminders.'
+        latencies = sorted(self.latencies)
+        return 'Sent {} reminders, wakeup latency mean {:.1f} ms, max {:.1f} ms.'.format(
+            len(latencies), sum(latencies) / len(latencies) * 1000, latencies[-1] * 1000)
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from itertools import accumulate, compress
+from .storage import SQLiteBackend
+import operator
+import time
+
+try:
+    import numpy
+except ImportError:
+    # The arrays of the `array` module and the C loops of `bisect`,
+    # `itertools` and `map` are used instead.
+    numpy = None
+
+DAY = 86400.0
+
+# The sorted series of values which the report reads: the expression, the
+# `is_completed` value of the records (None for every record) and the
+# lowest valid value, e.g. a lead time is never negative. A task is never
+# completed before it is created, e.g. an imported one without `update_at`.
+SERIES = {
+    'created': ('created_at', None, None),
+    'open_created': ('created_at', False, None),
+    'completed': ('MAX(update_at, created_at)', True, None),
+    'lead': ('update_at - created_at', True, 0.0),
+}
+
+
+def compact(values):
+    """
+    A compact array of floats, a `numpy.ndarray` if NumPy is installed.
+    """
+    if numpy is not None:
+        return numpy.asarray(values, dtype=float)
+    return values if isinstance(values, array) else array('d', values)
+
+
+def cumsum(values):
+    """
+    The running totals of an array.
+    """
+    if numpy is not None:
+        return numpy.cumsum(values)
+    return array('d', accumulate(values))
+
+
+def rolling_mean(values, window):
+    """
+    The mean of the last `window` values at every position, of fewer
+    values at the first positions.
+    """
+    totals = cumsum(compact(array('d', [0.0]) + array('d', values)))
+    if numpy is not None:
+        ends = numpy.arange(1, len(values) + 1)
+        starts = numpy.maximum(ends - window, 0)
+        return (totals[ends] - totals[starts]) / (ends - starts)
+    return array('d', [
+        (totals[i] - totals[max(i - window, 0)]) / min(i, window)
+        for i in range(1, len(values) + 1)])
+
+
+def after(counts):
+    """
+    The counts of the bins after every bin of a histogram.
+    """
+    totals = cumsum(compact(counts[::-1]))[::-1]
+    if numpy is not None:
+        return numpy.append(totals[1:], 0.0)
+    return totals[1:] + array('d', [0.0])
+
+
+def percentile(values_at, size, fractions):
+    """
+    Percentiles of a sorted series by linear interpolation, like the
+    default method of `numpy.percentile`.
+
+    Parameters
+    ----------
+    values_at : function
+        Returns the values of a list of ranks of the ascending series.
+    size : int
+        The number of values of the series.
+    fractions : list(float)
+        The percentiles as fractions, e.g. 0.5 for the median.
+
+    Returns
+    -------
+    values : list(float or None)
+        The value of every percentile, None for an empty series.
+    """
+    if not size:
+        return [None] * len(fractions)
+    positions = [q * (size - 1) for q in fractions]
+    ranks = sorted({int(p) for p in positions} | {min(int(p) + 1, size - 1) for p in positions})
+    values = dict(zip(ranks, values_at(ranks)))
+    result = []
+    for position in positions:
+        low = int(position)
+        high = min(low + 1, size - 1)
+        result.append(values[low] + (values[high] - values[low]) * (position - low))
+    return result
+
+
+class IndexSource(object):
+    """
+    Series of a SQLite database which are read by the indexes of `Todo`.
+
+    The size of a series comes from the `is_completed` counters, or from
+    an index range count of the records of the condition, a rank is an
+    'ORDER BY ... LIMIT 1 OFFSET' walk of the index from the nearer end
+    and the counts of a histogram are index range counts, so no record is
+    read and the cost depends on the report window and not on the size of
+    the table.
+    """
+
+    def __init__(self, model, backend, condition=None):
+        self.model = model
+        self.connection = backend.connection
+        self.condition = condition or {}
+        self.counts = None if self.condition else model.counters('is_completed')
+
+    def _where(self, name):
+        expression, completed, lower = SERIES[name]
+        # The columns of the condition lead the indexes of the series.
+        terms = ['{} = ?'.format(k) for k in self.condition]
+        args = list(self.condition.values())
+        if completed is None:
+            terms.append('is_completed IN (0, 1)')
+        else:
+            terms.append('is_completed = {:d}'.format(completed))
+        if lower is not None:
+            terms.append('{} >= ?'.format(expression))
+            args.append(lower)
+        return expression, ' AND '.join(terms), args
+
+    def _query(self, sql, args):
+        cursor = self.connection.execute(sql, args, autocommit=False)
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
+    def size(self, name):
+        expression, completed, lower = SERIES[name]
+        if self.counts is None:
+            _, where, args = self._where(name)
+            return self._query(
+                'SELECT COUNT(*) FROM {} WHERE {}'.format(self.model.TABLE_NAME, where),
+                args)[0][0]
+        if completed is None:
+            size = sum(self.counts.values())
+        else:
+            size = self.counts.get(completed, 0)
+        if lower is not None:
+            size -= self._query(
+                'SELECT COUNT(*) FROM {} WHERE is_completed = {:d} AND {} < ?'.format(
+                    self.model.TABLE_NAME, completed, expression), [lower])[0][0]
+        return size
+
+    def values_at(self, name, ranks):
+        expression, where, args = self._where(name)
+        size = self.size(name)
+        values = []
+        for rank in ranks:
+            if rank < size / 2:
+                order, offset = 'ASC', rank
+            else:
+                order, offset = 'DESC', size - 1 - rank
+            values.append(self._query(
+                'SELECT {1} FROM {0} WHERE {2} ORDER BY {1} {3} LIMIT 1 OFFSET ?'.format(
+                    self.model.TABLE_NAME, expression, where, order),
+                args + [offset])[0][0])
+        return values
+
+    def histogram(self, name, edges):
+        expression, where, args = self._where(name)
+        bins = list(zip(edges, list(edges[1:]) + [float('inf')]))
+        sql = (
+            'WITH bins(i, low, high) AS (VALUES {3}) '
+            'SELECT (SELECT COUNT(*) FROM {0} WHERE {2} AND {1} >= low AND {1} < high) '
+            'FROM bins ORDER BY i'.format(
+                self.model.TABLE_NAME, expression, where,
+                ', '.join('({}, ?, ?)'.format(i) for i in range(len(bins)))))
+        bound = [v for low_high in bins for v in low_high]
+        # The parameters of the VALUES come first in the statement.
+        return compact([row[0] for row in self._query(sql, bound + args)])
+
+
+class ArraySource(object):
+    """
+    Series of any backend, read by a projection of the `created_at`,
+    `update_at` and `is_completed` columns into compact arrays which are
+    filtered and sorted without a Python loop per record.
+    """
+
+    def __init__(self, model, backend, condition=None):
+        columns = backend.project(
+            model, ['created_at', 'update_at', 'is_completed'], condition)
+        created, updated, flags = (
+            columns['created_at'], columns['update_at'], columns['is_completed'])
+        self.series = {}
+        if numpy is not None:
+            created, updated = numpy.frombuffer(created), numpy.frombuffer(updated)
+            done = numpy.frombuffer(flags) != 0
+            lead = numpy.sort(updated[done] - created[done])
+            self.series = {
+                'created': numpy.sort(created),
+                'open_created': numpy.sort(created[~done]),
+                'completed': numpy.sort(numpy.maximum(updated, created)[done]),
+                'lead': lead[numpy.searchsorted(lead, 0.0):],
+            }
+            return
+        done = list(map(bool, flags))
+        lead = sorted(compress(map(operator.sub, updated, created), done))
+        self.series = {
+            'created': array('d', sorted(created)),
+            'open_created': array('d', sorted(compress(created, map(operator.not_, done)))),
+            'completed': array('d', sorted(compress(map(max, updated, created), done))),
+            'lead': array('d', lead[bisect_left(lead, 0.0):]),
+        }
+
+    def size(self, name):
+        return len(self.series[name])
+
+    def values_at(self, name, ranks):
+        values = self.series[name]
+        return [float(values[r]) for r in ranks]
+
+    def histogram(self, name, edges):
+        values = self.series[name]
+        if numpy is not None:
+            below = numpy.searchsorted(values, numpy.asarray(edges, dtype=float))
+            return numpy.diff(numpy.append(below, len(values))).astype(float)
+        below = [bisect_left(values, e) for e in edges] + [len(values)]
+        return array('d', map(operator.sub, below[1:], below[:-1]))
+
+
+def open_source(model, backend, condition=None):
+    """
+    The series source of the records of a condition: the indexes for
+    SQLite, a projection of the records otherwise.
+    """
+    if isinstance(backend, SQLiteBackend):
+        return IndexSource(model, backend, condition)
+    return ArraySource(model, backend, condition)
+
+
+class Report(object):
+    """
+    Analytics of the tasks: the lead time of the completed tasks
+    (`update_at - created_at`), the completions per day, the age of the
+    open tasks and the burndown of the open tasks per day.
+
+    The numbers are computed from a source of sorted series, see
+    `IndexSource` and `ArraySource`, over compact arrays of a value per
+    day of the window.
+
+    Example
+    -------
+    >>> Report(Todo, Storage.backend(), days=7).run()['lead_time']
+    {'count': 52, 'p50': 8100.0, 'p90': 86400.0, 'p99': 345600.0}
+    """
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, model, backend, days=30, now=None, window=7, condition=None):
+        """
+        Parameters
+        ----------
+        model : type
+            The model class of the tasks.
+        backend : StorageBackend
+            The backend of the tasks.
+        days : int
+            The number of days of the throughput and burndown series,
+            ending today.
+        now : float or None
+            The epoch time of the report, the current time if None.
+        window : int
+            The days of the rolling mean of the throughput.
+        condition : dict or None
+            Column names with the values of the reported tasks, e.g.
+            ``{'list_id': 2}``, every task if None.
+        """
+        self.model = model
+        self.backend = backend
+        self.days = days
+        self.now = time.time() if now is None else now
+        self.window = window
+        self.condition = condition
+
+    def day_edges(self):
+        """
+        The epoch times of the starts of the days of the window, in local
+        time.
+        """
+        today = datetime.fromtimestamp(self.now).replace(
+            hour=0, minute=0, second=0, microsecond=0).timestamp()
+        return [today - DAY * (self.days - 1 - i) for i in range(self.days)]
+
+    def _percentiles(self, source, name, reverse=False):
+        size = source.size(name)
+        fractions = [(100 - p if reverse else p) / 100 for p in self.PERCENTILES]
+        values = percentile(lambda ranks: source.values_at(name, ranks), size, fractions)
+        result = {'count': size}
+        for p, value in zip(self.PERCENTILES, values):
+            if value is not None and reverse:
+                value = self.now - value
+            result['p{}'.format(p)] = value
+        return result
+
+    def run(self, source=None):
+        """
+        Compute the report.
+
+        Parameters
+        ----------
+        source : IndexSource or ArraySource or None
+            The source of the series, `open_source()` of the backend if None.
+
+        Returns
+        -------
+        report : dict
+            The 'lead_time' and 'open_age' percentiles in seconds, the
+            'throughput' and the 'burndown' series of the days.
+        """
+        source = source or open_source(self.model, self.backend, self.condition)
+        edges = self.day_edges()
+        # A bin per day of the window, the last one also counts the
+        # values after today.
+        completed = source.histogram('completed', edges)
+        created = source.histogram('created', edges)
+        open_now = source.size('open_created')
+        # The open tasks at the end of a day are the open tasks now, minus
+        # the tasks created after it, plus the tasks completed after it.
+        if numpy is not None:
+            burndown = open_now - after(created) + after(completed)
+        else:
+            burndown = array('d', map(
+                operator.add, after(completed),
+                map(operator.sub, array('d', [open_now]) * self.days, after(created))))
+        days = [datetime.fromtimestamp(e).strftime('%Y-%m-%d') for e in edges]
+        return {
+            'generated_at': self.now,
+            'lead_time': self._percentiles(source, 'lead'),
+            'open_age': self._percentiles(source, 'open_created', reverse=True),
+            'throughput': {
+                'days': days,
+                'completed': [int(v) for v in completed],
+                'mean': float(sum(completed)) / self.days if self.days else 0.0,
+                'rolling_mean': [
+                    round(float(v), 3) for v in rolling_mean(completed, self.window)],
+            },
+            'burndown': {
+                'days': days,
+                'open': [int(v) for v in burndown],
+            },
+        }
+
+
+def format_duration(seconds):
+    """
+    A short text of a duration, e.g. '2.5 h'.
+    """
+    if seconds is None:
+        return '-'
+    for unit, size in (('d', DAY), ('h', 3600.0), ('min', 60.0)):
+        if seconds >= size:
+            return '{:.1f} {}'.format(seconds / size, unit)
+    return '{:.0f} s'.format(seconds)
+
+
+def format_report(report):
+    """
+    The text of a report.
+    """
+    lines = []
+    for title, key in (('Lead time', 'lead_time'), ('Open task age', 'open_age')):
+        stats = report[key]
+        lines.append('{} ({} tasks): {}'.format(title, stats['count'], ', '.join(
+            '{} {}'.format(k, format_duration(v)) for k, v in stats.items() if k != 'count')))
+    throughput = report['throughput']
+    lines.append('Throughput: {:.2f} tasks/day'.format(throughput['mean']))
+    lines.append('{:<10} {:>9} {:>9} {:>6}'.format('day', 'completed', 'rolling', 'open'))
+    for day, done, rolling, open_count in zip(
+            throughput['days'], throughput['completed'], throughput['rolling_mean'],
+            report['burndown']['open']):
+        lines.append('{:<10} {:>9} {:>9.2f} {:>6}'.format(day, done, rolling, open_count))
+    return '\n'.join(lines)
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+from .storage import Compare, SQLiteBackend, Storage
+from .todo import Todo, TodoList
+from .utility import Connection, parse_list_name
+import json
+import queue
+import sqlite3
+import time
+import traceback
+
+# The fields of a task which a request writes, with their check.
+FIELDS = {
+    'text': lambda v: isinstance(v, str),
+    'priority': lambda v: type(v) is int and 1 <= v <= 5,
+    'due_at': lambda v: v is None or type(v) in (int, float),
+    'is_completed': lambda v: type(v) is bool,
+    'parent_id': lambda v: v is None or type(v) is int,
+}
+# A new task also names its list.
+ADD_FIELDS = dict(FIELDS, list=lambda v: v is None or isinstance(v, str))
+# The statuses of `GET /tasks?status=`, the value of `is_completed`.
+STATUSES = {'open': False, 'completed': True, 'all': None}
+
+
+class RequestError(Exception):
+    """
+    Error of a request, it is answered with its HTTP status.
+    """
+
+    def __init__(self, status, message):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+class ConnectionPool(object):
+    """
+    Open SQLite backends of a database file which the threads of the
+    server borrow for a request.
+
+    The connections stay open between the requests, so a request neither
+    connects nor reads the schema again, and the last returned one is
+    borrowed first, its page cache is the warmest.
+    """
+
+    def __init__(self, path, size=8):
+        """
+        Parameters
+        ----------
+        path : str
+            A URI of the database file, e.g. 'file:/tmp/data.db'.
+        size : int
+            The number of connections, the requests over it wait.
+        """
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(SQLiteBackend(Connection(path, check_same_thread=False)))
+        self.size = size
+        # The version of the database which every connection has last read,
+        # with the state of the connection which it was read at.
+        self._versions = {}
+
+    @contextmanager
+    def borrow(self):
+        """
+        Use an idle backend as the `Storage` backend of the thread inside
+        the block.
+        """
+        backend = self._idle.get()
+        try:
+            with Storage.use(backend):
+                yield backend
+        finally:
+            self._idle.put(backend)
+
+    def version(self, backend, model):
+        """
+        The version of the records of a model, the sequence number of its
+        latest change.
+
+        It is read again only when `PRAGMA data_version` of the connection
+        has moved, i.e. another connection has committed, or the connection
+        itself has written since, so a poll of an unchanged database costs
+        a pragma.
+        """
+        state = (backend.data_version(), backend.connection.conn.total_changes)
+        cached = self._versions.get(id(backend))
+        if cached is None or cached[0] != state:
+            cached = (state, model.last_change_seq())
+            self._versions[id(backend)] = cached
+        return cached[1]
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class TaskHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests of the tasks, see `TaskServer`.
+
+    Routes
+    ------
+
+    - ``GET /tasks?list=NAME&status=open|completed|all&after=ID&limit=N``:
+                            a page of the tasks of a list by id, with the
+                            id to pass as `after` for the ``next`` page;
+                            ``format=jsonl`` streams every task after
+                            `after` as JSON lines instead
+    - ``POST /tasks``: adds a task of the JSON body, its `list` is created
+                            if it does not exist
+    - ``GET /tasks/ID`` / ``PATCH /tasks/ID`` / ``DELETE /tasks/ID``
+
+    The GET responses have an ETag of the version of the tasks, a request
+    whose `If-None-Match` has it is answered 304 without reading a task.
+    """
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are separate writes, Nagle's algorithm
+    # would hold the body until the client acknowledges the headers.
+    disable_nagle_algorithm = True
+    PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    # The tasks of a streamed listing are read and sent in batches.
+    STREAM_BATCH_SIZE = 1000
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(TaskHandler, self).log_message(format, *args)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        """
+        Route a request to the action of its method and path, and answer
+        its errors as JSON.
+        """
+        self._sent = False
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        try:
+            # The body is read even when the request fails, the next
+            # request of the connection follows it.
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if parts[0] != 'tasks' or len(parts) > 2:
+                raise RequestError(404, 'Not found.')
+            if len(parts) == 1:
+                action = {'GET': self._list_tasks, 'POST': self._add_task}.get(method)
+                args = ()
+            else:
+                action = {
+                    'GET': self._get_task, 'PATCH': self._update_task,
+                    'DELETE': self._delete_task}.get(method)
+                args = (_integer(parts[1], 404),)
+            if action is None:
+                raise RequestError(405, 'Method not allowed.')
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            with self.server.pool.borrow() as backend:
+                action(backend, query, body, *args)
+        except RequestError as e:
+            self._fail(e.status, str(e))
+        except ValueError as e:
+            self._fail(400, str(e))
+        except sqlite3.OperationalError as e:
+            # E.g. the database is locked by a long write of another process.
+            self._fail(503, str(e))
+        except Exception:
+            # A bug answers its request only, the server goes on.
+            traceback.print_exc()
+            self._fail(500, 'Internal server error.')
+
+    def _fail(self, status, message):
+        if self._sent:
+            # The response has started, the client sees it cut short.
+            self.close_connection = True
+        else:
+            self._send_json(status, {'error': message})
+
+    def _send_json(self, status, value, headers=()):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self._sent = True
+        self.wfile.write(body)
+
+    def _etag(self, backend):
+        """
+        The ETag of the version of the tasks, None when the request has it
+        in `If-None-Match` and is answered 304.
+        """
+        etag = '"{}"'.format(self.server.pool.version(backend, Todo))
+        tags = [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]
+        if etag in tags or 'W/' + etag in tags:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self._sent = True
+            return None
+        return etag
+
+    def _json_body(self, body):
+        try:
+            values = json.loads(body or b'{}')
+        except ValueError:
+            raise RequestError(400, 'The body is not JSON.')
+        if not isinstance(values, dict):
+            raise RequestError(400, 'The body is not a JSON object.')
+        return values
+
+    def _list_id(self, name, create=False):
+        """
+        The id of a named list, 0 for the default list.
+        """
+        if name is None or name == TodoList.DEFAULT_NAME:
+            return 0
+        name = parse_list_name(name)
+        if create:
+            return TodoList.find_or_create({'name': name}).id
+        todo_list = TodoList.find_all({'name': name}, size=1)
+        if not todo_list:
+            raise RequestError(404, 'This list not exist.')
+        return todo_list[0].id
+
+    def _find_task(self, id):
+        task = Todo.find(id)
+        if not task:
+            raise RequestError(404, 'This id of task not exist.')
+        return task[0]
+
+    def _page(self, condition, after, size):
+        if after is not None:
+            condition = dict(condition, id=Compare('>', after))
+        # Every page is a range of the index on `list_id` or on `list_id,
+        # is_completed`, whose entries are in the id order.
+        return Todo.find_all(condition, order_by='id', size=size) or []
+
+    def _list_tasks(self, backend, query, body):
+        status = query.get('status', 'all')
+        if status not in STATUSES:
+            raise RequestError(400, 'The status is open, completed or all.')
+        after = _integer(query['after']) if 'after' in query else None
+        limit = _integer(query.get('limit', self.PAGE_SIZE))
+        if not 1 <= limit <= self.MAX_PAGE_SIZE:
+            raise RequestError(400, 'The limit is from 1 to {}.'.format(self.MAX_PAGE_SIZE))
+        etag = self._etag(backend)
+        if etag is None:
+            return
+        condition = {'list_id': self._list_id(query.get('list'))}
+        if STATUSES[status] is not None:
+            condition['is_completed'] = STATUSES[status]
+        if query.get('format') == 'jsonl':
+            self._stream(condition, after, etag)
+            return
+        tasks = self._page(condition, after, limit + 1)
+        next_id = tasks[limit - 1].id if len(tasks) > limit else None
+        self._send_json(200, {'tasks': tasks[:limit], 'next': next_id}, [('ETag', etag)])
+
+    def _stream(self, condition, after, etag):
+        """
+        Send every task of the condition as a JSON line, in a chunk per
+        batch, so a listing of any size takes the memory of a batch.
+
+        The batches are separate reads, a task written during the stream
+        is sent if it comes after the last sent one.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self._sent = True
+        while True:
+            tasks = self._page(condition, after, self.STREAM_BATCH_SIZE)
+            if tasks:
+                chunk = ''.join(json.dumps(t) + '\n' for t in tasks).encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                after = tasks[-1].id
+            if len(tasks) < self.STREAM_BATCH_SIZE:
+                break
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _get_task(self, backend, query, body, id):
+        etag = self._etag(backend)
+        if etag is not None:
+            self._send_json(200, self._find_task(id), [('ETag', etag)])
+
+    def _add_task(self, backend, query, body):
+        values = self._json_body(body)
+        _check(values, ADD_FIELDS)
+        name = values.pop('list', None)
+        if 'text' not in values:
+            raise RequestError(400, 'The task has no text.')
+        with Todo.transaction():
+            list_id = self._list_id(name, create=True)
+            parent_id = values.get('parent_id')
+            if parent_id is not None:
+                # A subtask is in the list of its parent.
+                parent = Todo.find(parent_id)
+                if not parent or parent[0].list_id != list_id:
+                    raise RequestError(400, 'This id of parent task not exist.')
+            task = Todo(
+                id=(Todo.max('id') or 0) + 1, uid=uuid4().hex, created_at=time.time(),
+                list_id=list_id, **values)
+            task.save()
+            task = self._find_task(task.id)
+        self._send_json(201, task, [('Location', '/tasks/{}'.format(task.id))])
+
+    def _update_task(self, backend, query, body, id):
+        values = self._json_body(body)
+        _check(values)
+        if 'parent_id' in values:
+            raise RequestError(400, 'The parent of a task does not change.')
+        with Todo.transaction():
+            self._find_task(id)
+            Todo(id=id, update_at=time.time(), **values).update()
+            task = self._find_task(id)
+        self._send_json(200, task)
+
+    def _delete_task(self, backend, query, body, id):
+        with Todo.transaction():
+            task = self._find_task(id)
+            Todo(id=id).remove()
+            Todo.tags.clear(id)
+            # The subtasks move up to the parent of the deleted task.
+            for subtask in Todo.find_all({'parent_id': id}) or []:
+                Todo(id=subtask.id, parent_id=task.parent_id).update()
+        self.send_response(204)
+        self.end_headers()
+        self._sent = True
+
+
+class TaskServer(ThreadingHTTPServer):
+    """
+    HTTP server of the tasks of a SQLite database file, a thread per
+    connection with a borrowed backend of `pool` per request.
+
+    Example
+    -------
+    >>> server = TaskServer(('127.0.0.1', 8080), 'file:/tmp/data.db')
+    >>> server.serve_forever()
+    """
+    daemon_threads = True
+
+    def __init__(self, address, path, pool_size=8, verbose=False):
+        """
+        Parameters
+        ----------
+        address : tuple
+            The host and the port, port 0 binds a free port.
+        path : str
+            A URI of the database file, it is migrated.
+        pool_size : int
+            The number of open connections of the database file.
+        verbose : bool
+            Log every request to stderr.
+        """
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        self.verbose = verbose
+        super(TaskServer, self).__init__(address, TaskHandler)
+
+    def server_close(self):
+        super(TaskServer, self).server_close()
+        self.pool.close()
+
+
+def _integer(text, status=400):
+    try:
+        return int(text)
+    except ValueError:
+        raise RequestError(status, '{!r} is not an integer.'.format(text))
+
+
+def _check(values, fields=FIELDS):
+    """
+    Check the fields of a task in the body of a request.
+    """
+    for key, value in values.items():
+        if key not in fields:
+            raise RequestError(400, 'A task has no field {}.'.format(key))
+        if not fields[key](value):
+            raise RequestError(400, 'The value of {} is invalid.'.format(key))
+
+
+def parse_bind(text):
+    """
+    Parse the HOST:PORT address of `todo http --bind`.
+
+    Returns
+    -------
+    address : tuple
+        The host and the port.
+    """
+    host, _, port = text.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError('{!r} is not a HOST:PORT address.'.format(text))
+    return host, int(port)
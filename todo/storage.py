@@ -0,0 +1,2179 @@
+# -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from heapq import merge
+from itertools import groupby, islice
+from sqlite3 import IntegrityError
+from .memprofile import PROFILER
+from .migration import Migration
+from .trace import TRACER
+from .utility import Connection, SQLConnection
+import glob
+import json
+import operator
+import os
+import re
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# A change of a record in the change feed of a model, `columns` are the
+# written columns (every column for 'insert', none for 'delete').
+Change = namedtuple('Change', ['seq', 'op', 'primary_key', 'columns'])
+
+# A record of a `Tree` walk, `done` and `total` roll up the descendants of
+# the record (`done` is None when the tree has no rollup column).
+Node = namedtuple('Node', ['record', 'depth', 'done', 'total'])
+
+# What `upsert()` does with a record whose primary key is already stored:
+# overwrite it, keep it, or overwrite it only with a newer version.
+CONFLICTS = ('replace', 'ignore', 'update-newer')
+
+
+class Compare(namedtuple('Compare', ['op', 'value'])):
+    """
+    A comparison of a column in a condition, the other values of a
+    condition are compared by equality.
+
+    The operators are '<', '<=', '>', '>=', '!=', 'IS' and 'IS NOT', they
+    follow SQL: a NULL column only matches 'IS' None and 'IS NOT' a value.
+
+    Example
+    -------
+    >>> Todo.find_all({'is_completed': False, 'due_at': Compare('<=', time.time())})
+    """
+    OPERATORS = {
+        '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+        '!=': operator.ne,
+    }
+
+    def test(self, value):
+        """
+        Whether a column value matches the comparison.
+        """
+        if self.op in ('IS', 'IS NOT'):
+            same = value is None if self.value is None else value == self.value
+            return same if self.op == 'IS' else not same
+        if value is None or self.value is None:
+            return False
+        return self.OPERATORS[self.op](value, self.value)
+
+
+def _match(value, expected):
+    """
+    Whether a column value matches the value of a condition.
+    """
+    if isinstance(expected, Compare):
+        return expected.test(value)
+    return expected is not None and value == expected
+
+
+class StorageBackend(object):
+    """
+    Base class of the storage backends which `Model` is stored in.
+
+    A backend receives the records of a model as tuples whose items follow
+    the order of the model's `COLUMNS` and returns them as instances of the
+    model built by its `ROW_FACTORY`, every method receives the model class
+    as its first argument.
+
+    Methods of the storage protocol
+    -------------------------------
+
+    - ``create_table(model)`` / ``drop_table(model)``
+    - ``migrate(models, version)``: brings the tables to a schema version
+    - ``insert(model, values)``: stores a new record
+    - ``get(model, primary_key)``: point lookup of a record
+    - ``scan(model, condition, order_by, size)``: records which match
+                            the equality predicates of ``condition``
+    - ``update(model, values, primary_key)`` / ``delete(model, primary_key)``
+    - ``upsert(model, rows, conflict)``: stores records which may exist, the
+                            base class implements it with ``get()``,
+                            ``insert()`` and ``update()``
+    - ``project(model, columns, condition)``: the values of numeric columns
+                            as compact arrays, without building records
+    - ``aggregate(model, function, column, condition)``: 'COUNT', 'MIN'
+                            or 'MAX' of a column
+    - ``group_count(model, column, condition)`` / ``counters(model, column)``
+    - ``collisions(model, column, member)``: the values of a column which
+                            several records hold, the base class implements
+                            it with ``scan()``
+    - ``changes_since(model, seq, size)`` / ``last_change_seq(model)``: the
+                            change feed of a model, if `CHANGE_FEED`
+    - ``first_change_seq(model)`` / ``prune_changes(model, seq)``: the
+                            oldest change which is kept, and the deletion
+                            of the older ones
+    - ``load_related(relation, keys)`` / ``scan_related(relation, column,
+                            values, ...)``: reads a `ManyToMany` relation,
+                            the base class implements them with ``scan()``
+    - ``walk_tree(tree, roots)`` / ``update_tree(tree, root, values)``: reads
+                            or updates the subtrees of a `Tree`, the base
+                            class implements them with a ``scan()`` per record
+    - ``data_version()``: a number which moves on commits of other connections
+    - ``transaction()``: a context manager grouping the writes of a block
+    """
+    # Whether the backend keeps a change feed which follows every write of
+    # the records it stores, so its sequence numbers can be remembered.
+    CHANGE_FEED = False
+
+    def require_change_feed(self, name):
+        """
+        Raise ValueError if the backend has no change feed, which `name`
+        follows.
+        """
+        if not self.CHANGE_FEED:
+            raise ValueError('{} follows the change feed, which the {} does not keep.'.format(
+                name, type(self).__name__))
+
+    def create_table(self, model):
+        """
+        Create the storage of the model.
+        """
+        raise NotImplementedError()
+
+    def drop_table(self, model):
+        """
+        Drop the storage of the model.
+        """
+        raise NotImplementedError()
+
+    def is_migrated(self, models, version):
+        """
+        Whether the storage of the models is at the schema version, so it
+        can be read without `migrate()`. Backends without a schema always
+        create their storage.
+        """
+        return False
+
+    def migrate(self, models, version, **options):
+        """
+        Bring the storage of the models to the schema version.
+
+        Backends without a schema only create the storage of the models.
+
+        Parameters
+        ----------
+        models : list(type)
+            The model classes.
+        version : int
+            The schema version of the models.
+        options : dict
+            Options of the migration, e.g. `batch_size`, or `rebuild=False`
+            which only applies the additive changes.
+        """
+        for model in models:
+            self.create_table(model)
+
+    def insert(self, model, values):
+        """
+        Store a new record.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+        values : list
+            The values of the record in the order of `COLUMNS`.
+
+        Returns
+        -------
+        is_completed : bool
+            Whether the record is stored.
+        """
+        raise NotImplementedError()
+
+    def get(self, model, primary_key):
+        """
+        Look up a record by its primary key.
+
+        Returns
+        -------
+        result : list(object)
+            A list which holds the record, empty if it does not exist.
+        """
+        raise NotImplementedError()
+
+    def scan(self, model, condition=None, order_by=None, size=None):
+        """
+        Look up the records which match the condition.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+        condition : dict or None
+            Column names with condition value.
+        order_by : str or None
+            The order of the records, e.g. 'id desc'.
+        size : int or None
+            The size of result.
+
+        Returns
+        -------
+        result : list(object)
+            A list of records.
+        """
+        raise NotImplementedError()
+
+    def update(self, model, values, primary_key):
+        """
+        Update the columns of a record.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+        values : dict
+            Column names with their new value.
+        primary_key : Filed object default type
+            The value of primary key.
+
+        Returns
+        -------
+        is_completed : bool
+            Whether the record exists and is updated.
+        """
+        raise NotImplementedError()
+
+    def delete(self, model, primary_key):
+        """
+        Delete a record by its primary key.
+
+        Returns
+        -------
+        is_completed : bool
+            Whether the record exists and is deleted.
+        """
+        raise NotImplementedError()
+
+    def _check_conflict(self, model, conflict):
+        if conflict not in CONFLICTS:
+            raise ValueError('Unknown conflict mode: {}'.format(conflict))
+        if conflict == 'update-newer' and not model.VERSION_COLUMN:
+            raise ValueError('{} has no VERSION_COLUMN.'.format(model.__name__))
+
+    def _unique_conflict(self, model, values):
+        """
+        Whether a stored record has the columns of a `UNIQUE_INDEXES` of the
+        values of a new record.
+        """
+        for columns in model.UNIQUE_INDEXES:
+            condition = {c: values[model.COLUMNS.index(c)] for c in columns}
+            if self.scan(model, condition, size=1):
+                return True
+        return False
+
+    def upsert(self, model, rows, conflict='replace', batch_size=None):
+        """
+        Store records, a record whose primary key is stored is handled by
+        the conflict mode.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+        rows : iterable(list)
+            The values of the records in the order of `COLUMNS`.
+        conflict : str
+            'replace' overwrites the stored record, 'ignore' keeps it, also
+            a record whose `UNIQUE_INDEXES` columns are the same, and
+            'update-newer' overwrites it only when the `VERSION_COLUMN` of
+            the new record is greater.
+        batch_size : int or None
+            The number of the records written by a statement, if the
+            backend batches them.
+
+        Returns
+        -------
+        count : int
+            The number of the inserted or overwritten records.
+        """
+        self._check_conflict(model, conflict)
+        version = model.COLUMNS.index(model.VERSION_COLUMN) if model.VERSION_COLUMN else None
+        count = 0
+        with self.transaction():
+            for values in rows:
+                primary_key = model._primary_key_of(values)
+                stored = self.get(model, primary_key)
+                if not stored:
+                    if conflict == 'ignore' and self._unique_conflict(model, values):
+                        continue
+                    count += bool(self.insert(model, values))
+                    continue
+                if conflict == 'ignore':
+                    continue
+                if conflict == 'update-newer':
+                    current = stored[0][model.VERSION_COLUMN]
+                    if current is not None and not (
+                            values[version] is not None and values[version] > current):
+                        continue
+                columns = {
+                    c: v for c, v in zip(model.COLUMNS, values)
+                    if c not in model.PRIMARY_KEYS}
+                if columns:
+                    count += bool(self.update(model, columns, primary_key))
+        return count
+
+    def project(self, model, columns, condition=None):
+        """
+        Read numeric columns of the records which match the condition.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+        columns : list(str)
+            The column names.
+        condition : dict or None
+            Column names with condition value.
+
+        Returns
+        -------
+        values : dict
+            An ``array('d')`` of the values of every column, in the same
+            record order, NULL is read as 0.0.
+        """
+        records = self.scan(model, condition)
+        return {
+            c: array('d', [0.0 if r[c] is None else r[c] for r in records])
+            for c in columns
+        }
+
+    def aggregate(self, model, function, column, condition=None):
+        """
+        Compute 'COUNT', 'MIN' or 'MAX' of a column.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+        function : str
+            One of 'COUNT', 'MIN' and 'MAX'.
+        column : str
+            The column name, '*' for 'COUNT'.
+        condition : dict or None
+            Column names with condition value.
+        """
+        raise NotImplementedError()
+
+    def group_count(self, model, column, condition=None):
+        """
+        Count the records of every value of a column.
+
+        Returns
+        -------
+        counts : dict
+            The number of records of every value of the column.
+        """
+        raise NotImplementedError()
+
+    def counters(self, model, column):
+        """
+        Read the maintained counters of a column of `COUNTER_COLUMNS`.
+
+        Returns
+        -------
+        counts : dict
+            The number of records of every value of the column, or of
+            every tuple of values of a tuple of columns.
+        """
+        raise NotImplementedError()
+
+    def collisions(self, model, column, member):
+        """
+        Group the records by the values of a column which several records
+        hold.
+
+        Returns
+        -------
+        collisions : list(list)
+            The `member` column values of the records of every value of
+            `column` which two or more records hold.
+        """
+        groups = {}
+        for record in self.scan(model) or []:
+            groups.setdefault(record[column], []).append(record[member])
+        return [g for g in groups.values() if len(g) > 1]
+
+    def _order(self, order_by):
+        """
+        Parse the 'ORDER BY' clause into a list of (column, reverse).
+        """
+        result = []
+        for term in order_by.split(','):
+            words = term.split()
+            result.append((words[0], len(words) > 1 and words[1].lower() == 'desc'))
+        return result
+
+    def load_related(self, relation, keys):
+        """
+        Read the related records of several records of a relation.
+
+        Returns
+        -------
+        related : dict
+            The list of the related records of every key.
+        """
+        result = {key: [] for key in keys}
+        for key in keys:
+            for link in self.scan(relation.through, {relation.key: key}) or []:
+                result[key].extend(self.get(relation.model, link[relation.other_key]))
+        return result
+
+    def scan_related(self, relation, column, values, condition=None, order_by=None,
+                     size=None):
+        """
+        Records of the owner model of a relation which are related to a
+        record of every value of a column of the related model.
+
+        Returns
+        -------
+        object : list(object)
+            The records of the owner model.
+        """
+        keys = None
+        for value in values:
+            related = set()
+            for record in self.scan(relation.model, {column: value}) or []:
+                links = self.scan(
+                    relation.through,
+                    {relation.other_key: record._primary_key_value()}) or []
+                related.update(link[relation.key] for link in links)
+            keys = related if keys is None else keys & related
+        result = [r for key in keys or () for r in self.get(relation.owner, key)]
+        if condition:
+            result = [
+                r for r in result if all(_match(r[k], v) for k, v in condition.items())]
+        for column, reverse in reversed(self._order(order_by or relation.owner.PRIMARY_KEY)):
+            result.sort(key=lambda r: _sort_key(r[column]), reverse=reverse)
+        return result[:size] if size else result
+
+    def walk_tree(self, tree, roots=None):
+        """
+        Read the subtrees of a tree.
+
+        Parameters
+        ----------
+        tree : Tree
+            The tree of a model.
+        roots : list or None
+            The primary keys of the roots, the records without a parent if
+            None.
+
+        Returns
+        -------
+        nodes : list(Node)
+            The records of the subtrees depth first, the children of a
+            record ordered by their primary key.
+        """
+        model = tree.owner
+        if roots is None:
+            top = self.scan(model, {tree.key: Compare('IS', None)})
+        else:
+            top = [r for key in roots for r in self.get(model, key)]
+        nodes = []
+
+        def visit(record, depth):
+            index = len(nodes)
+            nodes.append(None)
+            done = total = 0
+            children = self.scan(model, {tree.key: record[model.PRIMARY_KEY]})
+            for child in sorted(children, key=lambda r: r[model.PRIMARY_KEY]):
+                child_done, child_total = visit(child, depth + 1)
+                done += child_done
+                total += child_total
+            nodes[index] = Node(record, depth, done if tree.rollup else None, total)
+            return done + bool(tree.rollup and record[tree.rollup]), total + 1
+
+        for record in sorted(top, key=lambda r: r[model.PRIMARY_KEY]):
+            visit(record, 0)
+        return nodes
+
+    def update_tree(self, tree, root, values):
+        """
+        Update the columns of a record and of all its descendants.
+
+        Returns
+        -------
+        count : int
+            The number of the updated records.
+        """
+        model = tree.owner
+        keys = [root]
+        count = 0
+        with self.transaction():
+            while keys:
+                key = keys.pop()
+                keys.extend(
+                    r[model.PRIMARY_KEY] for r in self.scan(model, {tree.key: key}))
+                count += bool(self.update(model, values, key))
+        return count
+
+    def changes_since(self, model, seq, size=None):
+        """
+        Read the changes of the records after a sequence number.
+
+        Returns
+        -------
+        changes : list(Change)
+            The changes ordered by their sequence number.
+        """
+        raise NotImplementedError()
+
+    def last_change_seq(self, model):
+        """
+        Return the sequence number of the latest change, 0 if none.
+        """
+        raise NotImplementedError()
+
+    def first_change_seq(self, model):
+        """
+        Return the sequence number of the oldest change which is kept, 0 if
+        none. A consumer which has read up to a lower number than the one
+        before it has missed the pruned changes.
+        """
+        raise NotImplementedError()
+
+    def prune_changes(self, model, seq):
+        """
+        Delete the changes up to a sequence number, except the latest one
+        which keeps `last_change_seq()`.
+
+        Returns
+        -------
+        count : int
+            The number of the deleted changes.
+        """
+        raise NotImplementedError()
+
+    def data_version(self):
+        """
+        Return a number which moves when another connection commits.
+        """
+        raise NotImplementedError()
+
+    def transaction(self):
+        """
+        Return a context manager which runs the block in a transaction.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Release the resources of the backend.
+        """
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Storage backend which issues SQL statements through `SQLConnection`.
+    """
+    CHANGE_FEED = True
+
+    def __init__(self, connection=None):
+        """
+        Parameters
+        ----------
+        connection : object or None
+            An object which provides ``execute()`` and ``transaction()``
+            like `SQLConnection`, the `SQLConnection` singleton if None.
+        """
+        self._connection = connection
+
+    @property
+    def connection(self):
+        """
+        The connection which the statements are executed with.
+        """
+        return self._connection if self._connection else SQLConnection()
+
+    def table_sql(self, model, name=None):
+        """
+        CREATE TABLE SQL statement of the model.
+
+        Parameters
+        ----------
+        model : type
+            The model class.
+        name : str or None
+            The name of the table, `TABLE_NAME` of the model if None.
+        """
+        values = []
+        composite = len(model.PRIMARY_KEYS) > 1
+        for key, field in model.COLUMN_TO_FILED.items():
+            sql = ' '.join([
+                key, field.column_type,
+                'PRIMARY KEY' if field.primary_key and not composite else ''])
+            values.append(sql)
+        if composite:
+            values.append('PRIMARY KEY ({})'.format(', '.join(model.PRIMARY_KEYS)))
+        return 'CREATE TABLE IF NOT EXISTS {} ({})'.format(
+            name if name else model.TABLE_NAME, ','.join(values))
+
+    def create_table(self, model):
+        """
+        Execute create table SQL statement, and the create index and create
+        trigger SQL statements of `INDEXES`, `UNIQUE_INDEXES`,
+        `COUNTER_COLUMNS` and the change feed of a model with `CHANGE_FEED`.
+
+        A unique index is not created over the records which already
+        repeat its columns, ValueError tells their values.
+        """
+        with TRACER.span('create_table', table=model.TABLE_NAME):
+            cursor = self.connection.execute(self.table_sql(model))
+            cursor.close()
+            for columns in model.INDEXES:
+                self.connection.execute(
+                    'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                        self.index_name(model, columns), model.TABLE_NAME,
+                        ', '.join(columns))
+                ).close()
+            for columns in model.UNIQUE_INDEXES:
+                try:
+                    self.connection.execute(
+                        'CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                            self.index_name(model, columns, unique=True), model.TABLE_NAME,
+                            ', '.join(columns))
+                    ).close()
+                except IntegrityError:
+                    cursor = self.connection.execute(
+                        'SELECT {0} FROM {1} GROUP BY {0} HAVING COUNT(*) > 1'.format(
+                            ', '.join(columns), model.TABLE_NAME))
+                    repeated = cursor.fetchall()
+                    cursor.close()
+                    raise ValueError(
+                        'The records of {} repeat the {} {}, merge them before the '
+                        'unique index is created.'.format(
+                            model.TABLE_NAME, ', '.join(columns),
+                            ', '.join(repr(v[0] if len(v) == 1 else v) for v in repeated)))
+            if model.COUNTER_COLUMNS:
+                self.create_counters(model)
+            if model.CHANGE_FEED:
+                self.create_changelog(model)
+
+    def index_name(self, model, columns, unique=False):
+        """
+        Name of the index of the columns of `INDEXES`, e.g.
+        'Todo_list_id_is_completed_due_at', or of `UNIQUE_INDEXES`, e.g.
+        'Tag_name_unique'.
+        """
+        return '{}_{}{}'.format(model.TABLE_NAME, '_'.join(
+            w for c in columns for w in re.findall(r'\w+', c)
+            if w.upper() not in ('ASC', 'DESC')), '_unique' if unique else '')
+
+    def create_counters(self, model):
+        """
+        Execute create table and create trigger SQL statements of the
+        counters of `COUNTER_COLUMNS`.
+
+        The counters of a column are seeded from the existing records when
+        the counter table has none of them, i.e. when it is created or the
+        column is new in `COUNTER_COLUMNS`, afterwards the triggers keep
+        them up to date on every 'INSERT', 'DELETE' and 'UPDATE' of the
+        counted columns. The counters of a tuple of columns are named
+        after the columns joined by ',' and their values are the JSON
+        arrays of the values of the columns.
+        """
+        counter = model._counter_table()
+        conn = self.connection
+        with conn.transaction():
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS {} (name TEXT NOT NULL, value, '
+                'count INTEGER NOT NULL DEFAULT 0, '
+                'PRIMARY KEY (name, value))'.format(counter)).close()
+            cursor = conn.execute('SELECT DISTINCT name FROM {}'.format(counter))
+            seeded = {name for (name,) in cursor.fetchall()}
+            cursor.close()
+            for column in model.COUNTER_COLUMNS:
+                columns = (column,) if isinstance(column, str) else tuple(column)
+                name = self.counter_name(column)
+                value = '{}' if len(columns) == 1 else 'json_array({})'
+                new, old = [value.format(', '.join(row + c for c in columns))
+                            for row in ('NEW.', 'OLD.')]
+                increment = (
+                    "INSERT INTO {0} (name, value, count) VALUES ('{1}', {2}, 1) "
+                    "ON CONFLICT (name, value) DO UPDATE SET count = count + 1;"
+                ).format(counter, name, new)
+                decrement = (
+                    "UPDATE {0} SET count = count - 1 "
+                    "WHERE name = '{1}' AND value = {2};"
+                ).format(counter, name, old)
+                triggers = [
+                    ('insert', 'AFTER INSERT', '', increment),
+                    ('delete', 'AFTER DELETE', '', decrement),
+                    ('update', 'AFTER UPDATE OF {}'.format(', '.join(columns)),
+                     'WHEN ' + ' OR '.join('OLD.{0} IS NOT NEW.{0}'.format(c)
+                                           for c in columns),
+                     decrement + ' ' + increment),
+                ]
+                for suffix, event, when, body in triggers:
+                    conn.execute(
+                        'CREATE TRIGGER IF NOT EXISTS {0}_{1}_{2} {3} ON {0} '
+                        '{4} BEGIN {5} END'.format(
+                            model.TABLE_NAME, '_'.join(columns), suffix, event, when, body)
+                    ).close()
+                if name not in seeded:
+                    conn.execute(
+                        "INSERT INTO {0} (name, value, count) "
+                        "SELECT '{1}', {2}, COUNT(*) FROM {3} GROUP BY {4}".format(
+                            counter, name, value.format(', '.join(columns)),
+                            model.TABLE_NAME, ', '.join(columns))
+                    ).close()
+
+    def counter_name(self, column):
+        """
+        Name of the counters of a column of `COUNTER_COLUMNS`, e.g.
+        'is_completed', or of a tuple of columns, e.g.
+        'list_id,is_completed'.
+        """
+        return column if isinstance(column, str) else ','.join(column)
+
+    def create_changelog(self, model):
+        """
+        Execute create table and create trigger SQL statements of the
+        change feed of the model.
+
+        The triggers append the operation, the primary key and the written
+        columns of every 'INSERT', 'DELETE' and 'UPDATE' to the
+        `<TABLE_NAME>Changes` table, its AUTOINCREMENT `seq` never goes
+        back, even after the latest changes are deleted.
+        """
+        changes = model._changes_table()
+        # A composite primary key is stored as a JSON array.
+        if len(model.PRIMARY_KEYS) == 1:
+            primary_key = '{{0}}.{}'.format(model.PRIMARY_KEY)
+        else:
+            primary_key = 'json_array({})'.format(
+                ', '.join('{{0}}.{}'.format(k) for k in model.PRIMARY_KEYS))
+        written = ' || '.join(
+            "CASE WHEN OLD.{0} IS NOT NEW.{0} THEN ',{0}' ELSE '' END".format(c)
+            for c in model.COLUMNS)
+        conn = self.connection
+        with conn.transaction():
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS {} (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'op TEXT NOT NULL, row_id, columns TEXT NOT NULL)'.format(changes)
+            ).close()
+            triggers = [
+                ('insert', 'AFTER INSERT', '',
+                 "VALUES ('insert', {}, '{}')".format(
+                     primary_key.format('NEW'), ','.join(model.COLUMNS))),
+                ('delete', 'AFTER DELETE', '',
+                 "VALUES ('delete', {}, '')".format(primary_key.format('OLD'))),
+                ('update', 'AFTER UPDATE',
+                 'WHEN ' + ' OR '.join(
+                     'OLD.{0} IS NOT NEW.{0}'.format(c) for c in model.COLUMNS),
+                 "VALUES ('update', {}, substr({}, 2))".format(
+                     primary_key.format('NEW'), written)),
+            ]
+            for suffix, event, when, values in triggers:
+                conn.execute(
+                    'CREATE TRIGGER IF NOT EXISTS {0}_changes_{1} {2} ON {0} {3} '
+                    'BEGIN INSERT INTO {4} (op, row_id, columns) {5}; END'.format(
+                        model.TABLE_NAME, suffix, event, when, changes, values)
+                ).close()
+
+    def is_migrated(self, models, version):
+        """
+        Whether the database has the schema version, so its tables can be
+        read without `migrate()`.
+        """
+        return Migration(models, version, self).current_version() >= version
+
+    def migrate(self, models, version, **options):
+        """
+        Migrate the tables of the models with `Migration` and create them.
+
+        The `options` are passed to `Migration`, e.g. `batch_size`.
+
+        The database is switched to the WAL journal mode first, it is kept
+        in the file: the readers then neither block the writer nor wait
+        for it, and a commit appends to the log instead of rewriting pages.
+        """
+        self.connection.execute('PRAGMA journal_mode=WAL').close()
+        Migration(models, version, self, **options).migrate()
+        for model in models:
+            self.create_table(model)
+
+    def drop_table(self, model):
+        """
+        Execute drop table SQL statement.
+        """
+        sql = 'DROP TABLE {}'.format(model.TABLE_NAME)
+        cursor = self.connection.execute(sql)
+        cursor.close()
+        if model.COUNTER_COLUMNS:
+            cursor = self.connection.execute(
+                'DROP TABLE IF EXISTS {}'.format(model._counter_table()))
+            cursor.close()
+        cursor = self.connection.execute(
+            'DROP TABLE IF EXISTS {}'.format(model._changes_table()))
+        cursor.close()
+
+    def insert(self, model, values):
+        """
+        Execute 'INSERT' statement.
+        """
+        columns = model.COLUMNS
+        sql = 'INSERT INTO {} ({}) VALUES({})'.format(
+            model.TABLE_NAME,
+            ', '.join(columns),
+            ','.join('?'*len(columns))
+        )
+        if model.COMPRESSED_COLUMNS:
+            values = self._compress_row(model, values)
+        cursor = self.connection.execute(sql, values)
+        count = cursor.rowcount
+        cursor.close()
+        return count == 1
+
+    def _compress_row(self, model, values):
+        """
+        The values of a record in the order of `COLUMNS` with the texts of
+        its `CompressedTextField` columns compressed.
+        """
+        values = list(values)
+        for column, field in model.COMPRESSED_COLUMNS.items():
+            i = model.COLUMNS.index(column)
+            values[i] = field.compress(values[i])
+        return values
+
+    def _compress_values(self, model, values):
+        """
+        A dict of column values with the texts of the `CompressedTextField`
+        columns compressed.
+        """
+        fields = model.COMPRESSED_COLUMNS
+        return {k: fields[k].compress(v) if k in fields else v for k, v in values.items()}
+
+    def _key_args(self, model, primary_key):
+        """
+        Arguments of the primary key columns, see `PRIMARY_KEYS`.
+        """
+        return [primary_key] if len(model.PRIMARY_KEYS) == 1 else list(primary_key)
+
+    def get(self, model, primary_key):
+        """
+        Execute 'SELECT' and 'WHERE' statement with primary key.
+        """
+        sql = '{} WHERE {}'.format(
+            model._select(),
+            ' AND '.join('{} = ?'.format(k) for k in model.PRIMARY_KEYS))
+        cursor = self.connection.execute(sql, self._key_args(model, primary_key))
+        cursor.row_factory = model.ROW_FACTORY
+        result = cursor.fetchmany(1)
+        cursor.close()
+        return result
+
+    def scan(self, model, condition=None, order_by=None, size=None):
+        """
+        Execute 'SELECT' statement with optional 'WHERE' and 'ORDER BY'.
+        """
+        sql = [model._select()]
+        where, args = model._where(condition)
+        if where:
+            sql.append(where)
+        if order_by:
+            sql.append('ORDER BY')
+            sql.append(order_by)
+        if size:
+            sql.append('LIMIT ?')
+            args.append(size)
+        cursor = self.connection.execute(' '.join(sql), args)
+        cursor.row_factory = model.ROW_FACTORY
+        with TRACER.span('fetch', table=model.TABLE_NAME), \
+                PROFILER.phase('fetch') as phase:
+            result = cursor.fetchall()
+            if phase is not None:
+                phase['rows'] = len(result)
+        cursor.close()
+        return result
+
+    def update(self, model, values, primary_key):
+        """
+        Execute 'UPDATE' statement.
+        """
+        sql = 'UPDATE {} SET  {} where {}'.format(
+           model.TABLE_NAME,
+           ', '.join(map(lambda f: '{}=?'.format(f), values)),
+           ' AND '.join('{}=?'.format(k) for k in model.PRIMARY_KEYS)
+        )
+        if model.COMPRESSED_COLUMNS:
+            values = self._compress_values(model, values)
+        args = list(values.values())
+        args.extend(self._key_args(model, primary_key))
+        cursor = self.connection.execute(sql, args)
+        count = cursor.rowcount
+        cursor.close()
+        return count == 1
+
+    def upsert_sql(self, model, conflict='replace'):
+        """
+        The 'INSERT ... ON CONFLICT' statement of a conflict mode.
+
+        'update-newer' guards the 'DO UPDATE' with
+        ``WHERE excluded.<VERSION_COLUMN> > <VERSION_COLUMN>``, so an older
+        record neither writes the row nor fires its triggers.
+        """
+        self._check_conflict(model, conflict)
+        columns = model.COLUMNS
+        sql = 'INSERT INTO {} ({}) VALUES({}) ON CONFLICT '.format(
+            model.TABLE_NAME,
+            ', '.join(columns),
+            ','.join('?'*len(columns)),
+        )
+        updated = [c for c in columns if c not in model.PRIMARY_KEYS]
+        if conflict == 'ignore' or not updated:
+            # Without a target it also keeps a record of `UNIQUE_INDEXES`.
+            return sql + 'DO NOTHING'
+        sql += '({}) DO '.format(', '.join(model.PRIMARY_KEYS))
+        sql += 'UPDATE SET {}'.format(
+            ', '.join('{0}=excluded.{0}'.format(c) for c in updated))
+        if conflict == 'update-newer':
+            sql += ' WHERE {1}.{0} IS NULL OR excluded.{0} > {1}.{0}'.format(
+                model.VERSION_COLUMN, model.TABLE_NAME)
+        return sql
+
+    def upsert(self, model, rows, conflict='replace', batch_size=500):
+        """
+        Execute 'INSERT ... ON CONFLICT' statement, a statement per record.
+
+        The statement is prepared once and executed with `batch_size`
+        records per `executemany()` call, all of them in a transaction.
+        """
+        sql = self.upsert_sql(model, conflict)
+        rows = iter(rows)
+        if model.COMPRESSED_COLUMNS:
+            rows = (self._compress_row(model, row) for row in rows)
+        count = 0
+        with TRACER.span('upsert', table=model.TABLE_NAME), self.transaction():
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                cursor = self.connection.executemany(sql, batch)
+                count += cursor.rowcount
+                cursor.close()
+        return count
+
+    def delete(self, model, primary_key):
+        """
+        Execute 'DELETE' statement.
+        """
+        cursor = self.connection.execute(
+            model._delete(), self._key_args(model, primary_key))
+        count = cursor.rowcount
+        cursor.close()
+        return count == 1
+
+    # The number of records fetched at once by `project()`.
+    PROJECT_CHUNK = 65536
+
+    def project(self, model, columns, condition=None):
+        """
+        Execute a 'SELECT' statement of the columns only and append its
+        rows chunk by chunk to the arrays, without a row factory.
+        """
+        sql = ['SELECT {} FROM {}'.format(
+            ', '.join('IFNULL({}, 0.0)'.format(c) for c in columns), model.TABLE_NAME)]
+        where, args = model._where(condition)
+        if where:
+            sql.append(where)
+        result = {c: array('d') for c in columns}
+        getters = [(result[c], operator.itemgetter(i)) for i, c in enumerate(columns)]
+        cursor = self.connection.execute(' '.join(sql), args)
+        with TRACER.span('fetch', table=model.TABLE_NAME):
+            while True:
+                rows = cursor.fetchmany(self.PROJECT_CHUNK)
+                if not rows:
+                    break
+                for values, getter in getters:
+                    values.extend(map(getter, rows))
+        cursor.close()
+        return result
+
+    def aggregate(self, model, function, column, condition=None):
+        """
+        Execute an aggregate 'SELECT' statement.
+        """
+        sql = ['SELECT {}({}) FROM {}'.format(function, column, model.TABLE_NAME)]
+        where, args = model._where(condition)
+        if where:
+            sql.append(where)
+        cursor = self.connection.execute(' '.join(sql), args)
+        result = cursor.fetchone()
+        cursor.close()
+        return result[0]
+
+    def group_count(self, model, column, condition=None):
+        """
+        Execute 'SELECT COUNT(*) ... GROUP BY' statement.
+        """
+        sql = ['SELECT {}, COUNT(*) FROM {}'.format(column, model.TABLE_NAME)]
+        where, args = model._where(condition)
+        if where:
+            sql.append(where)
+        sql.append('GROUP BY {}'.format(column))
+        cursor = self.connection.execute(' '.join(sql), args)
+        result = dict(cursor.fetchall())
+        cursor.close()
+        return result
+
+    def counters(self, model, column):
+        """
+        Read the counter rows which the triggers maintain.
+        """
+        cursor = self.connection.execute(
+            'SELECT value, count FROM {} WHERE name=?'.format(model._counter_table()),
+            [self.counter_name(column)])
+        result = dict(cursor.fetchall())
+        cursor.close()
+        if not isinstance(column, str):
+            result = {tuple(json.loads(value)): count for value, count in result.items()}
+        return result
+
+    def collisions(self, model, column, member):
+        """
+        Execute 'SELECT json_group_array(...) ... GROUP BY ... HAVING'
+        statement, an index which starts with the column groups the records
+        without sorting them.
+        """
+        cursor = self.connection.execute(
+            'SELECT json_group_array({}) FROM {} GROUP BY {} HAVING COUNT(*) > 1'.format(
+                member, model.TABLE_NAME, column))
+        result = [json.loads(members) for members, in cursor.fetchall()]
+        cursor.close()
+        return result
+
+    # The number of keys bound in a single 'IN (...)' list.
+    KEYS_PER_QUERY = 500
+
+    def load_related(self, relation, keys):
+        """
+        Execute a single 'SELECT ... JOIN' statement of the join table and
+        the related table for the keys.
+        """
+        through = relation.through.TABLE_NAME
+        model = relation.model
+        result = {key: [] for key in keys}
+        for i in range(0, len(keys), self.KEYS_PER_QUERY):
+            chunk = keys[i:i + self.KEYS_PER_QUERY]
+            sql = (
+                'SELECT J.{0}, {1} FROM {2} J JOIN {3} R ON R.{4} = J.{5} '
+                'WHERE J.{0} IN ({6}) ORDER BY J.{0}, R.{4}'.format(
+                    relation.key,
+                    ', '.join('R.{}'.format(c) for c in model.COLUMNS),
+                    through, model.TABLE_NAME, model.PRIMARY_KEY, relation.other_key,
+                    ','.join('?' * len(chunk))))
+            cursor = self.connection.execute(sql, chunk)
+            for row in cursor.fetchall():
+                result[row[0]].append(model.ROW_FACTORY(None, row[1:]))
+            cursor.close()
+        return result
+
+    def scan_related(self, relation, column, values, condition=None, order_by=None,
+                     size=None):
+        """
+        Execute a single 'SELECT' statement whose primary keys are the
+        'INTERSECT' of an indexed join per value.
+        """
+        model = relation.model
+        owner = relation.owner
+        related = ' INTERSECT '.join(
+            'SELECT J.{0} FROM {1} J JOIN {2} R ON R.{3} = J.{4} WHERE R.{5} = ?'.format(
+                relation.key, relation.through.TABLE_NAME, model.TABLE_NAME,
+                model.PRIMARY_KEY, relation.other_key, column)
+            for _ in values)
+        sql = ['{} WHERE {} IN ({})'.format(owner._select(), owner.PRIMARY_KEY, related)]
+        args = list(values)
+        where, condition_args = owner._where(condition)
+        if where:
+            sql.append('AND' + where[len('WHERE'):])
+            args.extend(condition_args)
+        if order_by:
+            sql.append('ORDER BY')
+            sql.append(order_by)
+        if size:
+            sql.append('LIMIT ?')
+            args.append(size)
+        cursor = self.connection.execute(' '.join(sql), args)
+        cursor.row_factory = owner.ROW_FACTORY
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
+    def walk_tree(self, tree, roots=None):
+        """
+        Execute a single 'WITH RECURSIVE' statement which reads the subtrees
+        depth first and sums up the rollup of the descendants of every
+        record.
+
+        The `tree` CTE walks down from the roots and keeps the path of
+        zero-padded keys, which orders the records depth first. The
+        `closure` CTE pairs every record with each of its descendants, the
+        rollup is a 'GROUP BY' of it.
+        """
+        model = tree.owner
+        table = model.TABLE_NAME
+        key = model.PRIMARY_KEY
+        if roots is None:
+            seed, args = '{} IS NULL'.format(tree.key), []
+        else:
+            seed, args = '{} IN ({})'.format(key, ','.join('?' * len(roots))), list(roots)
+        sql = (
+            'WITH RECURSIVE '
+            'tree(key, depth, path) AS ('
+            "SELECT {1}, 0, printf('%020d', {1}) FROM {0} WHERE {3} "
+            'UNION ALL '
+            "SELECT C.{1}, tree.depth + 1, tree.path || printf('%020d', C.{1}) "
+            'FROM {0} C JOIN tree ON C.{2} = tree.key), '
+            'closure(ancestor, key) AS ('
+            'SELECT key, key FROM tree '
+            'UNION ALL '
+            'SELECT closure.ancestor, C.{1} FROM {0} C JOIN closure ON C.{2} = closure.key), '
+            'rollup(key, done, total) AS ('
+            'SELECT closure.ancestor, {4}, COUNT(*) FROM closure '
+            'JOIN {0} R ON R.{1} = closure.key '
+            'WHERE closure.key != closure.ancestor GROUP BY closure.ancestor) '
+            'SELECT {5}, tree.depth, rollup.done, COALESCE(rollup.total, 0) '
+            'FROM tree JOIN {0} R ON R.{1} = tree.key '
+            'LEFT JOIN rollup ON rollup.key = tree.key '
+            'ORDER BY tree.path'.format(
+                table, key, tree.key, seed,
+                'SUM(R.{})'.format(tree.rollup) if tree.rollup else 'NULL',
+                ', '.join('R.{}'.format(c) for c in model.COLUMNS)))
+        cursor = self.connection.execute(sql, args)
+        columns = len(model.COLUMNS)
+        row_factory = model.ROW_FACTORY
+        result = []
+        for row in cursor.fetchall():
+            depth, done, total = row[columns:]
+            if tree.rollup:
+                done = done or 0
+            result.append(Node(row_factory(None, row[:columns]), depth, done, total))
+        cursor.close()
+        return result
+
+    def update_tree(self, tree, root, values):
+        """
+        Execute a single 'UPDATE' statement of the record and all its
+        descendants, which are selected by a 'WITH RECURSIVE' subquery.
+        """
+        model = tree.owner
+        # The statement starts with UPDATE, sqlite3 reports the rowcount of
+        # DML statements only.
+        sql = (
+            'UPDATE {0} SET {3} WHERE {1} IN ('
+            'WITH RECURSIVE tree(key) AS ('
+            'SELECT ? UNION ALL '
+            'SELECT C.{1} FROM {0} C JOIN tree ON C.{2} = tree.key) '
+            'SELECT key FROM tree)'.format(
+                model.TABLE_NAME, model.PRIMARY_KEY, tree.key,
+                ', '.join('{}=?'.format(c) for c in values)))
+        if model.COMPRESSED_COLUMNS:
+            values = self._compress_values(model, values)
+        cursor = self.connection.execute(sql, list(values.values()) + [root])
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def changes_since(self, model, seq, size=None):
+        """
+        Execute 'SELECT' statement of the change feed table.
+        """
+        sql = 'SELECT seq, op, row_id, columns FROM {} WHERE seq > ? ORDER BY seq'.format(
+            model._changes_table())
+        args = [seq]
+        if size:
+            sql += ' LIMIT ?'
+            args.append(size)
+        cursor = self.connection.execute(sql, args)
+        composite = len(model.PRIMARY_KEYS) > 1
+        result = [
+            Change(seq, op, tuple(json.loads(key)) if composite else key,
+                   tuple(columns.split(',')) if columns else ())
+            for seq, op, key, columns in cursor.fetchall()]
+        cursor.close()
+        return result
+
+    def last_change_seq(self, model):
+        """
+        Execute 'SELECT MAX(seq)' statement of the change feed table.
+        """
+        cursor = self.connection.execute(
+            'SELECT MAX(seq) FROM {}'.format(model._changes_table()))
+        result = cursor.fetchone()[0]
+        cursor.close()
+        return result or 0
+
+    def first_change_seq(self, model):
+        """
+        Execute 'SELECT MIN(seq)' statement of the change feed table.
+        """
+        cursor = self.connection.execute(
+            'SELECT MIN(seq) FROM {}'.format(model._changes_table()))
+        result = cursor.fetchone()[0]
+        cursor.close()
+        return result or 0
+
+    def prune_changes(self, model, seq):
+        """
+        Execute 'DELETE' statement of the change feed table.
+        """
+        changes = model._changes_table()
+        cursor = self.connection.execute(
+            'DELETE FROM {0} WHERE seq <= ? AND seq < (SELECT MAX(seq) FROM {0})'.format(
+                changes), [seq])
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def data_version(self):
+        """
+        Read `PRAGMA data_version`, it moves when another connection
+        commits to the database file.
+        """
+        cursor = self.connection.execute('PRAGMA data_version', autocommit=False)
+        result = cursor.fetchone()[0]
+        cursor.close()
+        return result
+
+    def transaction(self):
+        """
+        Return the transaction context manager of the connection.
+        """
+        return self.connection.transaction()
+
+    def close(self):
+        """
+        Close the connection which is given to the backend.
+        """
+        if self._connection:
+            self._connection.close()
+
+
+def _sort_key(value):
+    """
+    Sort key of a column value, `None` is ordered first like SQL NULL.
+    """
+    return (value is not None, value)
+
+
+def _log_key(key):
+    """
+    Primary key of a log record, JSON stores a composite key as a list.
+    """
+    return tuple(key) if isinstance(key, list) else key
+
+
+class _MemoryTable(object):
+    """
+    Records and secondary indexes of a model in `MemoryBackend`.
+    """
+
+    def __init__(self, columns, primary_key, counter_columns=()):
+        self.columns = list(columns)
+        self.position = {c: i for i, c in enumerate(self.columns)}
+        # A composite primary key is a tuple of the column names, its
+        # records are keyed by the tuple of their values.
+        if isinstance(primary_key, str):
+            self.primary_key = primary_key
+            self.key_columns = (primary_key,)
+            self.primary = self.position[primary_key]
+        else:
+            self.primary_key = self.key_columns = tuple(primary_key)
+            self.primary = tuple(self.position[c] for c in primary_key)
+        # A counter of several columns counts the tuples of their values,
+        # the log stores it as a list.
+        self.counter_columns = [
+            tuple(c) if isinstance(c, list) else c for c in counter_columns]
+        self.rows = dict()
+        # Every column has a sorted list of (sort key, primary key) pairs.
+        self.indexes = {c: [] for c in self.columns}
+        self.counters = {c: Counter() for c in self.counter_columns}
+        self.changes = []
+        self.seq = 0
+
+    def key(self, row):
+        """
+        Primary key of a record tuple.
+        """
+        if isinstance(self.primary, tuple):
+            return tuple(row[p] for p in self.primary)
+        return row[self.primary]
+
+    def counted(self, column, row):
+        """
+        Value of a record which the counter of a column counts.
+        """
+        if isinstance(column, tuple):
+            return tuple(row[self.position[c]] for c in column)
+        return row[self.position[column]]
+
+    def count(self, column):
+        """
+        Counters of a column, which are counted from the records when the
+        table was created before the column had a counter.
+        """
+        if column not in self.counters:
+            self.counter_columns.append(column)
+            self.counters[column] = Counter(
+                self.counted(column, row) for row in self.rows.values())
+        return self.counters[column]
+
+    def add(self, row):
+        primary_key = self.key(row)
+        self.rows[primary_key] = row
+        for column, index in self.indexes.items():
+            insort(index, (_sort_key(row[self.position[column]]), primary_key))
+        for column, counter in self.counters.items():
+            counter[self.counted(column, row)] += 1
+
+    def discard(self, primary_key):
+        row = self.rows.pop(primary_key)
+        for column, index in self.indexes.items():
+            entry = (_sort_key(row[self.position[column]]), primary_key)
+            del index[bisect_left(index, entry)]
+        for column, counter in self.counters.items():
+            counter[self.counted(column, row)] -= 1
+        return row
+
+    def replace(self, primary_key, row):
+        """
+        Replace a record, it keeps its position if the primary key is kept.
+        """
+        if self.key(row) != primary_key:
+            self.discard(primary_key)
+            self.add(row)
+            return
+        old = self.rows[primary_key]
+        self.rows[primary_key] = row
+        for column, index in self.indexes.items():
+            position = self.position[column]
+            if old[position] is row[position]:
+                continue
+            del index[bisect_left(index, (_sort_key(old[position]), primary_key))]
+            insort(index, (_sort_key(row[position]), primary_key))
+        for column, counter in self.counters.items():
+            counter[self.counted(column, old)] -= 1
+            counter[self.counted(column, row)] += 1
+
+    def lookup(self, column, value):
+        """
+        Primary keys of the records whose column equals the value.
+        """
+        if value is None:
+            return []
+        index = self.indexes[column]
+        key = _sort_key(value)
+        result = []
+        for i in range(bisect_left(index, (key,)), len(index)):
+            if index[i][0] != key:
+                break
+            result.append(index[i][1])
+        return result
+
+    def match(self, row, condition):
+        return all(_match(row[self.position[k]], v) for k, v in condition.items())
+
+    def record(self, op, primary_key, columns):
+        self.seq += 1
+        self.changes.append(Change(self.seq, op, primary_key, tuple(columns)))
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Storage backend which keeps the records in dicts in the process memory.
+
+    Every column has a sorted secondary index, so equality predicates
+    and ordered scans with a size do not visit every record. Nothing is
+    written to disk, which makes it a fast backend for tests and
+    short-lived jobs.
+    """
+    CHANGE_FEED = True
+
+    def __init__(self):
+        self.tables = dict()
+        self.depth = 0
+        self.undo = []
+
+    def _table(self, model):
+        try:
+            return self.tables[model.TABLE_NAME]
+        except KeyError:
+            raise NameError('no such table: {}'.format(model.TABLE_NAME))
+
+    def _log(self, *entry):
+        if self.depth:
+            self.undo.append(entry)
+
+    def _change(self, table, op, primary_key, columns):
+        table.record(op, primary_key, columns)
+        self._log('unrecord', table)
+
+    def create_table(self, model):
+        if model.TABLE_NAME not in self.tables:
+            self.tables[model.TABLE_NAME] = _MemoryTable(
+                model.COLUMNS, model.PRIMARY_KEY, model.COUNTER_COLUMNS)
+
+    def drop_table(self, model):
+        self._table(model)
+        self._log('create', model.TABLE_NAME, self.tables.pop(model.TABLE_NAME))
+
+    def insert(self, model, values):
+        table = self._table(model)
+        row = tuple(values)
+        primary_key = table.key(row)
+        if primary_key in table.rows:
+            raise IntegrityError('UNIQUE constraint failed: {}.{}'.format(
+                model.TABLE_NAME, model.PRIMARY_KEY))
+        table.add(row)
+        self._log('delete', table, primary_key)
+        self._change(table, 'insert', primary_key, table.columns)
+        return True
+
+    def get(self, model, primary_key):
+        row = self._table(model).rows.get(primary_key)
+        return [] if row is None else [model.ROW_FACTORY(None, row)]
+
+    def _candidates(self, table, condition):
+        """
+        Primary keys which may match the condition, None for every record.
+        """
+        if not condition:
+            return None
+        columns = [c for c, v in condition.items() if not isinstance(v, Compare)]
+        if all(c in columns for c in table.key_columns):
+            value = table.key([condition.get(c) for c in table.columns])
+            return [value] if value in table.rows else []
+        if not columns:
+            return None
+        return table.lookup(columns[0], condition[columns[0]])
+
+    def scan(self, model, condition=None, order_by=None, size=None):
+        row_factory = model.ROW_FACTORY
+        return [row_factory(None, r) for r in self._rows(model, condition, order_by, size)]
+
+    def _rows(self, model, condition=None, order_by=None, size=None):
+        """
+        Record tuples which match the condition, see ``scan()``.
+        """
+        table = self._table(model)
+        candidates = self._candidates(table, condition)
+        order = self._order(order_by) if order_by else []
+        if len(order) == 1 and order[0][0] in table.indexes:
+            # Walk the index of the ordered column and stop at `size`.
+            column, reverse = order[0]
+            index = table.indexes[column]
+            entries = reversed(index) if reverse else iter(index)
+            if candidates is not None:
+                candidates = set(candidates)
+            result = []
+            for _, primary_key in entries:
+                if candidates is not None and primary_key not in candidates:
+                    continue
+                row = table.rows[primary_key]
+                if condition and not table.match(row, condition):
+                    continue
+                result.append(row)
+                if size and len(result) == size:
+                    break
+            return result
+        if candidates is None:
+            rows = list(table.rows.values())
+        else:
+            rows = [table.rows[k] for k in candidates]
+        if condition:
+            rows = [r for r in rows if table.match(r, condition)]
+        for column, reverse in reversed(order):
+            position = table.position[column]
+            rows.sort(key=lambda r: _sort_key(r[position]), reverse=reverse)
+        return rows[:size] if size else rows
+
+    def update(self, model, values, primary_key):
+        table = self._table(model)
+        if primary_key not in table.rows:
+            return False
+        old = table.rows[primary_key]
+        row = list(old)
+        for column, value in values.items():
+            row[table.position[column]] = value
+        row = tuple(row)
+        new_key = table.key(row)
+        if new_key != primary_key and new_key in table.rows:
+            raise IntegrityError('UNIQUE constraint failed: {}.{}'.format(
+                model.TABLE_NAME, model.PRIMARY_KEY))
+        table.replace(primary_key, row)
+        self._log('replace', table, new_key, old)
+        written = [c for c, a, b in zip(table.columns, old, row) if a != b]
+        if written:
+            self._change(table, 'update', new_key, written)
+        return True
+
+    def delete(self, model, primary_key):
+        table = self._table(model)
+        if primary_key not in table.rows:
+            return False
+        self._log('insert', table, table.discard(primary_key))
+        self._change(table, 'delete', primary_key, ())
+        return True
+
+    def project(self, model, columns, condition=None):
+        table = self._table(model)
+        rows = self._rows(model, condition)
+        return {
+            c: array('d', [0.0 if v is None else v
+                           for v in map(operator.itemgetter(table.position[c]), rows)])
+            for c in columns
+        }
+
+    def aggregate(self, model, function, column, condition=None):
+        table = self._table(model)
+        if function == 'COUNT' and column == '*':
+            if not condition:
+                return len(table.rows)
+            return len(self._rows(model, condition))
+        position = table.position[column]
+        if condition:
+            values = [r[position] for r in self._rows(model, condition)]
+        else:
+            values = [table.rows[k][position] for _, k in table.indexes[column]]
+        values = [v for v in values if v is not None]
+        if function == 'COUNT':
+            return len(values)
+        if not values:
+            return None
+        return min(values) if function == 'MIN' else max(values)
+
+    def group_count(self, model, column, condition=None):
+        table = self._table(model)
+        position = table.position[column]
+        return dict(Counter(r[position] for r in self._rows(model, condition)))
+
+    def counters(self, model, column):
+        return dict(self._table(model).count(column))
+
+    def collisions(self, model, column, member):
+        # The index of the column has the records of a value side by side.
+        table = self._table(model)
+        position = table.position[member]
+        result = []
+        for _, entries in groupby(table.indexes[column], key=operator.itemgetter(0)):
+            keys = [k for _, k in entries]
+            if len(keys) > 1:
+                result.append([table.rows[k][position] for k in keys])
+        return result
+
+    def changes_since(self, model, seq, size=None):
+        changes = self._table(model).changes
+        result = changes[bisect_left(changes, (seq + 1,)):]
+        return result[:size] if size else result
+
+    def last_change_seq(self, model):
+        return self._table(model).seq
+
+    def first_change_seq(self, model):
+        changes = self._table(model).changes
+        return changes[0].seq if changes else 0
+
+    def prune_changes(self, model, seq):
+        changes = self._table(model).changes
+        count = min(bisect_left(changes, (seq + 1,)), len(changes) - 1)
+        if count <= 0:
+            return 0
+        del changes[:count]
+        return count
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block in a transaction, the writes are undone if it raises.
+        """
+        self.depth += 1
+        mark = len(self.undo)
+        try:
+            yield self
+        except BaseException:
+            self._rollback(mark)
+            raise
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self.undo = []
+
+    def _rollback(self, mark):
+        while len(self.undo) > mark:
+            entry = self.undo.pop()
+            if entry[0] == 'create':
+                self.tables[entry[1]] = entry[2]
+            elif entry[0] == 'delete':
+                entry[1].discard(entry[2])
+            elif entry[0] == 'insert':
+                entry[1].add(entry[2])
+            elif entry[0] == 'replace':
+                entry[1].replace(entry[2], entry[3])
+            elif entry[0] == 'unrecord':
+                entry[1].changes.pop()
+                entry[1].seq -= 1
+
+
+class LogBackend(MemoryBackend):
+    """
+    Storage backend which appends every write to a record log file.
+
+    The records live in the memory tables of `MemoryBackend`, the log is
+    only appended and never rewritten in place, so a write costs a line
+    of JSON instead of B-tree page updates. The log is synced with
+    `os.fsync` every `sync_every` records and at the end of every
+    transaction, and once it holds `snapshot_every` records the tables
+    are written to a snapshot file and the log is truncated (compaction).
+
+    Opening the backend loads the snapshot and replays the log, the log
+    file is locked until the backend is closed so processes sharing it
+    are serialized.
+
+    The change feed of the memory tables is not logged, it starts again
+    on every open, so its sequence numbers can not be remembered.
+    """
+    CHANGE_FEED = False
+
+    def __init__(self, path, sync_every=100, snapshot_every=10000):
+        """
+        Parameters
+        ----------
+        path : str
+            A path to the log file, the snapshot is stored next to it
+            with the `.snapshot` suffix.
+        sync_every : int
+            The number of records written between two `os.fsync` calls.
+        snapshot_every : int
+            The number of records of the log which triggers a snapshot.
+        """
+        super(LogBackend, self).__init__()
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.sync_every = sync_every
+        self.snapshot_every = snapshot_every
+        self.pending = []
+        self.unsynced = 0
+        self.records = 0
+        self.generation = 0
+        self.file = open(path, 'a+', encoding='utf-8')
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        self._load()
+
+    def _load(self):
+        """
+        Load the snapshot and replay the records of the log.
+        """
+        covered = -1
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            covered = snapshot['generation']
+            self.generation = covered + 1
+            for name, table in snapshot['tables'].items():
+                self.tables[name] = _MemoryTable(
+                    table['columns'], table['primary_key'], table['counters'])
+                for row in table['rows']:
+                    self.tables[name].add(tuple(row))
+        self.file.seek(0)
+        offset = 0
+        for line in self.file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A record which is torn by a crash is the end of the log.
+                break
+            offset += len(line.encode('utf-8'))
+            if 'generation' in record:
+                self.generation = record['generation']
+            elif self.generation > covered:
+                self._replay(record)
+                self.records += 1
+        if self.generation <= covered:
+            # The log is already in the snapshot, the compaction which
+            # wrote the snapshot did not truncate it.
+            self.generation = covered + 1
+            offset = 0
+        self.file.truncate(offset)
+        if offset == 0:
+            self._append_line({'generation': self.generation})
+            self._sync()
+
+    def _replay(self, record):
+        """
+        Apply a record of the log to the memory tables.
+        """
+        op = record['op']
+        if op == 'create':
+            self.tables[record['table']] = _MemoryTable(
+                record['columns'], record['primary_key'], record['counters'])
+        elif op == 'drop':
+            self.tables.pop(record['table'], None)
+        elif op == 'insert':
+            self.tables[record['table']].add(tuple(record['row']))
+        elif op == 'update':
+            self.tables[record['table']].replace(
+                _log_key(record['key']), tuple(record['row']))
+        elif op == 'delete':
+            self.tables[record['table']].discard(_log_key(record['key']))
+
+    def _append_line(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def _record(self, record):
+        """
+        Queue a record, it is written at once outside of a transaction.
+        """
+        self.pending.append(record)
+        if not self.depth:
+            self._write()
+
+    def _write(self, sync=False):
+        """
+        Write the queued records to the log.
+
+        Parameters
+        ----------
+        sync : bool
+            Whether to sync the log even if fewer than `sync_every`
+            records are not synced yet.
+        """
+        for record in self.pending:
+            self._append_line(record)
+        self.unsynced += len(self.pending)
+        self.records += len(self.pending)
+        self.pending = []
+        if self.unsynced and (sync or self.unsynced >= self.sync_every):
+            self._sync()
+        if self.records >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Write the tables to the snapshot file and truncate the log.
+
+        The snapshot records the generation of the log which it covers,
+        so a crash between writing the snapshot and truncating the log
+        does not replay the records twice.
+        """
+        tables = dict()
+        for name, table in self.tables.items():
+            tables[name] = {
+                'columns': table.columns,
+                'primary_key': table.primary_key,
+                'counters': table.counter_columns,
+                'rows': list(table.rows.values()),
+            }
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'generation': self.generation, 'tables': tables}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.generation += 1
+        self.file.truncate(0)
+        self._append_line({'generation': self.generation})
+        self._sync()
+        self.records = 0
+
+    def create_table(self, model):
+        if model.TABLE_NAME in self.tables:
+            return
+        super(LogBackend, self).create_table(model)
+        self._record({
+            'op': 'create', 'table': model.TABLE_NAME,
+            'columns': list(model.COLUMNS),
+            'primary_key': model.PRIMARY_KEY,
+            'counters': list(model.COUNTER_COLUMNS),
+        })
+
+    def drop_table(self, model):
+        super(LogBackend, self).drop_table(model)
+        self._record({'op': 'drop', 'table': model.TABLE_NAME})
+
+    def insert(self, model, values):
+        super(LogBackend, self).insert(model, values)
+        self._record({'op': 'insert', 'table': model.TABLE_NAME, 'row': list(values)})
+        return True
+
+    def update(self, model, values, primary_key):
+        if not super(LogBackend, self).update(model, values, primary_key):
+            return False
+        table = self.tables[model.TABLE_NAME]
+        if len(model.PRIMARY_KEYS) == 1:
+            key = values.get(model.PRIMARY_KEY, primary_key)
+        else:
+            key = tuple(
+                values.get(c, v) for c, v in zip(model.PRIMARY_KEYS, primary_key))
+        self._record({
+            'op': 'update', 'table': model.TABLE_NAME,
+            'key': primary_key, 'row': list(table.rows[key]),
+        })
+        return True
+
+    def delete(self, model, primary_key):
+        if not super(LogBackend, self).delete(model, primary_key):
+            return False
+        self._record({'op': 'delete', 'table': model.TABLE_NAME, 'key': primary_key})
+        return True
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block in a transaction, its records are written and synced
+        together when the outermost block exits and dropped if it raises.
+        """
+        mark = len(self.pending)
+        try:
+            with super(LogBackend, self).transaction():
+                yield self
+        except BaseException:
+            del self.pending[mark:]
+            raise
+        if not self.depth:
+            self._write(sync=True)
+
+    def close(self):
+        """
+        Write and sync the queued records and release the log file.
+        """
+        if self.file.closed:
+            return
+        self._write(sync=True)
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class ShardedBackend(StorageBackend):
+    """
+    Storage backend which spreads the records over several SQLite files.
+
+    With ``by='hash'`` a record is stored in the shard of the CRC32 of its
+    primary key, so point lookups, updates and deletes go to one shard.
+    With ``by='month'`` it is stored in the shard of the month of its
+    `month_column`, a new shard file is created for every month and point
+    lookups ask the shards one by one.
+
+    Scans are sent to every shard, optionally in parallel threads, and
+    the sorted results are merged so ``order_by`` and ``size`` keep their
+    meaning. A transaction spans a transaction of every shard, but the
+    shards are committed one after another, not atomically.
+    """
+
+    def __init__(self, path, shards=4, by='hash', month_column='created_at',
+                 parallel=False):
+        """
+        Parameters
+        ----------
+        path : str
+            The path prefix of the shard files, e.g. '/tmp/data.db' stores
+            the shards in '/tmp/data.db.0', '/tmp/data.db.1', ...
+        shards : int
+            The number of shards of the 'hash' mode.
+        by : str
+            'hash' or 'month'.
+        month_column : str
+            The epoch time column which the 'month' mode is sharded by.
+        parallel : bool
+            Whether to query the shards in parallel threads.
+        """
+        if by not in ('hash', 'month'):
+            raise ValueError('Unknown shard mode: {}'.format(by))
+        self.path = path[len('file:'):] if path.startswith('file:') else path
+        self.by = by
+        self.month_column = month_column
+        self.models = dict()
+        self.backends = dict()
+        if by == 'hash':
+            names = [str(i) for i in range(shards)]
+        else:
+            names = sorted(
+                p[len(self.path) + 1:] for p in glob.glob(self.path + '.*-*'))
+        for name in names:
+            self._open_shard(name)
+        self.executor = ThreadPoolExecutor(max(shards, 4)) if parallel else None
+
+    def _open_shard(self, name):
+        connection = Connection(
+            'file:{}.{}'.format(self.path, name), check_same_thread=False)
+        backend = SQLiteBackend(connection)
+        for model in self.models.values():
+            backend.create_table(model)
+        self.backends[name] = backend
+        return backend
+
+    def _shard_name(self, model, values):
+        """
+        Name of the shard of a record.
+        """
+        if self.by == 'hash':
+            return str(self._hash(model._primary_key_of(values)))
+        epoch_time = values[model.COLUMNS.index(self.month_column)]
+        return datetime.fromtimestamp(epoch_time or 0).strftime('%Y-%m')
+
+    def _hash(self, primary_key):
+        return zlib.crc32(str(primary_key).encode('utf-8')) % len(self.backends)
+
+    def _primary_shard(self, primary_key):
+        """
+        The shards which may store the primary key, in lookup order.
+        """
+        if self.by == 'hash':
+            return [self.backends[str(self._hash(primary_key))]]
+        return [self.backends[k] for k in sorted(self.backends, reverse=True)]
+
+    def _map(self, function):
+        """
+        Call the function with every shard backend, in parallel if enabled.
+        """
+        backends = [self.backends[k] for k in sorted(self.backends)]
+        if self.executor and len(backends) > 1:
+            return list(self.executor.map(function, backends))
+        return [function(b) for b in backends]
+
+    def create_table(self, model):
+        self.models[model.TABLE_NAME] = model
+        self._map(lambda b: b.create_table(model))
+
+    def migrate(self, models, version, **options):
+        for model in models:
+            self.models[model.TABLE_NAME] = model
+        self._map(lambda b: b.migrate(models, version, **options))
+
+    def drop_table(self, model):
+        self.models.pop(model.TABLE_NAME, None)
+        self._map(lambda b: b.drop_table(model))
+
+    def insert(self, model, values):
+        name = self._shard_name(model, values)
+        backend = self.backends.get(name)
+        if backend is None:
+            backend = self._open_shard(name)
+        return backend.insert(model, values)
+
+    def get(self, model, primary_key):
+        for backend in self._primary_shard(primary_key):
+            result = backend.get(model, primary_key)
+            if result:
+                return result
+        return []
+
+    def _merge_key(self, model, order_by):
+        """
+        Sort key and direction which merge the sorted results of shards.
+
+        Returns None when the terms of ``order_by`` mix directions.
+        """
+        columns = []
+        directions = set()
+        for term in order_by.split(','):
+            words = term.split()
+            columns.append(words[0])
+            directions.add(len(words) > 1 and words[1].lower() == 'desc')
+        if len(directions) > 1:
+            return None
+        key = lambda row: tuple(_sort_key(row[c]) for c in columns)
+        return key, directions.pop()
+
+    def scan(self, model, condition=None, order_by=None, size=None):
+        results = self._map(lambda b: b.scan(model, condition, order_by, size))
+        if not order_by:
+            rows = [row for result in results for row in result]
+        else:
+            merge_key = self._merge_key(model, order_by)
+            if merge_key:
+                key, reverse = merge_key
+                rows = list(islice(merge(*results, key=key, reverse=reverse), size))
+            else:
+                rows = [row for result in results for row in result]
+                for term in reversed(order_by.split(',')):
+                    words = term.split()
+                    column = words[0]
+                    rows.sort(key=lambda r: _sort_key(r[column]),
+                              reverse=len(words) > 1 and words[1].lower() == 'desc')
+        return rows[:size] if size else rows
+
+    def update(self, model, values, primary_key):
+        for backend in self._primary_shard(primary_key):
+            if backend.update(model, values, primary_key):
+                return True
+        return False
+
+    def delete(self, model, primary_key):
+        for backend in self._primary_shard(primary_key):
+            if backend.delete(model, primary_key):
+                return True
+        return False
+
+    def aggregate(self, model, function, column, condition=None):
+        results = self._map(lambda b: b.aggregate(model, function, column, condition))
+        if function == 'COUNT':
+            return sum(results)
+        results = [r for r in results if r is not None]
+        if not results:
+            return None
+        return min(results) if function == 'MIN' else max(results)
+
+    def _sum_counts(self, results):
+        counts = Counter()
+        for result in results:
+            counts.update(result)
+        return dict(counts)
+
+    def group_count(self, model, column, condition=None):
+        return self._sum_counts(
+            self._map(lambda b: b.group_count(model, column, condition)))
+
+    def counters(self, model, column):
+        return self._sum_counts(self._map(lambda b: b.counters(model, column)))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block in a transaction of every shard.
+        """
+        with ExitStack() as stack:
+            for name in sorted(self.backends):
+                stack.enter_context(self.backends[name].transaction())
+            yield self
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+        for backend in self.backends.values():
+            backend.close()
+
+
+class Storage(object):
+    """
+    Holder of the storage backend which every `Model` uses.
+    """
+    BACKEND = None
+    # The backend of `use()` of the current thread, it overrides `BACKEND`.
+    _LOCAL = threading.local()
+
+    @classmethod
+    def initialize(cls, backend=None, **options):
+        """
+        Initialize the storage backend.
+
+        Parameters
+        ----------
+        backend : StorageBackend or str or None
+            A backend instance, or a path which is opened by
+            ``Storage.open()``. The SQLite backend of the default
+            database file if None.
+        options : dict
+            Options of ``Storage.open()``, e.g. `read_only`.
+        """
+        if cls.BACKEND is not None:
+            cls.BACKEND.close()
+        if backend is None and options:
+            backend = SQLConnection.DEFAULT_PATH
+        if isinstance(backend, str):
+            backend = cls.open(backend, **options)
+        elif backend is None:
+            SQLConnection.initialize(None)
+        cls.BACKEND = backend
+
+    @classmethod
+    def open(cls, path, read_only=False, immutable=False):
+        """
+        Create the backend of a path.
+
+        ``memory:`` opens an empty `MemoryBackend`, ``log:<path>`` opens
+        the `LogBackend` of the log file, ``shard:<N>:<path>`` and
+        ``shard:month:<path>`` open the `ShardedBackend` of N hashed or
+        monthly shard files, any other path is opened as a SQLite
+        database file.
+
+        Parameters
+        ----------
+        path : str
+            A path to data file.
+        read_only : bool
+            Open a SQLite database file with ``mode=ro``, its reads neither
+            take nor wait for the write lock.
+        immutable : bool
+            Open a read-only SQLite database file with ``immutable=1``, for
+            snapshots and archives which never change.
+
+        Returns
+        -------
+        backend : StorageBackend
+            The backend of the path.
+        """
+        if path == 'memory:':
+            return MemoryBackend()
+        if path.startswith('log:'):
+            return LogBackend(path[len('log:'):])
+        if path.startswith('shard:'):
+            mode, shard_path = path[len('shard:'):].split(':', 1)
+            if mode == 'month':
+                return ShardedBackend(shard_path, by='month')
+            return ShardedBackend(shard_path, shards=int(mode))
+        SQLConnection.initialize(path, read_only, immutable)
+        return SQLiteBackend()
+
+    @classmethod
+    def close(cls):
+        """
+        Close the storage backend, the next use opens the default one.
+        """
+        if cls.BACKEND is not None:
+            cls.BACKEND.close()
+            cls.BACKEND = None
+
+    @classmethod
+    @contextmanager
+    def use(cls, backend):
+        """
+        Use a backend in the current thread inside the block, the other
+        threads keep the backend of `initialize()`.
+
+        A thread of a server runs every request with a connection of its
+        own, e.g. one borrowed from a pool of open connections.
+
+        Example
+        -------
+        >>> with Storage.use(SQLiteBackend(Connection('file:/tmp/data.db'))):
+        ...     Todo.find_all({'is_completed': False})
+        """
+        previous = getattr(cls._LOCAL, 'backend', None)
+        cls._LOCAL.backend = backend
+        try:
+            yield backend
+        finally:
+            cls._LOCAL.backend = previous
+
+    @classmethod
+    def backend(cls):
+        """
+        Return the storage backend, the backend of `use()` in its block and
+        the SQLite backend by default.
+        """
+        backend = getattr(cls._LOCAL, 'backend', None)
+        if backend is not None:
+            return backend
+        if cls.BACKEND is None:
+            cls.BACKEND = SQLiteBackend()
+        return cls.BACKEND
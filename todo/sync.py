@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+from uuid import uuid4
+
+
+class Sync(object):
+    """
+    Incremental two-way sync of the tasks of two SQLite databases.
+
+    A task is identified across the databases by its `uid`, while its `id`
+    stays local: when a task of the other database arrives with an id
+    which is taken by another task, it gets the next free id.
+
+    Every database remembers, for each peer, the sequence numbers of the
+    peer's change feed and tombstones it has already pulled, so a sync
+    only reads the tasks changed since the last one. The first sync with
+    a peer copies every task, as does a sync after the peer has pruned
+    changes which were not pulled yet or has started its change feed
+    again. The changes are applied in batches of
+    `batch_size`, each batch and its high-water mark in one transaction,
+    so an interrupted sync resumes from the last finished batch.
+
+    Conflicts are resolved by the last write: a task replaces the other
+    copy when its version stamp, ``max(created_at, update_at)``, is newer,
+    and a deleted task stays deleted unless it is changed after the delete.
+
+    The references of a task are local ids too, they are translated on
+    the way: the parent by its `uid`, the parent is applied first when it
+    has not arrived yet, and the list by its name, the list is created
+    when the database has none of the name.
+    """
+    NODE_TABLE = '_sync_node'
+    PEER_TABLE = '_sync_peer'
+
+    def __init__(self, model, local, remote, batch_size=500, parent_column=None,
+                 list_column=None, list_model=None):
+        """
+        Parameters
+        ----------
+        model : type
+            The model class of the tasks, it has `uid` and `update_at`.
+        local : SQLiteBackend
+            The backend of this database.
+        remote : SQLiteBackend
+            The backend of the other database.
+        batch_size : int
+            The number of changes applied per transaction.
+        parent_column : str or None
+            The column of the primary key of the parent task.
+        list_column : str or None
+            The column of the primary key of the list of a task, 0 is the
+            default list which has no row.
+        list_model : type or None
+            The model class of the lists, it has `name`.
+        """
+        self.model = model
+        self.local = local
+        self.remote = remote
+        self.batch_size = batch_size
+        self.parent_column = parent_column
+        self.list_column = list_column
+        self.list_model = list_model
+
+    def _tombstone_table(self):
+        return '{}Tombstone'.format(self.model.TABLE_NAME)
+
+    def _query(self, backend, sql, args=()):
+        cursor = backend.connection.execute(sql, args)
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
+    def prepare(self, backend):
+        """
+        Create the sync tables and the delete trigger of a database and
+        give the tasks without a `uid` one.
+
+        Returns
+        -------
+        node : str
+            The id of the database.
+        """
+        model = self.model
+        table = model.TABLE_NAME
+        tombstone = self._tombstone_table()
+        conn = backend.connection
+        with conn.transaction():
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS {} (node TEXT NOT NULL)'.format(
+                    self.NODE_TABLE)).close()
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS {} (peer TEXT PRIMARY KEY, '
+                'seq INTEGER NOT NULL, tombstone_seq INTEGER NOT NULL)'.format(
+                    self.PEER_TABLE)).close()
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS {} (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'uid TEXT NOT NULL UNIQUE, deleted_at REAL NOT NULL)'.format(
+                    tombstone)).close()
+            conn.execute(
+                'CREATE TRIGGER IF NOT EXISTS {0}_tombstone AFTER DELETE ON {0} '
+                'WHEN OLD.uid IS NOT NULL BEGIN INSERT OR REPLACE INTO {1} '
+                "(uid, deleted_at) VALUES (OLD.uid, "
+                "(julianday('now') - 2440587.5) * 86400.0); END".format(
+                    table, tombstone)).close()
+            # Tasks copied by hand between the databases get the same uid
+            # on both sides.
+            conn.execute(
+                "UPDATE {} SET uid = printf('%d-%.6f', {}, created_at) "
+                "WHERE uid IS NULL".format(table, model.PRIMARY_KEY)).close()
+            node = self._query(backend, 'SELECT node FROM {}'.format(self.NODE_TABLE))
+            if node:
+                return node[0][0]
+            node = uuid4().hex
+            conn.execute(
+                'INSERT INTO {} (node) VALUES (?)'.format(self.NODE_TABLE), [node]).close()
+            return node
+
+    def run(self):
+        """
+        Pull the changes of the other database and push the local ones.
+
+        Returns
+        -------
+        stats : dict
+            The number of 'pulled' and 'pushed' tasks, the 'deleted' tasks
+            and the tasks which are 'renumbered' because of an id collision.
+        """
+        local_node = self.prepare(self.local)
+        remote_node = self.prepare(self.remote)
+        stats = dict(pulled=0, pushed=0, deleted=0, renumbered=0)
+        self.pull(self.remote, remote_node, self.local, stats, 'pulled')
+        self.pull(self.local, local_node, self.remote, stats, 'pushed')
+        return stats
+
+    def _stamp(self, row):
+        position = self.model.COLUMNS.index
+        return max(row[position('created_at')] or 0.0, row[position('update_at')] or 0.0)
+
+    def pull(self, source, source_node, target, stats, name):
+        """
+        Apply the changes of the source database to the target database.
+        """
+        model = self.model
+        mark = self._query(
+            target, 'SELECT seq, tombstone_seq FROM {} WHERE peer=?'.format(
+                self.PEER_TABLE), [source_node])
+        if mark:
+            seq, tombstone_seq = mark[0]
+        else:
+            seq = tombstone_seq = None
+        if seq is not None and source.first_change_seq(model) <= seq + 1 and \
+                seq <= source.last_change_seq(model):
+            batches = self._changed_rows(source, seq)
+        else:
+            # The first sync with the peer copies every task, and so does a
+            # sync after the changes since the last one are pruned or the
+            # change feed of the peer starts again, e.g. after `todo --init`.
+            last_tombstone = self._query(source, 'SELECT MAX(seq) FROM {}'.format(
+                self._tombstone_table()))[0][0] or 0
+            if not tombstone_seq or tombstone_seq > last_tombstone:
+                tombstone_seq = 0
+            batches = self._all_rows(source, source.last_change_seq(model))
+        for rows, seq in batches:
+            with target.transaction():
+                for row in rows:
+                    self._apply(source, target, row, stats, name)
+                self._save_mark(target, source_node, seq, tombstone_seq)
+        tombstones = self._tombstone_table()
+        while True:
+            deleted = self._query(
+                source, 'SELECT seq, uid, deleted_at FROM {} WHERE seq > ? '
+                'ORDER BY seq LIMIT ?'.format(tombstones),
+                [tombstone_seq, self.batch_size])
+            if not deleted:
+                break
+            with target.transaction():
+                for _, uid, deleted_at in deleted:
+                    stats['deleted'] += self._apply_delete(target, uid, deleted_at)
+                tombstone_seq = deleted[-1][0]
+                self._save_mark(target, source_node, seq, tombstone_seq)
+
+    def _save_mark(self, target, source_node, seq, tombstone_seq):
+        target.connection.execute(
+            'INSERT OR REPLACE INTO {} (peer, seq, tombstone_seq) VALUES (?, ?, ?)'.format(
+                self.PEER_TABLE), [source_node, seq, tombstone_seq]).close()
+
+    def _select(self, backend, where, args):
+        model = self.model
+        return self._query(backend, 'SELECT {} FROM {} WHERE {}'.format(
+            ', '.join(model.COLUMNS), model.TABLE_NAME, where), args)
+
+    def _changed_rows(self, source, seq):
+        """
+        Batches of the rows changed after the sequence number of the change
+        feed, with the sequence number the batch ends at.
+        """
+        model = self.model
+        while True:
+            changes = source.changes_since(model, seq, self.batch_size)
+            if not changes:
+                return
+            seq = changes[-1].seq
+            keys = list({c.primary_key for c in changes if c.op != 'delete'})
+            rows = self._select(
+                source, '{} IN ({})'.format(
+                    model.PRIMARY_KEY, ','.join('?' * len(keys))), keys) if keys else []
+            yield rows, seq
+
+    def _all_rows(self, source, seq):
+        """
+        Batches of every row in the order of the primary key, they all end
+        at the sequence number of the change feed at the start.
+        """
+        model = self.model
+        last = None
+        while True:
+            if last is None:
+                where, args = '1', []
+            else:
+                where, args = '{} > ?'.format(model.PRIMARY_KEY), [last]
+            rows = self._select(
+                source, '{} ORDER BY {} LIMIT ?'.format(where, model.PRIMARY_KEY),
+                args + [self.batch_size])
+            if not rows:
+                if last is None:
+                    yield [], seq
+                return
+            last = rows[-1][model.COLUMNS.index(model.PRIMARY_KEY)]
+            yield rows, seq
+
+    def _apply(self, source, target, row, stats, name):
+        """
+        Apply a row of the source database to the target database and
+        count it in the stats as `name`.
+
+        Returns
+        -------
+        result : str or None
+            'inserted', 'renumbered', 'updated' or None if the local copy is
+            kept.
+        """
+        model = self.model
+        columns = model.COLUMNS
+        uid = row[columns.index('uid')]
+        primary = columns.index(model.PRIMARY_KEY)
+        local = self._select(target, 'uid = ?', [uid])
+        if local and self._stamp(row) <= self._stamp(local[0]):
+            return None
+        if not local:
+            deleted = self._query(
+                target, 'SELECT deleted_at FROM {} WHERE uid = ?'.format(
+                    self._tombstone_table()), [uid])
+            if deleted and deleted[0][0] >= self._stamp(row):
+                return None
+        row = self._translate(source, target, row, stats, name)
+        if local:
+            values = {c: v for c, v in zip(columns, row) if c != model.PRIMARY_KEY}
+            target.update(model, values, local[0][primary])
+            result = 'updated'
+        else:
+            result = 'inserted'
+            if self._select(target, '{} = ?'.format(model.PRIMARY_KEY), [row[primary]]):
+                row[primary] = (target.aggregate(model, 'MAX', model.PRIMARY_KEY) or 0) + 1
+                result = 'renumbered'
+            target.insert(model, row)
+        stats[name] += 1
+        stats['renumbered'] += result == 'renumbered'
+        return result
+
+    def _translate(self, source, target, row, stats, name):
+        """
+        The row with the parent id and the list id of the target database.
+        """
+        model = self.model
+        row = list(row)
+        if self.parent_column:
+            position = model.COLUMNS.index(self.parent_column)
+            if row[position] is not None:
+                row[position] = self._parent_id(source, target, row[position], stats, name)
+        if self.list_column:
+            position = model.COLUMNS.index(self.list_column)
+            if row[position]:
+                row[position] = self._list_id(source, target, row[position])
+        return row
+
+    def _parent_id(self, source, target, parent_id, stats, name):
+        """
+        The target id of the parent task of the source id, None if the
+        parent is not in the source or is deleted in the target.
+        """
+        model = self.model
+        parent = self._select(source, '{} = ?'.format(model.PRIMARY_KEY), [parent_id])
+        if not parent:
+            return None
+        uid = parent[0][model.COLUMNS.index('uid')]
+        local = self._query(target, 'SELECT {} FROM {} WHERE uid = ?'.format(
+            model.PRIMARY_KEY, model.TABLE_NAME), [uid])
+        if not local:
+            # The parent arrives before its subtask.
+            self._apply(source, target, parent[0], stats, name)
+            local = self._query(target, 'SELECT {} FROM {} WHERE uid = ?'.format(
+                model.PRIMARY_KEY, model.TABLE_NAME), [uid])
+        return local[0][0] if local else None
+
+    def _list_id(self, source, target, list_id):
+        """
+        The target id of the list of the source id, the list is created in
+        the target when it is missing, 0 if the source has no such list.
+        """
+        lists = self.list_model
+        sql = 'SELECT {} FROM {} WHERE {} = ?'
+        name = self._query(source, sql.format('name', lists.TABLE_NAME, lists.PRIMARY_KEY),
+                           [list_id])
+        if not name:
+            return 0
+        select = sql.format(lists.PRIMARY_KEY, lists.TABLE_NAME, 'name')
+        local = self._query(target, select, name[0])
+        if local:
+            return local[0][0]
+        # The name is unique, a list which another writer has added is kept.
+        values = {'name': name[0][0]}
+        values[lists.PRIMARY_KEY] = (target.aggregate(lists, 'MAX', lists.PRIMARY_KEY) or 0) + 1
+        target.upsert(lists, [[values.get(c) for c in lists.COLUMNS]], 'ignore')
+        return self._query(target, select, name[0])[0][0]
+
+    def _apply_delete(self, target, uid, deleted_at):
+        """
+        Delete the local copy of a task deleted in the other database,
+        unless it is changed after the delete.
+        """
+        model = self.model
+        local = self._select(target, 'uid = ?', [uid])
+        if not local or self._stamp(local[0]) > deleted_at:
+            return 0
+        primary = model.COLUMNS.index(model.PRIMARY_KEY)
+        target.delete(model, local[0][primary])
+        target.connection.execute(
+            'UPDATE {} SET deleted_at = ? WHERE uid = ?'.format(
+                self._tombstone_table()), [deleted_at, uid]).close()
+        return 1
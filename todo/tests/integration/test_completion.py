@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import subprocess
+import time
+from todo.completion import cache_file, database_file
+
+
+def test_database_file():
+    assert database_file('file:/tmp/a.db?mode=ro') == '/tmp/a.db'
+    assert database_file('/tmp/a.db') == '/tmp/a.db'
+    assert database_file(None) == '/tmp/data.db'
+    assert cache_file('log:/tmp/todo.log') is None
+
+
+def test_writes_remove_the_completion_cache(tmp_path):
+    path = str(tmp_path / 'data.db')
+    for args in [['add', 'first   task'], ['add', 'x' * 50], ['add', 'third'],
+                 ['complete', '3']]:
+        subprocess.run(['todo', '-f', path] + args, stdout=subprocess.PIPE)
+    cache = tmp_path / 'data.db.completion'
+    assert not cache.exists()
+    p = subprocess.run(['todo', '-f', path, 'completion', 'ids'], stdout=subprocess.PIPE)
+    assert p.stdout == cache.read_bytes() == '1\tfirst task\n2\t{}\n'.format('x' * 40).encode()
+
+    # A read does not touch the cache.
+    before = cache.stat().st_mtime_ns
+    subprocess.run(['todo', '-f', path, 'show', '-a'], stdout=subprocess.PIPE)
+    assert cache.stat().st_mtime_ns == before
+    subprocess.run(['todo', '-f', path, 'delete', '1'], stdout=subprocess.PIPE)
+    assert not cache.exists()
+
+
+def test_every_list_has_a_completion_cache(tmp_path):
+    path = str(tmp_path / 'data.db')
+    for args in [['add', 'home'], ['-l', 'ops', 'add', 'rotate keys'], ['add', 'garden'],
+                 ['completion', 'ids'], ['-l', 'ops', 'completion', 'ids']]:
+        subprocess.run(['todo', '-f', path] + args, stdout=subprocess.PIPE)
+    assert cache_file(path, 'ops') == path + '.completion.ops'
+    assert (tmp_path / 'data.db.completion.ops').read_text() == '2\trotate keys\n'
+    assert (tmp_path / 'data.db.completion').read_text() == '1\thome\n3\tgarden\n'
+    # A write removes the caches of every list.
+    subprocess.run(['todo', '-f', path, 'add', 'fence'], stdout=subprocess.PIPE)
+    assert not list(tmp_path.glob('data.db.completion*'))
+
+
+def test_bash_completion_reads_the_cache(tmp_path):
+    path = str(tmp_path / 'data.db')
+    subprocess.run(['todo', '-f', path, 'add', 'task'], stdout=subprocess.PIPE)
+    p = subprocess.run(['todo', 'completion', 'bash'], stdout=subprocess.PIPE)
+    script = tmp_path / 'todo.bash'
+    script.write_bytes(p.stdout)
+    complete = (
+        'source {}; COMP_WORDS=(todo -f file:{} {}); COMP_CWORD={}; _todo; '
+        'echo "${{COMPREPLY[@]}}"')
+
+    def run(*words):
+        p = subprocess.run(
+            ['bash', '-c', complete.format(script, path, ' '.join(words), len(words) + 2)],
+            stdout=subprocess.PIPE)
+        return str(p.stdout, encoding='utf-8').split()
+
+    assert run('co') == ['complete', 'completion']
+    assert run('complete', '""') == ['1']
+    assert run('tag', '""') == ['add', 'rm']
+    subprocess.run(['todo', '-f', path, '-l', 'ops', 'add', 'ops task'], stdout=subprocess.PIPE)
+    assert run('-l', 'ops', 'complete', '""') == ['2']
+    assert run('complete', '""') == ['1']
+
+    # A write of another program makes the cache stale, it is rewritten.
+    (tmp_path / 'data.db.completion').write_text('1\ttask\n')
+    subprocess.run(['python', '-c', (
+        'import sqlite3, time; time.sleep(0.01); c = sqlite3.connect("{}"); '
+        'c.execute("UPDATE Todo SET id = 5 WHERE id = 1"); c.commit()').format(path)])
+    assert run('delete', '""') == ['5']
+    # A commit of an open connection only changes the write-ahead log.
+    writer = sqlite3.connect(path)
+    try:
+        time.sleep(0.01)
+        writer.execute('UPDATE Todo SET id = 6 WHERE id = 5')
+        writer.commit()
+        assert run('delete', '""') == ['6']
+    finally:
+        writer.close()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import pytest
+import subprocess
+from todo.dedupe import DuplicateIndex, buckets, shingles, similarity
+from todo.storage import Storage
+from todo.todo import MODELS, Checkpoint, Todo, TodoSignature
+
+TEXTS = [
+    'Reply to the email from Bob about the invoice',
+    'reply to the email from bob about the invoice!',
+    'Buy milk',
+    'Reply to the e-mail from Bob about the  invoice',
+    'Water the plants',
+    'buy milk',
+]
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        Storage.initialize('file:' + str(tmp_path / 'data.db'))
+    else:
+        Storage.initialize('memory:')
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    Todo.bulk_upsert([{'id': i, 'text': t} for i, t in enumerate(TEXTS, 1)])
+    yield Storage.backend()
+    Storage.close()
+
+
+def test_shingles_and_signature():
+    assert shingles('AB') == {' ab', 'ab '}
+    assert shingles(' a   b ') == shingles('A B')
+    assert shingles('') == set() and buckets(set()) == []
+    assert similarity(shingles('buy milk'), shingles('Buy  milk')) == 1.0
+    # Equal texts share every band, the bands of a text differ.
+    assert buckets(shingles('buy milk')) == buckets(shingles('Buy milk'))
+    assert len(set(buckets(shingles('a')))) == 8
+
+
+def test_similar_and_groups(backend):
+    index = DuplicateIndex(Todo, TodoSignature, 'todo_id', Checkpoint)
+    assert index.refresh() == 6
+    assert Checkpoint.find('TodoSignature')[0].seq == Todo.last_change_seq()
+    similar = index.similar('Reply to the email from Bob about invoice')
+    assert [r.id for r, _ in similar] == [1, 2, 4]
+    assert similar[0][1] == pytest.approx(0.93, abs=0.01)
+    assert index.similar('buy milk', exclude=3)[0][0].id == 6
+    assert index.similar('Feed the cat') == []
+    assert [[r.id for r in g] for g in index.groups()] == [[1, 2, 4], [3, 6]]
+
+    # The index follows the changes of the tasks.
+    Todo(id=6, is_completed=True).update()
+    Todo(id=4, text='Call Alice').update()
+    Todo(id=2).remove()
+    Todo(id=7, text='Water the plants.').save()
+    assert index.refresh() == 4
+    assert index.refresh() == 0
+    assert [[r.id for r in g] for g in index.groups()] == [[5, 7]]
+    assert [r.id for r, _ in index.similar('Call Alice')] == [4]
+    assert [r.id for r, _ in DuplicateIndex(
+        Todo, TodoSignature, 'todo_id', Checkpoint, 0.3).similar('buy milk')] == [3]
+
+
+def test_similar_and_groups_of_a_list(backend):
+    Todo.bulk_upsert([{'id': 7, 'text': 'Buy milk!', 'list_id': 1}])
+    index = DuplicateIndex(
+        Todo, TodoSignature, 'todo_id', Checkpoint, 0.7, condition={'list_id': 1})
+    index.refresh()
+    assert [r.id for r, _ in index.similar('buy milk')] == [7]
+    assert index.groups() == []
+    index = DuplicateIndex(
+        Todo, TodoSignature, 'todo_id', Checkpoint, 0.7, condition={'list_id': 0})
+    assert [r.id for r, _ in index.similar('buy milk')] == [3, 6]
+    assert [[r.id for r in g] for g in index.groups()] == [[1, 2, 4], [3, 6]]
+
+
+def test_refresh_rebuilds_a_reset_change_feed(tmp_path):
+    Storage.initialize('file:' + str(tmp_path / 'data.db'))
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    Todo.bulk_upsert([{'id': i, 'text': t} for i, t in enumerate(TEXTS, 1)])
+    index = DuplicateIndex(Todo, TodoSignature, 'todo_id', Checkpoint)
+    index.refresh()
+    # The index rows have no change feed of their own.
+    with pytest.raises(Exception):
+        TodoSignature.last_change_seq()
+    Todo.drop_table()
+    Todo.create_table()
+    Todo(id=1, text='Buy milk').save()
+    Todo(id=2, text='buy  MILK').save()
+    Todo(id=3, text='Sell milk').save()
+    Todo(id=4, text='Sell bread').save()
+    assert index.refresh() == 4
+    assert [[r.id for r in g] for g in index.groups()] == [[1, 2]]
+    with pytest.raises(ValueError):
+        DuplicateIndex(Todo, TodoSignature, 'todo_id', Checkpoint, 1.5)
+
+    # The changes after the checkpoint are pruned.
+    Todo(id=4, text='Buy  milk').update()
+    Todo(id=5, text='Sell bread!').save()
+    Todo.prune_changes(Todo.last_change_seq())
+    assert index.refresh() == 5
+    assert [[r.id for r in g] for g in index.groups()] == [[1, 2, 4]]
+    Storage.close()
+
+
+def test_todo_cli_add_no_duplicates_and_dedupe(tmp_path):
+    path = 'file:' + str(tmp_path / 'data.db')
+    for text in TEXTS[:3]:
+        subprocess.run(['todo', '-f', path, 'add', text], stdout=subprocess.PIPE)
+    p = subprocess.run(['todo', '-f', path, 'add', '--no-duplicates', 'buy  MILK'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 1
+    assert p.stdout.decode().startswith('3 | Buy milk')
+    assert p.stderr == b'Task has not been added, it is similar to the open tasks above.\n'
+    p = subprocess.run(['todo', '-f', path, 'add', '--no-duplicates', '--threshold', '0.9',
+                        '-q', 'buy milk.'], stdout=subprocess.PIPE)
+    assert p.stdout == b'4\n'
+    p = subprocess.run(['todo', '-f', path, 'dedupe', '--threshold', '0.7'],
+                       stdout=subprocess.PIPE)
+    lines = p.stdout.decode().splitlines()
+    assert [line.split(' | ')[0] for line in lines[:-1]] == ['1', '    2', '3', '    4']
+    assert lines[1].endswith('(93% similar)') and lines[3].endswith('(70% similar)')
+    assert lines[-1] == 'Groups of similar tasks: 2'
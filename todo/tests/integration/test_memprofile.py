@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import pytest
+from todo.memprofile import PROFILER
+from todo.storage import Storage, SQLiteBackend
+from todo.todo import MODELS, Todo
+from todo.utility import Connection
+
+# The bytes a fetched `Todo` may hold: the instance dict, its values and
+# the list slot. A row of the test holds about 530 bytes.
+BYTES_PER_ROW_BUDGET = 640
+
+
+@pytest.fixture()
+def profiler(tmp_path):
+    """
+    The memory profiler of a database of 5000 tasks.
+    """
+    Storage.initialize(SQLiteBackend(Connection('file:' + str(tmp_path / 'data.db'))))
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    conn = Storage.backend().connection
+    with conn.transaction():
+        conn.conn.executemany(
+            'INSERT INTO Todo (id, text, is_completed, created_at, update_at, uid, '
+            'priority, due_at, list_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(i, 'task number {}'.format(i), i % 2 == 0, 1700000000.0 + i, 0.0,
+              '{:032x}'.format(i), 3, None, 0) for i in range(1, 5001)])
+    PROFILER.enable()
+    yield PROFILER
+    PROFILER.disable()
+    PROFILER.phases = []
+    Storage.close()
+
+
+def test_bytes_per_row_of_todo_stay_in_budget(profiler):
+    result = Todo.find_all()
+    assert len(result) == 5000
+    assert profiler.bytes_per_row('fetch') < BYTES_PER_ROW_BUDGET
+
+    rows = [tuple(t.values()) for t in result[:1000]]
+    assert len(Todo.convert_result_to_object(rows)) == 1000
+    assert profiler.bytes_per_row('convert') < BYTES_PER_ROW_BUDGET
+
+
+def test_report(profiler):
+    Todo.find_all()
+    lines = profiler.report().splitlines()
+    assert lines[0].split() == ['phase', 'rows', 'allocated', 'KiB', 'peak', 'KiB', 'bytes/row']
+    assert lines[1].split()[:2] == ['fetch', '5000']
+    assert lines[2].startswith('Peak RSS: ')
+    assert lines[3] == 'Top allocation sites:'
+    assert any('<Todo.ROW_FACTORY>' in line for line in lines[4:])
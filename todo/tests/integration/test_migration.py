@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import pytest
+import sqlite3
+from todo.migration import Migration, parse_column_type
+from todo.storage import Storage, SQLiteBackend
+from todo.todo import Tag, Todo
+from todo.utility import Connection
+
+
+@pytest.fixture()
+def backend(tmp_path):
+    """
+    A `SQLiteBackend` of a database which stores the Todo table of
+    schema version 0, with a TEXT id and 25 tasks.
+    """
+    path = 'file:' + str(tmp_path / 'data.db')
+    conn = sqlite3.connect(path, uri=True)
+    conn.execute(
+        'CREATE TABLE Todo (id TEXT NOT NULL PRIMARY KEY, text INTEGER NOT NULL, '
+        'is_completed BOOLEAN NOT NULL, created_at REAL, update_at REAL)')
+    conn.executemany(
+        'INSERT INTO Todo VALUES (?, ?, ?, ?, ?)',
+        [(str(i), 'task {}'.format(i), i % 3 == 0, float(i), 0.0) for i in range(1, 26)])
+    conn.commit()
+    conn.close()
+    backend = SQLiteBackend(Connection(path))
+    Storage.initialize(backend)
+    yield backend
+    Storage.close()
+
+
+def drop_update_at(backend):
+    """
+    Make the Todo table of schema version 0 without the update_at column.
+    """
+    migration = Migration([Todo], 0, backend)
+    migration._drop_triggers(Todo)
+    for (name,) in migration._query(
+            "SELECT name FROM sqlite_master WHERE type='index' AND sql LIKE '%update_at%'"):
+        backend.connection.execute('DROP INDEX {}'.format(name)).close()
+    backend.connection.execute('ALTER TABLE Todo DROP COLUMN update_at').close()
+    backend.connection.execute('PRAGMA user_version = 0').close()
+
+
+def test_parse_column_type():
+    assert parse_column_type('TEXT NOT NULL') == ('TEXT', True)
+    assert parse_column_type('integer') == ('INTEGER', False)
+    assert parse_column_type('REAL DEFAULT 0') == ('REAL', False)
+
+
+def test_rebuild_converts_text_ids(backend):
+    migration = Migration([Todo], 1, backend, batch_size=10)
+    assert migration.plan(Todo) == ('rebuild', [])
+    assert migration.migrate()
+    assert migration.current_version() == 1
+    assert not migration.migrate()
+
+    assert migration.table_columns('Todo')['id'] == ('INTEGER', True, True)
+    assert Todo.find_all(order_by='id desc', size=1)[0].id == 25
+    assert Todo.find(10)[0].text == 'task 10'
+    # The swap creates the counters and the change feed of the new table.
+    assert Todo.counters('is_completed') == {False: 17, True: 8}
+    Todo(id=26, text='new', is_completed=False).save()
+    assert Todo.changes_since(0)[-1].primary_key == 26
+    tables = backend.connection.execute(
+        "SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+    assert ('Todo__old',) not in tables and ('Todo__migrate',) not in tables
+
+
+def test_rebuild_mirrors_writes_and_resumes(backend):
+    migration = Migration([Todo], 1, backend, batch_size=10)
+    migration._create_state_table()
+    migration._start_rebuild(Todo, 'Todo__migrate', migration.table_columns('Todo'))
+    conn = backend.connection
+    with conn.transaction():
+        conn.execute('UPDATE _migration SET last_rowid=10').close()
+        conn.execute(
+            'INSERT INTO Todo__migrate SELECT CAST(id AS INTEGER), text, is_completed, '
+            'created_at, update_at, NULL, 3, NULL, NULL, 0 FROM Todo WHERE rowid <= 10').close()
+    # Writes during the copy: rows already copied are mirrored by the triggers.
+    conn.execute("UPDATE Todo SET text='changed' WHERE id='2'").close()
+    conn.execute("DELETE FROM Todo WHERE id='3'").close()
+    conn.execute("UPDATE Todo SET text='later' WHERE id='20'").close()
+    conn.execute(
+        "INSERT INTO Todo VALUES ('26', 'new', 0, 26.0, 0.0)").close()
+
+    # The interrupted rebuild resumes from the recorded watermark.
+    assert Migration([Todo], 1, backend, batch_size=10).migrate()
+    tasks = {t.id: t.text for t in Todo.find_all()}
+    assert len(tasks) == 25 and 3 not in tasks
+    assert tasks[2] == 'changed' and tasks[20] == 'later' and tasks[26] == 'new'
+
+
+def test_add_column_without_rebuild(backend):
+    migration = Migration([Todo], 1, backend)
+    migration.migrate()
+    drop_update_at(backend)
+
+    assert migration.plan(Todo) == ('add', ['update_at'])
+    messages = []
+    Migration([Todo], 1, backend, progress=messages.append).migrate()
+    assert messages == ['Added column Todo.update_at.', 'Schema version is 1.']
+    assert Todo.find(1)[0].update_at == 0.0
+
+
+def test_migration_drops_the_old_indexes_and_seeds_new_counters(backend):
+    backend.migrate([Todo], 7)
+    conn = backend.connection
+    conn.execute('CREATE INDEX Todo_is_completed_priority ON Todo (is_completed, priority)').close()
+    conn.execute("DELETE FROM TodoCounter WHERE name = 'list_id'").close()
+    conn.execute('PRAGMA user_version = 6').close()
+
+    messages = []
+    backend.migrate([Todo], 7, progress=messages.append)
+    assert messages == ['Dropped index Todo_is_completed_priority.', 'Schema version is 7.']
+    indexes = {name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall()}
+    assert 'Todo_list_id_is_completed_priority' in indexes
+    assert 'Todo_is_completed_priority' not in indexes
+    # The counters of a new counter column are seeded from the rows.
+    assert Todo.counters('list_id') == {0: 25}
+
+
+def test_migration_without_rebuild_refuses_a_rebuild(backend):
+    with pytest.raises(ValueError, match='run `todo migrate`'):
+        backend.migrate([Todo], 1, rebuild=False)
+    assert Migration([Todo], 1, backend).current_version() == 0
+    backend.migrate([Todo], 1)
+    drop_update_at(backend)
+    # The additive changes are applied.
+    backend.migrate([Todo], 1, rebuild=False)
+    assert Todo.find(1)[0].update_at == 0.0
+
+
+def test_migration_makes_the_names_unique(backend):
+    conn = backend.connection
+    conn.execute('CREATE TABLE Tag (id INTEGER NOT NULL PRIMARY KEY, name TEXT NOT NULL)').close()
+    conn.execute('CREATE INDEX Tag_name ON Tag (name)').close()
+    conn.execute("INSERT INTO Tag VALUES (1, 'home'), (2, 'ops'), (3, 'ops')").close()
+    with pytest.raises(ValueError, match="repeat the name 'ops', merge them"):
+        backend.migrate([Tag], 9)
+    # The version is not written, the migration runs again.
+    assert Migration([Tag], 9, backend).current_version() == 0
+
+    conn.execute('DELETE FROM Tag WHERE id = 3').close()
+    backend.migrate([Tag], 9)
+    indexes = {name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='Tag'").fetchall()}
+    assert indexes == {'Tag_name_unique'}
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO Tag VALUES (3, 'ops')")
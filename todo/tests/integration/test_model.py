@@ -2,8 +2,10 @@
 import pytest
 from todo.model import Model
 from todo.field import IntegerField, TextField, BooleanField, FloatField
-from sqlite3 import OperationalError
+from sqlite3 import IntegrityError, OperationalError
 from todo.utility import SQLConnection
+from todo.storage import Compare, Storage
+from todo.todo import MODELS, Tag, Todo, TodoList, TodoTag
 import time
 
 
@@ -50,3 +52,281 @@ def test_crud():
     )]
     User.drop_table()
     SQLConnection.initialize(None)
+
+
+class Task(Model):
+    """
+    A model class which counts its records by the completion flag.
+    """
+    task_id = IntegerField(primary_key=True)
+    done = BooleanField(column_type='BOOLEAN NOT NULL')
+    COUNTER_COLUMNS = ('done',)
+
+
+def test_aggregate_and_counters():
+    SQLConnection.initialize('file:/tmp/data-test.db')
+    Task.create_table()
+    Task(task_id=1, done=False).save()
+    Task(task_id=2, done=False).save()
+    # The counter table is seeded from the existing records.
+    SQLConnection().execute('DROP TABLE TaskCounter').close()
+    Task.create_table()
+    Task(task_id=3, done=True).save()
+
+    assert Task.count() == 3
+    assert Task.count({'done': False}) == 2
+    assert Task.min('task_id') == 1
+    assert Task.max('task_id', {'done': False}) == 2
+    assert Task.group_count('done') == {False: 2, True: 1}
+    assert Task.counters('done') == {False: 2, True: 1}
+
+    Task(task_id=1, done=True).update()
+    Task(task_id=2).remove()
+    assert Task.counters('done') == {False: 0, True: 2}
+    assert Task.group_count('done') == {True: 2}
+
+    Task.drop_table()
+    SQLConnection.initialize(None)
+
+
+def test_changes_since():
+    SQLConnection.initialize('file:/tmp/data-test.db')
+    Task.create_table()
+    assert Task.last_change_seq() == 0
+    Task(task_id=1, done=False).save()
+    Task(task_id=2, done=False).save()
+    Task(task_id=1, done=False).update()
+    Task(task_id=1, done=True).update()
+    Task(task_id=2).remove()
+
+    changes = Task.changes_since(0)
+    assert [(c.seq, c.op, c.primary_key, c.columns) for c in changes] == [
+        (1, 'insert', 1, ('task_id', 'done')),
+        (2, 'insert', 2, ('task_id', 'done')),
+        (3, 'update', 1, ('done',)),
+        (4, 'delete', 2, ()),
+    ]
+    assert Task.changes_since(3) == changes[3:]
+    assert Task.changes_since(0, size=2) == changes[:2]
+    assert Task.last_change_seq() == 4
+
+    assert Task.first_change_seq() == 1
+    assert Task.prune_changes(2) == 2 and Task.first_change_seq() == 3
+    assert Task.prune_changes(10) == 1
+    assert Task.changes_since(0) == changes[3:] and Task.last_change_seq() == 4
+
+    Task.drop_table()
+    SQLConnection.initialize(None)
+
+
+def test_many_to_many_queries():
+    SQLConnection.initialize('file:/tmp/data-test.db')
+    for model in MODELS:
+        model.create_table()
+    for i in range(1, 6):
+        Todo(id=i, text='task {}'.format(i), is_completed=i == 4).save()
+    Tag(id=1, name='home').save()
+    Tag(id=2, name='urgent').save()
+    for todo_id, tag_id in [(1, 1), (2, 1), (2, 2), (4, 1), (4, 2), (5, 2)]:
+        Todo.tags.add(todo_id, tag_id)
+    assert TodoTag.find((2, 2)) == [TodoTag(todo_id=2, tag_id=2)]
+
+    result = Todo.tags.find_all('name', ['home', 'urgent'], order_by='id')
+    assert [t.id for t in result] == [2, 4]
+    result = Todo.tags.find_all('name', ['home', 'urgent'], {'is_completed': False})
+    assert [t.id for t in result] == [2]
+    tags = Todo.tags.load([1, 2, 3])
+    assert {k: [t.name for t in v] for k, v in tags.items()} == {
+        1: ['home'], 2: ['home', 'urgent'], 3: []}
+
+    # Both directions of the relation are index lookups.
+    plan = SQLConnection().execute(
+        'EXPLAIN QUERY PLAN SELECT J.todo_id FROM TodoTag J JOIN Tag R '
+        'ON R.id = J.tag_id WHERE R.name = ?', ['home']).fetchall()
+    details = ' '.join(row[-1] for row in plan)
+    assert 'INDEX Tag_name_unique (name=?)' in details
+    assert 'USING COVERING INDEX TodoTag_tag_id_todo_id' in details
+    plan = SQLConnection().execute(
+        'EXPLAIN QUERY PLAN SELECT R.id FROM TodoTag J JOIN Tag R '
+        'ON R.id = J.tag_id WHERE J.todo_id IN (1, 2)').fetchall()
+    assert 'SCAN' not in ' '.join(row[-1] for row in plan)
+
+    for model in MODELS:
+        model.drop_table()
+    SQLConnection.initialize(None)
+
+
+def test_next_tasks_read_in_index_order():
+    SQLConnection.initialize('file:/tmp/data-test.db')
+    Todo.create_table()
+    tasks = [
+        Todo(id=1, text='later', due_at=300.0, priority=1),
+        Todo(id=2, text='sooner', due_at=100.0, priority=5),
+        Todo(id=3, text='same due, more urgent', due_at=100.0, priority=2),
+        Todo(id=4, text='no due date', priority=1),
+        Todo(id=5, text='done', is_completed=True, due_at=50.0, priority=1),
+    ]
+    for task in tasks:
+        task.save()
+
+    condition = {'is_completed': False, 'due_at': Compare('>', float('-inf'))}
+    result = Todo.find_all(condition, order_by='due_at, priority', size=2)
+    assert [t.id for t in result] == [3, 2]
+    result = Todo.find_all({'is_completed': False, 'due_at': Compare('IS', None)})
+    assert [t.id for t in result] == [4]
+    result = Todo.find_all({'due_at': Compare('<=', 100.0)}, order_by='id')
+    assert [t.id for t in result] == [2, 3, 5]
+
+    # Every order of a list is a range of an index, none sorts the table.
+    for condition, order_by in [
+            ({'list_id': 0, 'is_completed': False, 'due_at': Compare('>', float('-inf'))},
+             'due_at, priority'),
+            ({'list_id': 0, 'is_completed': False, 'due_at': Compare('IS', None)},
+             'priority'),
+            ({'list_id': 0, 'is_completed': False}, 'priority'),
+            ({'list_id': 0, 'is_completed': True}, 'created_at'),
+            ({'list_id': 0}, 'is_completed, due_at, priority')]:
+        where, args = Todo._where(condition)
+        plan = SQLConnection().execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM Todo {} ORDER BY {} LIMIT 5'.format(
+                where, order_by), args).fetchall()
+        details = ' '.join(row[-1] for row in plan)
+        assert 'USE TEMP B-TREE' not in details
+        assert 'INDEX Todo_list_id_is_completed_' in details
+
+    Todo.drop_table()
+    SQLConnection.initialize(None)
+
+
+def test_bulk_upsert_conflict_modes():
+    SQLConnection.initialize('file:/tmp/data-test.db')
+    Todo.create_table()
+    Todo(id=1, text='old', update_at=100.0).save()
+    Todo(id=2, text='new', update_at=200.0).save()
+    seq = Todo.last_change_seq()
+
+    rows = [
+        {'id': 1, 'text': 'newer', 'update_at': 150.0},
+        {'id': 2, 'text': 'older', 'update_at': 150.0},
+        {'id': 3, 'text': 'added', 'update_at': 150.0},
+    ]
+    assert Todo.bulk_upsert(rows, 'update-newer', batch_size=2) == 2
+    assert [t.text for t in Todo.find_all(order_by='id')] == ['newer', 'new', 'added']
+    # The skipped record fires no trigger, the counters stay exact.
+    assert [(c.op, c.primary_key) for c in Todo.changes_since(seq)] == [
+        ('update', 1), ('insert', 3)]
+    assert Todo.counters('is_completed') == {False: 3}
+
+    assert Todo.bulk_upsert([{'id': 3, 'text': 'kept'}], 'ignore') == 0
+    assert Todo(id=3, text='replaced', is_completed=True).upsert()
+    assert Todo.find(3)[0].text == 'replaced'
+    assert Todo.counters('is_completed') == {False: 2, True: 1}
+    with pytest.raises(ValueError):
+        Todo.bulk_upsert(rows, 'merge')
+
+    Todo.drop_table()
+    SQLConnection.initialize(None)
+
+
+@pytest.mark.parametrize('path', ['file:/tmp/data-test.db', 'memory:'])
+def test_counters_of_a_tuple_of_columns(path):
+    Storage.initialize(path)
+    Todo.create_table()
+    Todo(id=1, text='a', list_id=0).save()
+    Todo(id=2, text='b', list_id=1).save()
+    if path != 'memory:':
+        # The counters of a new tuple of columns are seeded from the records.
+        SQLConnection().execute(
+            "DELETE FROM TodoCounter WHERE name = 'list_id,is_completed'").close()
+        Todo.create_table()
+    Todo(id=3, text='c', list_id=1, is_completed=True).save()
+    Todo(id=2, text='b', list_id=1, is_completed=True).update()
+    Todo(id=1, text='a', list_id=1).update()
+    Todo(id=3).remove()
+
+    counts = Todo.counters(('list_id', 'is_completed'))
+    assert {k: v for k, v in counts.items() if v} == {(1, False): 1, (1, True): 1}
+    assert counts.get((0, False), 0) == 0
+    assert Todo.counters('list_id') == {0: 0, 1: 2}
+
+    Todo.drop_table()
+    Storage.initialize(None)
+
+
+@pytest.mark.parametrize('path', ['file:/tmp/data-test.db', 'memory:'])
+def test_find_or_create_unique_names(path):
+    Storage.initialize(path)
+    TodoList.create_table()
+    ops = TodoList.find_or_create({'name': 'ops'})
+    assert ops == TodoList(id=1, name='ops')
+    assert TodoList.find_or_create({'name': 'home'}).id == 2
+    assert TodoList.find_or_create({'name': 'ops'}).id == 1
+    # A record of a stored name is kept, whatever its primary key.
+    assert TodoList.bulk_upsert([{'id': 3, 'name': 'ops'}], 'ignore') == 0
+    assert TodoList.count() == 2
+    if path != 'memory:':
+        with pytest.raises(IntegrityError):
+            TodoList(id=3, name='home').save()
+
+    TodoList.drop_table()
+    Storage.initialize(None)
+
+
+@pytest.mark.parametrize('path', ['file:/tmp/data-test.db', 'memory:'])
+def test_subtask_tree(path):
+    Storage.initialize(path)
+    Todo.create_table()
+    for id, parent_id, done in [(1, None, False), (2, 1, True), (3, 1, False),
+                                (4, 3, True), (5, None, False), (6, 3, False)]:
+        Todo(id=id, text='task {}'.format(id), parent_id=parent_id,
+             is_completed=done).save()
+
+    nodes = Todo.subtasks.walk()
+    assert [(n.record.id, n.depth, n.done, n.total) for n in nodes] == [
+        (1, 0, 2, 4), (2, 1, 0, 0), (3, 1, 1, 2), (4, 2, 0, 0), (6, 2, 0, 0),
+        (5, 0, 0, 0)]
+    assert [n.record.id for n in Todo.subtasks.walk([3])] == [3, 4, 6]
+
+    assert Todo.subtasks.update(3, {'is_completed': True}) == 3
+    assert Todo.subtasks.walk([1])[0][2:] == (4, 4)
+    assert Todo.subtasks.update(7, {'is_completed': True}) == 0
+
+    Todo.drop_table()
+    Storage.initialize(None)
+
+
+def test_subtask_levels_read_by_index():
+    SQLConnection.initialize('file:/tmp/data-test.db')
+    Todo.create_table()
+    plan = SQLConnection().execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM Todo WHERE parent_id = ?', [1]).fetchall()
+    assert 'INDEX Todo_parent_id' in ' '.join(row[-1] for row in plan)
+    Todo.drop_table()
+    SQLConnection.initialize(None)
+
+
+@pytest.mark.parametrize('path', ['file:/tmp/data-test.db', 'memory:'])
+def test_compressed_text(path):
+    Storage.initialize(path)
+    Todo.create_table()
+    log = 'Traceback (most recent call last):\n  File "app.py", line 1\n' * 50
+    Todo(id=1, text=log).save()
+    Todo(id=2, text='Buy milk').save()
+    Todo.bulk_upsert([{'id': 3, 'text': log + 'upserted'}])
+    Todo(id=2, text=log + 'updated').update()
+
+    tasks = Todo.find_all(order_by='id')
+    if path != 'memory:':
+        # The long texts are stored compressed and decompressed when read.
+        rows = SQLConnection().execute(
+            'SELECT typeof(text), length(text) FROM Todo ORDER BY id').fetchall()
+        assert [kind for kind, _ in rows] == ['blob'] * 3
+        assert all(size < len(log) / 10 for _, size in rows)
+        assert type(dict.__getitem__(tasks[0], 'text')) is bytes
+    assert [t.text for t in tasks] == [log, log + 'updated', log + 'upserted']
+    assert tasks[0]['text'] == log
+    Todo(id=2, text='Buy milk').update()
+    assert Todo.find(2)[0]['text'] == 'Buy milk'
+
+    Todo.drop_table()
+    Storage.initialize(None)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import pytest
+import signal
+import subprocess
+import time
+from todo.remind import Reminder, open_sink, FileSink
+from todo.storage import Storage, SQLiteBackend
+from todo.todo import MODELS, Todo
+from todo.utility import Connection
+
+
+class Clock(object):
+    """
+    A clock which moves only when the reminder sleeps.
+    """
+
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture()
+def path(tmp_path):
+    """
+    Path of a database file of the reminder, the tasks are written by
+    another connection.
+    """
+    path = 'file:' + str(tmp_path / 'data.db')
+    Storage.initialize(SQLiteBackend(Connection(path)))
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    yield path
+    Storage.close()
+
+
+def write(path, action):
+    backend = SQLiteBackend(Connection(path))
+    backend.connection.execute(action).close()
+    backend.close()
+
+
+def test_reminder_sleeps_until_the_next_due_time(path):
+    for i, due_at in [(1, 130.0), (2, 110.0), (3, None), (4, 90.0)]:
+        Todo(id=i, text='task {}'.format(i), due_at=due_at).save()
+    Todo(id=5, text='done', due_at=120.0, is_completed=True).save()
+    clock = Clock(100.0)
+    sent = []
+    reminder = Reminder(Todo, sent.append, interval=60.0, clock=clock, sleep=clock.sleep)
+
+    reminder.run(count=2)
+    assert [r['id'] for r in sent] == [2, 1]
+    assert clock.sleeps == [10.0, 20.0]
+    assert [r['latency'] for r in sent] == [0.0, 0.0]
+    assert sent[0]['message'].startswith('Task 2 is due: task 2 (due ')
+    assert reminder.summary() == (
+        'Sent 2 reminders, wakeup latency mean 0.0 ms, max 0.0 ms.')
+
+
+def test_reminder_refreshes_the_changed_tasks(path):
+    Todo(id=1, text='moved', due_at=110.0).save()
+    Todo(id=2, text='completed', due_at=120.0).save()
+    Todo(id=3, text='deleted', due_at=125.0).save()
+    clock = Clock(100.0)
+    sent = []
+    reminder = Reminder(Todo, sent.append, interval=5.0, clock=clock, sleep=clock.sleep)
+    reminder.load()
+    assert reminder.next_due() == 110.0
+
+    # Nothing is read until another connection commits.
+    assert reminder.refresh() == 0
+    write(path, 'UPDATE Todo SET due_at = 140.0 WHERE id = 1')
+    write(path, 'UPDATE Todo SET is_completed = 1 WHERE id = 2')
+    write(path, 'DELETE FROM Todo WHERE id = 3')
+    write(path, "INSERT INTO Todo (id, text, is_completed, priority, due_at) "
+                "VALUES (4, 'added', 0, 3, 105.0)")
+    assert reminder.refresh() == 4
+    assert reminder.next_due() == 105.0
+
+    reminder.run(count=2)
+    assert [r['id'] for r in sent] == [4, 1]
+    assert clock.now == 140.0
+
+
+def test_reminder_of_a_list(path):
+    Todo(id=1, text='home', due_at=110.0).save()
+    Todo(id=2, text='ops', due_at=120.0, list_id=1).save()
+    clock = Clock(100.0)
+    sent = []
+    reminder = Reminder(Todo, sent.append, interval=60.0, clock=clock, sleep=clock.sleep,
+                        condition={'list_id': 1})
+    reminder.load()
+    assert reminder.next_due() == 120.0
+    # A changed task of another list stays out of the heap.
+    write(path, 'UPDATE Todo SET due_at = 105.0 WHERE id = 1')
+    assert reminder.refresh() == 1
+    assert reminder.next_due() == 120.0
+
+    reminder.run(count=1)
+    assert [r['id'] for r in sent] == [2]
+    assert clock.now == 120.0
+
+
+def test_open_sink(tmp_path):
+    assert isinstance(open_sink('file:/tmp/reminders.txt'), FileSink)
+    with pytest.raises(ValueError):
+        open_sink('mail:me')
+    output = tmp_path / 'hook.txt'
+    sink = open_sink('command:sh -c \'echo "$TODO_TASK_ID $1" > {}\' hook'.format(output))
+    sink({'id': 7, 'text': 'text', 'due_at': 1.0, 'message': 'Task 7 is due'})
+    assert output.read_text() == '7 Task 7 is due\n'
+
+
+def test_todo_cli_remind_daemon(tmp_path):
+    path = 'file:' + str(tmp_path / 'data.db')
+    output = tmp_path / 'reminders.txt'
+    subprocess.run(['todo', '-f', path, 'add', 'overdue', '--due', '2020-01-01'],
+                   stdout=subprocess.PIPE)
+    p = subprocess.run(['todo', '-f', path, 'remind'], stdout=subprocess.PIPE)
+    assert str(p.stdout, encoding='utf-8').startswith('1 | overdue (')
+
+    daemon = subprocess.Popen(
+        ['todo', '-f', path, 'remind', '--daemon', '--sink', 'file:' + str(output),
+         '--interval', '0.1'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    time.sleep(0.5)
+    # A task written after the start is read from the change feed.
+    backend = SQLiteBackend(Connection(path))
+    Storage.initialize(backend)
+    Todo(id=2, text='soon', due_at=time.time() + 0.5).save()
+    Storage.close()
+    deadline = time.time() + 10
+    while not output.exists() and time.time() < deadline:
+        time.sleep(0.1)
+    daemon.send_signal(signal.SIGINT)
+    stdout, stderr = daemon.communicate()
+
+    assert daemon.returncode == 0
+    assert output.read_text().startswith('Task 2 is due: soon (due ')
+    assert str(stderr, encoding='utf-8').startswith('Sent 1 reminders, wakeup latency')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+import subprocess
+from datetime import datetime
+from todo.report import ArraySource, IndexSource, Report, format_report
+from todo.storage import Storage
+from todo.todo import MODELS, Todo
+
+DAY = 86400.0
+# Noon of a day, the report window ends on its day.
+NOW = datetime(2026, 10, 19, 12).timestamp()
+
+
+def store_tasks():
+    """
+    Tasks created over the last days, completed ones after a lead time.
+    """
+    Todo.bulk_upsert([
+        # created days ago, lead time in hours or None while open
+        {'id': i, 'text': 'task {}'.format(i), 'created_at': NOW - days * DAY,
+         'is_completed': lead is not None,
+         'update_at': NOW - days * DAY + lead * 3600 if lead is not None else 0.0}
+        for i, (days, lead) in enumerate([
+            (6, 1), (6, 30), (5, None), (4, 2), (3, None), (2, 4),
+            (2, None), (1, None), (0.25, 1), (10, None)], 1)
+    ])
+    # A completed task without a completion time has no lead time.
+    Todo(id=11, text='imported', is_completed=True, created_at=NOW - DAY).save()
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        Storage.initialize('file:' + str(tmp_path / 'data.db'))
+    else:
+        Storage.initialize('memory:')
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    store_tasks()
+    yield Storage.backend()
+    Storage.close()
+
+
+def test_report(backend):
+    report = Report(Todo, backend, days=7, now=NOW).run()
+    assert report['lead_time'] == {
+        'count': 5, 'p50': 2 * 3600.0, 'p90': 19.6 * 3600, 'p99': 28.96 * 3600}
+    assert report['open_age']['count'] == 5
+    assert report['open_age']['p50'] == pytest.approx(3 * DAY)
+    assert report['open_age']['p90'] == pytest.approx(8 * DAY)
+
+    throughput = report['throughput']
+    assert throughput['days'][-1] == '2026-10-19'
+    # The imported task counts as completed when it was created.
+    assert throughput['completed'] == [1, 1, 1, 0, 1, 1, 1]
+    assert throughput['mean'] == pytest.approx(6 / 7)
+    assert throughput['rolling_mean'][2:5] == [1.0, 0.75, 0.8]
+    # The open tasks at the end of every day of the window.
+    assert report['burndown']['open'] == [2, 2, 2, 3, 4, 5, 5]
+    assert 'Lead time (5 tasks): p50 2.0 h' in format_report(report)
+
+
+def test_index_and_array_sources_agree(tmp_path):
+    Storage.initialize('file:' + str(tmp_path / 'data.db'))
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    store_tasks()
+    report = Report(Todo, Storage.backend(), days=10, now=NOW)
+    expected = report.run(IndexSource(Todo, Storage.backend()))
+    assert expected == report.run(ArraySource(Todo, Storage.backend()))
+
+    # The report of a list does not count the tasks of another list.
+    Todo.bulk_upsert([
+        {'id': 20 + i, 'text': 'other list', 'list_id': 1, 'created_at': NOW - i * DAY,
+         'is_completed': i % 2 == 0, 'update_at': NOW} for i in range(4)])
+    condition = {'list_id': 0}
+    assert Report(Todo, Storage.backend(), days=10, now=NOW, condition=condition).run() == \
+        expected
+    assert report.run(ArraySource(Todo, Storage.backend(), condition)) == expected
+    Storage.close()
+
+
+def test_todo_cli_report_json(tmp_path):
+    path = 'file:' + str(tmp_path / 'data.db')
+    subprocess.run(['todo', '-f', path, 'add', 'first'], stdout=subprocess.PIPE)
+    subprocess.run(['todo', '-f', path, 'complete', '1'], stdout=subprocess.PIPE)
+    p = subprocess.run(['todo', '-f', path, 'report', '--days', '3', '--json'],
+                       stdout=subprocess.PIPE)
+    assert p.returncode == 0
+    report = json.loads(p.stdout)
+    assert report['lead_time']['count'] == 1
+    assert report['throughput']['completed'] == [0, 0, 1]
+    assert report['burndown']['open'] == [0, 0, 0]
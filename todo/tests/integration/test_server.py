@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import http.client
+import json
+import pytest
+import subprocess
+import threading
+from todo.server import TaskServer, parse_bind
+from todo.storage import Storage, SQLiteBackend
+from todo.todo import MODELS, Todo
+from todo.utility import Connection
+
+
+@pytest.fixture()
+def server(tmp_path):
+    path = 'file:' + str(tmp_path / 'data.db')
+    backend = SQLiteBackend(Connection(path))
+    backend.migrate(MODELS, Todo.SCHEMA_VERSION)
+    backend.close()
+    server = TaskServer(('127.0.0.1', 0), path, pool_size=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture()
+def client(server):
+    client = http.client.HTTPConnection(*server.server_address)
+    yield client
+    client.close()
+
+
+def request(client, method, url, body=None, headers=None):
+    client.request(method, url, None if body is None else json.dumps(body), headers or {})
+    response = client.getresponse()
+    data = response.read()
+    return response, json.loads(data) if data and '/json' in response.getheader(
+        'Content-Type', '') else data
+
+
+def test_crud(client):
+    response, task = request(client, 'POST', '/tasks', {'text': 'Buy milk', 'priority': 2})
+    assert response.status == 201 and response.getheader('Location') == '/tasks/1'
+    assert task['text'] == 'Buy milk' and task['priority'] == 2 and task['list_id'] == 0
+    assert task['uid'] and not task['is_completed']
+    response, subtask = request(client, 'POST', '/tasks', {'text': 'Milk', 'parent_id': 1})
+    assert subtask['id'] == 2 and subtask['parent_id'] == 1
+
+    response, task = request(client, 'PATCH', '/tasks/1', {'is_completed': True})
+    assert response.status == 200 and task['is_completed'] and task['update_at'] > 0
+    assert request(client, 'GET', '/tasks/1')[1] == task
+    response, _ = request(client, 'DELETE', '/tasks/1')
+    assert response.status == 204
+    assert request(client, 'GET', '/tasks/1')[0].status == 404
+    # The subtasks move up to the parent of the deleted task.
+    assert request(client, 'GET', '/tasks/2')[1]['parent_id'] is None
+
+    for method, url, body, status in [
+            ('POST', '/tasks', {'priority': 1}, 400),
+            ('POST', '/tasks', {'text': 'a', 'priority': 6}, 400),
+            ('POST', '/tasks', {'text': 'a', 'owner': 'bob'}, 400),
+            ('POST', '/tasks', {'text': 'a', 'parent_id': 5}, 400),
+            ('POST', '/tasks', {'text': 'a', 'list': 'a b'}, 400),
+            ('POST', '/tasks', {'text': 'a', 'list': 5}, 400),
+            ('PATCH', '/tasks/2', {'parent_id': None}, 400),
+            ('PATCH', '/tasks/9', {'text': 'a'}, 404),
+            ('GET', '/tasks/x', None, 404),
+            ('GET', '/tasks?status=done', None, 400),
+            ('GET', '/tasks?list=none', None, 404),
+            ('DELETE', '/tasks', None, 405),
+            ('GET', '/lists', None, 404)]:
+        response, error = request(client, method, url, body)
+        assert response.status == status and error['error']
+    # The connection is kept alive after the errors.
+    assert request(client, 'GET', '/tasks/2')[0].status == 200
+
+    # The compressed texts are sent decompressed.
+    log = 'Traceback (most recent call last):\n' * 100
+    assert request(client, 'POST', '/tasks', {'text': log})[1]['text'] == log
+    assert request(client, 'GET', '/tasks/3')[1]['text'] == log
+    _, page = request(client, 'GET', '/tasks')
+    assert page['tasks'][-1]['text'] == log
+
+
+def test_pages_and_lists(client):
+    for i in range(5):
+        request(client, 'POST', '/tasks', {'text': 'task {}'.format(i)})
+    request(client, 'POST', '/tasks', {'text': 'ops task', 'list': 'ops'})
+    request(client, 'PATCH', '/tasks/2', {'is_completed': True})
+
+    _, page = request(client, 'GET', '/tasks?limit=2')
+    assert [t['id'] for t in page['tasks']] == [1, 2] and page['next'] == 2
+    _, page = request(client, 'GET', '/tasks?limit=2&after=2')
+    assert [t['id'] for t in page['tasks']] == [3, 4] and page['next'] == 4
+    _, page = request(client, 'GET', '/tasks?limit=2&after=4')
+    assert [t['id'] for t in page['tasks']] == [5] and page['next'] is None
+    _, page = request(client, 'GET', '/tasks?status=open&limit=2')
+    assert [t['id'] for t in page['tasks']] == [1, 3]
+    _, page = request(client, 'GET', '/tasks?status=completed')
+    assert [t['id'] for t in page['tasks']] == [2]
+    _, page = request(client, 'GET', '/tasks?list=ops')
+    assert [t['text'] for t in page['tasks']] == ['ops task']
+
+
+def test_etag_and_not_modified(server, client):
+    request(client, 'POST', '/tasks', {'text': 'Buy milk'})
+    response, _ = request(client, 'GET', '/tasks')
+    etag = response.getheader('ETag')
+    response, body = request(client, 'GET', '/tasks', headers={'If-None-Match': etag})
+    assert response.status == 304 and body == b''
+    assert request(client, 'GET', '/tasks/1', headers={'If-None-Match': etag})[0].status == 304
+
+    # A write of the server, or of another connection, changes the ETag.
+    request(client, 'PATCH', '/tasks/1', {'text': 'Buy oat milk'})
+    response, page = request(client, 'GET', '/tasks', headers={'If-None-Match': etag})
+    assert response.status == 200 and page['tasks'][0]['text'] == 'Buy oat milk'
+    etag = response.getheader('ETag')
+    other = SQLiteBackend(Connection(server.path))
+    with Storage.use(other):
+        Todo(id=1, is_completed=True).update()
+    other.close()
+    response, page = request(client, 'GET', '/tasks', headers={'If-None-Match': etag})
+    assert response.status == 200 and page['tasks'][0]['is_completed']
+
+
+def test_unexpected_error(server, client, monkeypatch):
+    def fail(self, backend, query, body, id):
+        raise TypeError('a bug')
+    monkeypatch.setattr(server.RequestHandlerClass, '_get_task', fail)
+    response, error = request(client, 'GET', '/tasks/1')
+    assert response.status == 500 and error == {'error': 'Internal server error.'}
+    assert request(client, 'GET', '/tasks')[0].status == 200
+
+
+def test_stream_json_lines(server, client, monkeypatch):
+    monkeypatch.setattr(server.RequestHandlerClass, 'STREAM_BATCH_SIZE', 2)
+    for i in range(5):
+        request(client, 'POST', '/tasks', {'text': 'task {}'.format(i)})
+    response, body = request(client, 'GET', '/tasks?format=jsonl&after=1')
+    assert response.getheader('Transfer-Encoding') == 'chunked'
+    assert response.getheader('Content-Type') == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in body.splitlines()] == [2, 3, 4, 5]
+
+
+def test_parse_bind():
+    assert parse_bind('127.0.0.1:8080') == ('127.0.0.1', 8080)
+    with pytest.raises(ValueError):
+        parse_bind('8080')
+
+
+def test_todo_cli_http(tmp_path):
+    path = str(tmp_path / 'data.db')
+    p = subprocess.Popen(['todo', '-f', path, 'http', '--bind', '127.0.0.1:0'],
+                         stdout=subprocess.PIPE)
+    try:
+        line = p.stdout.readline().decode()
+        assert line.startswith('Serving the tasks on http://127.0.0.1:')
+        client = http.client.HTTPConnection('127.0.0.1', int(line.rsplit(':', 1)[1].split('/')[0]))
+        assert request(client, 'POST', '/tasks', {'text': 'Buy milk'})[0].status == 201
+        client.close()
+    finally:
+        p.terminate()
+        p.wait()
+    p = subprocess.run(['todo', '-f', path, 'show', '-a'], stdout=subprocess.PIPE)
+    assert b'Buy milk' in p.stdout
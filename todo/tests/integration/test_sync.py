@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import pytest
+import sqlite3
+import subprocess
+from todo.migration import Migration
+from todo.storage import Storage, SQLiteBackend
+from todo.sync import Sync
+from todo.todo import MODELS, Todo, TodoList
+from todo.utility import Connection
+
+
+@pytest.fixture()
+def paths(tmp_path):
+    """
+    Paths of a laptop and a host database file.
+    """
+    yield ['file:' + str(tmp_path / name) for name in ('laptop.db', 'host.db')]
+    Storage.initialize(None)
+
+
+def write(path, *tasks):
+    Storage.initialize(SQLiteBackend(Connection(path)))
+    Storage.backend().migrate(MODELS, Todo.SCHEMA_VERSION)
+    for task in tasks:
+        task.save()
+    Storage.close()
+
+
+def tasks(path):
+    Storage.initialize(SQLiteBackend(Connection(path)))
+    result = {t.uid: (t.id, t.text, t.is_completed) for t in Todo.find_all() or []}
+    Storage.close()
+    return result
+
+
+def sync(laptop, host, **kwargs):
+    backends = [SQLiteBackend(Connection(laptop)), SQLiteBackend(Connection(host))]
+    try:
+        for backend in backends:
+            backend.migrate(MODELS, Todo.SCHEMA_VERSION)
+        return Sync(Todo, *backends, parent_column='parent_id', list_column='list_id',
+                    list_model=TodoList, **kwargs).run()
+    finally:
+        for backend in backends:
+            backend.close()
+
+
+def test_sync_both_ways_with_id_collisions(paths):
+    laptop, host = paths
+    write(laptop, Todo(id=1, text='one', uid='a'), Todo(id=2, text='two', uid='b'))
+    write(host, Todo(id=1, text='host one', uid='c'))
+
+    stats = sync(laptop, host, batch_size=1)
+    assert stats == dict(pulled=1, pushed=2, deleted=0, renumbered=3)
+    assert set(tasks(laptop)) == set(tasks(host)) == {'a', 'b', 'c'}
+    assert tasks(laptop)['c'] == (3, 'host one', False)
+    assert tasks(host)['a'] == (2, 'one', False) and tasks(host)['b'] == (3, 'two', False)
+
+    # Nothing changed, nothing is exchanged.
+    assert sync(laptop, host) == dict(
+        pulled=0, pushed=0, deleted=0, renumbered=0)
+
+
+def test_sync_last_update_wins_and_deletes(paths):
+    laptop, host = paths
+    write(laptop, Todo(id=1, text='one', uid='a', created_at=1.0),
+          Todo(id=2, text='two', uid='b', created_at=1.0))
+    sync(laptop, host)
+
+    Storage.initialize(SQLiteBackend(Connection(laptop)))
+    Todo(id=1, text='laptop', update_at=10.0).update()
+    Todo(id=2).remove()
+    Storage.initialize(SQLiteBackend(Connection(host)))
+    Todo(id=1, text='host', update_at=20.0).update()
+    Storage.close()
+
+    stats = sync(laptop, host)
+    assert stats['deleted'] == 1
+    assert tasks(laptop) == tasks(host) == {'a': (1, 'host', False)}
+
+
+def test_sync_keeps_a_task_changed_after_its_delete(paths):
+    laptop, host = paths
+    write(laptop, Todo(id=1, text='one', uid='a', created_at=1.0))
+    sync(laptop, host)
+
+    Storage.initialize(SQLiteBackend(Connection(laptop)))
+    Todo(id=1).remove()
+    Storage.initialize(SQLiteBackend(Connection(host)))
+    Todo(id=1, is_completed=True, update_at=4102444800.0).update()
+    Storage.close()
+
+    sync(laptop, host)
+    assert tasks(laptop) == tasks(host) == {'a': (1, 'one', True)}
+
+
+def test_sync_copies_every_task_after_a_prune(paths):
+    laptop, host = paths
+    write(laptop, Todo(id=1, text='one', uid='a', created_at=1.0))
+    sync(laptop, host)
+
+    Storage.initialize(SQLiteBackend(Connection(laptop)))
+    Todo(id=1, text='laptop', update_at=10.0).update()
+    Todo(id=2, text='two', uid='b', created_at=1.0).save()
+    Todo(id=3, text='three', uid='c', created_at=1.0).save()
+    # The host has not pulled the changes which are pruned.
+    Todo.prune_changes(Todo.last_change_seq())
+    Storage.close()
+
+    assert sync(laptop, host)['pulled'] == 0
+    assert tasks(host) == tasks(laptop) == {
+        'a': (1, 'laptop', False), 'b': (2, 'two', False), 'c': (3, 'three', False)}
+
+
+def test_sync_translates_the_parent_and_the_list(paths):
+    laptop, host = paths
+    # The subtask has a lower id than its parent, which is renumbered on the
+    # host, and the list has another id on the host.
+    write(laptop, TodoList(id=1, name='ops'),
+          Todo(id=1, text='rotate keys', uid='a', parent_id=2, list_id=1),
+          Todo(id=2, text='security', uid='b', list_id=1))
+    write(host, TodoList(id=1, name='home'), TodoList(id=2, name='garden'),
+          Todo(id=2, text='host task', uid='c', list_id=1))
+
+    assert sync(laptop, host, batch_size=1)['pushed'] == 2
+    Storage.initialize(SQLiteBackend(Connection(host)))
+    ops = TodoList.find_all({'name': 'ops'})[0].id
+    parent = Todo.find_all({'uid': 'b'})[0]
+    child = Todo.find_all({'uid': 'a'})[0]
+    Storage.close()
+    assert ops == 3 and parent.id == 3
+    assert child.parent_id == 3 and child.list_id == parent.list_id == ops
+    # The host task arrives in the list of the same name.
+    Storage.initialize(SQLiteBackend(Connection(laptop)))
+    home = TodoList.find_all({'name': 'home'})[0].id
+    assert Todo.find_all({'uid': 'c'})[0].list_id == home == 2
+    Storage.close()
+
+
+def test_sync_keeps_the_tombstones_after_a_migration(paths):
+    laptop, host = paths
+    write(laptop, Todo(id=1, text='one', uid='a', created_at=1.0),
+          Todo(id=2, text='two', uid='b', created_at=1.0))
+    sync(laptop, host)
+
+    backend = SQLiteBackend(Connection(laptop))
+    migration = Migration(MODELS, Todo.SCHEMA_VERSION, backend)
+    migration.add_columns(Todo, [])
+    migration.rebuild(Todo)
+    migration._drop_old_table(Todo)
+    Storage.initialize(backend)
+    Todo(id=1).remove()
+    Storage.close()
+
+    assert sync(laptop, host)['deleted'] == 1
+    assert sync(laptop, host)['pulled'] == 0
+    assert set(tasks(laptop)) == set(tasks(host)) == {'b'}
+
+
+def test_sync_copies_every_task_after_a_reset_of_the_peer(paths):
+    laptop, host = paths
+    write(host, *[Todo(id=i, text='task {}'.format(i), uid=str(i)) for i in range(1, 4)])
+    sync(laptop, host)
+
+    # `todo --init` on the host starts its change feed again.
+    Storage.initialize(SQLiteBackend(Connection(host)))
+    for model in MODELS:
+        model.drop_table()
+    Storage.close()
+    write(host, Todo(id=1, text='new task', uid='d'))
+
+    assert sync(laptop, host)['pulled'] == 1
+    assert 'd' in tasks(laptop)
+
+
+def test_todo_cli_sync_command(tmp_path):
+    laptop = 'file:' + str(tmp_path / 'laptop.db')
+    host = str(tmp_path / 'host.db')
+    subprocess.run(['todo', '-f', laptop, 'add', 'laptop task'], stdout=subprocess.PIPE)
+    subprocess.run(['todo', '-f', 'file:' + host, 'add', 'host task'],
+                   stdout=subprocess.PIPE)
+
+    args = ['todo', '-f', laptop, 'sync', host]
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+
+    # check return code
+    assert p.returncode == 0
+
+    # check stdout
+    assert str(stdout, encoding='utf-8') == (
+        'Pulled 1 tasks, pushed 1 tasks, deleted 0 tasks.\n'
+        '2 tasks got a new id because their id was taken.\n')
+    p = subprocess.run(['todo', '-f', 'file:' + host, 'show', '--all'],
+                       stdout=subprocess.PIPE)
+    lines = str(p.stdout, encoding='utf-8').splitlines()
+    assert [l.split(' (')[0] for l in lines] == ['1 | host task', '2 | laptop task']
+
+
+def test_todo_cli_sync_does_not_rebuild_the_other_database(tmp_path):
+    laptop = 'file:' + str(tmp_path / 'laptop.db')
+    host = str(tmp_path / 'host.db')
+    conn = sqlite3.connect(host)
+    conn.execute('CREATE TABLE Todo (id TEXT NOT NULL PRIMARY KEY, text INTEGER NOT NULL, '
+                 'is_completed BOOLEAN NOT NULL, created_at REAL, update_at REAL)')
+    conn.commit()
+    conn.close()
+    p = subprocess.run(['todo', '-f', laptop, 'sync', host],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 1
+    assert 'run `todo -f {} migrate` first'.format(host) in str(p.stderr, encoding='utf-8')
+    subprocess.run(['todo', '-f', host, 'migrate'], stdout=subprocess.PIPE)
+    p = subprocess.run(['todo', '-f', laptop, 'sync', host], stdout=subprocess.PIPE)
+    assert p.returncode == 0
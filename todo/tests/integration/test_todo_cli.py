@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import json
+import os
 import pytest
+import sqlite3
 import subprocess
+import zipfile
 from todo.todo import Todo
 
 
@@ -324,3 +328,377 @@ def test_todo_cli_show_command_when_task_exist():
     message = '1 | task will complete (Created At: 1 mins ago, Updated At: 1 mins ago)\n'
     assert message == cmd_output
     
+
+
+def test_todo_cli_stats_command():
+    """
+    Test 'todo stats' command.
+    """
+    # add two task and complete one of them
+    args = [['todo', '-f', 'file:/tmp/data-test.db', 'add', 'task will complete'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'task still incomplete'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'complete', '1']]
+    for i in args:
+        p = subprocess.Popen(i, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'stats']
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+
+    # check return code
+    assert p.returncode == 0
+
+    # check stdout
+    cmd_output = str(stdout, encoding='utf-8')
+    message = 'Open: 1\nCompleted: 1\nTotal: 2\n'
+    assert message == cmd_output
+
+
+def test_todo_cli_add_subcommand_with_quiet_and_show_open():
+    """
+    Test 'todo add' command with `--quiet` and `--show-open` options.
+    """
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'task one', '-q']
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+
+    # check return code
+    assert p.returncode == 0
+
+    # check stdout
+    cmd_output = str(stdout, encoding='utf-8')
+    assert '1\n' == cmd_output
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'task two', '--show-open', '1']
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+
+    # check return code
+    assert p.returncode == 0
+
+    # check stdout
+    cmd_output = str(stdout, encoding='utf-8')
+    message = 'Task has been added successfully.\n' + \
+        '1 | task one (Created At: 1 mins ago, Updated At: )\n'
+    assert message == cmd_output
+
+
+def test_todo_cli_watch_command():
+    """
+    Test 'todo watch' command prints the changes of other commands.
+    """
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'task one']
+    subprocess.run(args, stdout=subprocess.PIPE)
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'watch', '--since', '1',
+            '--interval', '0.05']
+    watch = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        args = ['todo', '-f', 'file:/tmp/data-test.db', 'complete', '1']
+        subprocess.run(args, stdout=subprocess.PIPE)
+        line = str(watch.stdout.readline(), encoding='utf-8')
+    finally:
+        watch.terminate()
+        watch.communicate()
+
+    assert json.loads(line) == {
+        'seq': 2, 'op': 'update', 'id': 1, 'columns': ['is_completed', 'update_at']}
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'watch', '--since', '0', '--once']
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+
+    # check return code
+    assert p.returncode == 0
+
+    # check stdout
+    lines = str(stdout, encoding='utf-8').splitlines()
+    assert [json.loads(l)['op'] for l in lines] == ['insert', 'update']
+
+
+def test_todo_cli_prune_command(tmp_path):
+    """
+    Test 'todo prune' keeps the latest changes and the unread ones of an index.
+    """
+    path = 'file:/tmp/data-test.db'
+    for args in [['add', 'task one'], ['add', 'task two'], ['dedupe'], ['complete', '1'],
+                 ['complete', '2']]:
+        subprocess.run(['todo', '-f', path] + args, stdout=subprocess.PIPE)
+    # The index of `dedupe` has read the changes up to 2.
+    p = subprocess.run(['todo', '-f', path, 'prune', '--keep', '0'], stdout=subprocess.PIPE)
+    assert p.stdout == b'Pruned 2 changes, the change feed starts at 3.\n'
+    p = subprocess.run(['todo', '-f', path, 'watch', '--since', '1', '--once'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 1 and b'The changes up to 2 are pruned' in p.stderr
+    p = subprocess.run(['todo', '-f', path, 'watch', '--since', '2', '--once'],
+                       stdout=subprocess.PIPE)
+    assert [json.loads(l)['seq'] for l in p.stdout.splitlines()] == [3, 4]
+
+    # The log backend has no change feed which outlives a call.
+    log = 'log:' + str(tmp_path / 'todo.log')
+    subprocess.run(['todo', '-f', log, 'add', 'task'], stdout=subprocess.PIPE)
+    for args in [['watch', '--once'], ['dedupe'], ['prune']]:
+        p = subprocess.run(['todo', '-f', log] + args,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert p.returncode == 1 and b'which the LogBackend does not keep' in p.stderr
+
+
+def test_todo_cli_rebuild_only_by_migrate_command(tmp_path):
+    """
+    Test the commands refuse a database whose tables have to be rebuilt.
+    """
+    path = str(tmp_path / 'data.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE Todo (id TEXT NOT NULL PRIMARY KEY, text INTEGER NOT NULL, '
+                 'is_completed BOOLEAN NOT NULL, created_at REAL, update_at REAL)')
+    conn.execute("INSERT INTO Todo VALUES ('1', 'old task', 0, 1.0, 0.0)")
+    conn.commit()
+    conn.close()
+    p = subprocess.run(['todo', '-f', path, 'add', 'new task'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 1 and b'run `todo migrate` first' in p.stderr
+    p = subprocess.run(['todo', '-f', path, 'migrate'], stdout=subprocess.PIPE)
+    assert p.returncode == 0 and b'Rebuilt table Todo.' in p.stdout
+    subprocess.run(['todo', '-f', path, 'add', 'new task'], stdout=subprocess.PIPE)
+    p = subprocess.run(['todo', '-f', path, 'show', '-a'], stdout=subprocess.PIPE)
+    assert b'old task' in p.stdout and b'new task' in p.stdout
+
+
+def test_todo_cli_tag_command_and_show_tag_option():
+    """
+    Test 'todo tag add/rm' command and 'todo show --tag' option.
+    """
+    for text in ['task one', 'task two', 'task three']:
+        subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', 'add', text],
+                       stdout=subprocess.PIPE)
+    for args in [['add', '1', 'home'], ['add', '2', 'home', 'urgent'],
+                 ['add', '3', 'urgent']]:
+        p = subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', 'tag'] + args,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert p.returncode == 0
+    assert str(p.stdout, encoding='utf-8') == 'Task 3 is tagged urgent.\n'
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'show', '--tag', 'home', '--tag', 'urgent']
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+
+    # check return code
+    assert p.returncode == 0
+
+    # check stdout
+    cmd_output = str(stdout, encoding='utf-8')
+    message = '2 | task two (Created At: 1 mins ago, Updated At: ) #home #urgent\n'
+    assert message == cmd_output
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'tag', 'rm', '2', 'home']
+    p = subprocess.run(args, stdout=subprocess.PIPE)
+    assert str(p.stdout, encoding='utf-8') == 'Tags home are removed from task 2.\n'
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'show', '--tag', 'home']
+    p = subprocess.run(args, stdout=subprocess.PIPE)
+    assert str(p.stdout, encoding='utf-8') == \
+        '1 | task one (Created At: 1 mins ago, Updated At: ) #home\n'
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'tag', 'rm', '2', 'home']
+    p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 1
+    assert str(p.stderr, encoding='utf-8') == 'This tag of task not exist.\n'
+
+
+def test_todo_cli_next_command_and_show_sort_option():
+    """
+    Test 'todo next' command and 'todo show --sort' option.
+    """
+    args = [['todo', '-f', 'file:/tmp/data-test.db', 'add', 'no due date', '-p', '1'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'due later',
+             '--due', '2030-01-02'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'due sooner',
+             '--due', '2030-01-01 09:30', '-p', '2'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'least urgent', '-p', '5']]
+    for i in args:
+        p = subprocess.Popen(i, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p.communicate()
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'next', '-n', '3']
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+
+    # check return code
+    assert p.returncode == 0
+
+    # check stdout
+    lines = str(stdout, encoding='utf-8').splitlines()
+    assert [l.split(' (')[0] for l in lines] == [
+        '3 | due sooner', '2 | due later', '1 | no due date']
+    assert lines[0].endswith(') [due 2030-01-01 09:30, priority 2]')
+    assert lines[2].endswith(') [priority 1]')
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'show', '-i', '--sort', 'priority']
+    p = subprocess.run(args, stdout=subprocess.PIPE)
+    lines = str(p.stdout, encoding='utf-8').splitlines()
+    assert [l.split(' |')[0] for l in lines] == ['1', '3', '2', '4']
+
+
+def test_todo_cli_subtasks_show_tree_and_complete_recursive():
+    """
+    Test 'todo add --parent', 'todo show --tree' and 'todo complete -r'.
+    """
+    args = [['todo', '-f', 'file:/tmp/data-test.db', 'add', 'release'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'write notes', '--parent', '1'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'build', '--parent', '1'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'wheel', '--parent', '3'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'unrelated'],
+            ['todo', '-f', 'file:/tmp/data-test.db', 'complete', '2']]
+    for i in args:
+        p = subprocess.Popen(i, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p.communicate()
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'show', '--tree']
+    p = subprocess.run(args, stdout=subprocess.PIPE)
+    assert p.returncode == 0
+    lines = str(p.stdout, encoding='utf-8').splitlines()
+    assert [l.split(' (')[0] for l in lines] == [
+        '1 | release', '    2 | write notes', '    3 | build',
+        '        4 | wheel', '5 | unrelated']
+    assert lines[0].endswith(') (1 of 3 done)')
+    assert lines[2].endswith(') (0 of 1 done)')
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'complete', '3', '--recursive']
+    p = subprocess.run(args, stdout=subprocess.PIPE)
+    assert str(p.stdout, encoding='utf-8') == 'Task 3 and 1 subtasks complete.\n'
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'show', '-i']
+    p = subprocess.run(args, stdout=subprocess.PIPE)
+    lines = str(p.stdout, encoding='utf-8').splitlines()
+    assert [l.split(' |')[0] for l in lines] == ['1', '5']
+
+    args = ['todo', '-f', 'file:/tmp/data-test.db', 'add', 'orphan', '--parent', '9']
+    p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 1
+
+
+def test_todo_cli_read_only_commands_do_not_wait_for_writers(tmp_path):
+    """
+    Test the query subcommands read while another process holds the write lock.
+    """
+    subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', 'add', 'a task'],
+                   stdout=subprocess.PIPE)
+    writer = sqlite3.connect('/tmp/data-test.db')
+    assert writer.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+    writer.execute('BEGIN IMMEDIATE')
+    writer.execute("UPDATE Todo SET text = 'not committed'")
+    try:
+        p = subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', 'show', '-a'],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=3)
+        assert p.returncode == 0
+        assert str(p.stdout, encoding='utf-8').startswith('1 | a task (')
+        # The commits in the write-ahead log are not read immutable.
+        for args, error in [(['show', '-a'], b'read it without --immutable'),
+                            (['add', 'b'], b'can only be read')]:
+            p = subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', '--immutable'] + args,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            assert p.returncode == 1 and error in p.stderr
+        # A snapshot without a write-ahead log is read immutable.
+        snapshot = sqlite3.connect(str(tmp_path / 'snapshot.db'))
+        reader = sqlite3.connect('/tmp/data-test.db')
+        reader.backup(snapshot)
+        reader.close()
+        snapshot.execute('PRAGMA journal_mode=DELETE')
+        snapshot.close()
+        p = subprocess.run(['todo', '-f', str(tmp_path / 'snapshot.db'), '--immutable',
+                            'show', '-a'], stdout=subprocess.PIPE, timeout=3)
+        assert str(p.stdout, encoding='utf-8').startswith('1 | a task (')
+    finally:
+        writer.rollback()
+        writer.close()
+    p = subprocess.run(['todo', '-f', str(tmp_path / 'missing.db'), '--immutable', 'show'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 1 and b'has to be migrated with `todo migrate`' in p.stderr
+
+
+def test_todo_cli_trace(tmp_path):
+    """
+    Test 'TODO_TRACE=1' and '--trace' record the phases of a call.
+    """
+    trace = str(tmp_path / 'trace.json')
+    env = dict(os.environ, TODO_TRACE='1', TODO_TRACE_FILE=trace)
+    p = subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', 'add', 'traced'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    assert p.returncode == 0
+    names = {e['name'] for e in json.load(open(trace))['traceEvents']}
+    assert {'import', 'parse_args', 'connect', 'migrate', 'create_table', 'execute',
+            'command', 'render'} <= names
+    summary = str(p.stderr, encoding='utf-8')
+    assert summary.startswith('span ') and 'Trace is written to {}.'.format(trace) in summary
+
+    env['TODO_TRACE'] = ''
+    p = subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', '--trace', 'show', '-a'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    assert str(p.stdout, encoding='utf-8').startswith('1 | traced (')
+    assert '\nfetch ' in str(p.stderr, encoding='utf-8')
+
+
+def test_todo_cli_memprofile():
+    """
+    Test '--memprofile' reports the memory of the phases.
+    """
+    subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', 'add', 'a task'],
+                   stdout=subprocess.PIPE)
+    p = subprocess.run(['todo', '-f', 'file:/tmp/data-test.db', '--memprofile', 'show', '-a'],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert p.returncode == 0
+    lines = str(p.stderr, encoding='utf-8').splitlines()
+    assert [l.split()[:2] for l in lines[1:3]] == [['fetch', '1'], ['render', '1']]
+    assert 'Top allocation sites:' in lines
+
+
+def test_todo_cli_lists_scope_the_commands():
+    """
+    Test '--list' scopes the commands to a list and 'todo lists'.
+    """
+    def todo(*args):
+        p = subprocess.run(['todo', '-f', 'file:/tmp/data-test.db'] + list(args),
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return p.returncode, str(p.stdout, encoding='utf-8'), str(p.stderr, encoding='utf-8')
+
+    todo('add', 'home task')
+    todo('-l', 'ops', 'add', 'rotate the keys')
+    todo('-l', 'ops', 'add', 'renew the certificate')
+    todo('--list', 'ops', 'complete', '2')
+
+    _, out, _ = todo('-l', 'ops', 'show', '-a')
+    assert [line.split(' | ')[0] for line in out.splitlines()] == ['2', '3']
+    _, out, _ = todo('show', '-a')
+    assert [line.split(' | ')[0] for line in out.splitlines()] == ['1']
+    _, out, _ = todo('-l', 'ops', 'stats')
+    assert out == 'Open: 1\nCompleted: 1\nTotal: 2\n'
+    _, out, _ = todo('lists')
+    assert out == 'default | Open: 1, Total: 1\nops | Open: 1, Total: 2\n'
+
+    # A task of another list is not found.
+    assert todo('complete', '3')[2] == 'This id of task not exist.\n'
+    assert todo('-l', 'ops', 'delete', '1')[0] == 1
+    assert todo('-l', 'ops', 'add', 'subtask', '--parent', '1')[0] == 1
+    assert todo('-l', 'dev', 'show', '-a')[2] == 'This list not exist.\n'
+    assert todo('-l', 'ops', 'delete', '3')[0] == 0
+    _, out, _ = todo('-l', 'ops', 'show', '-i')
+    assert out == 'No task exist.\n'
+
+
+def test_todo_cli_python_m_and_zipapp(tmp_path):
+    """
+    Test 'python -m todo' and the zipapp of 'setup.py zipapp'.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+    zipapp = str(tmp_path / 'todo.pyz')
+    subprocess.run(['python', 'setup.py', '-q', 'zipapp', '-o', zipapp], cwd=root,
+                   check=True, stdout=subprocess.PIPE)
+    p = subprocess.run(['python', '-m', 'todo', '-f', 'file:/tmp/data-test.db', 'add', 'Say Hello.'],
+                       stdout=subprocess.PIPE)
+    assert p.stdout.startswith(b'Task has been added successfully.\n')
+    # The zipapp runs from its bytecode, without the tests.
+    p = subprocess.run(['python', zipapp, '-f', 'file:/tmp/data-test.db', 'show', '-a'],
+                       stdout=subprocess.PIPE)
+    assert p.stdout.startswith(b'1 | Say Hello.')
+    names = zipfile.ZipFile(zipapp).namelist()
+    assert 'todo/app.pyc' in names and not any('tests' in name for name in names)
@@ -4,7 +4,9 @@ import pytest
 import sqlite3
 from todo.todo import Todo
 import argparse
+from datetime import datetime
 from todo.cmd_manager import CmdLineParser
+from todo.remind import stdout_sink
 
 
 def test_add_subcommand_with_set_context():
@@ -12,10 +14,37 @@ def test_add_subcommand_with_set_context():
         parser = CmdLineParser(['add', 'hello'])
         assert vars(parser.args) == {
             'add-text': 'hello',
+            'show_open': None,
+            'quiet': False,
+            'priority': 3,
+            'due': None,
+            'parent': None,
+            'no_duplicates': False,
+            'threshold': None,
             'init': False,
             'execute_cmd': mock_add_action,
-            'file_path': None
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
         }
+        parser = CmdLineParser(['add', 'hello', '--show-open', '3', '--quiet'])
+        assert vars(parser.args)['show_open'] == 3
+        assert vars(parser.args)['quiet'] == True
+        parser = CmdLineParser(['add', 'hello', '-p', '1', '--due', '2026-10-20 09:30'])
+        assert vars(parser.args)['priority'] == 1
+        assert vars(parser.args)['due'] == datetime(2026, 10, 20, 9, 30).timestamp()
+        with pytest.raises(SystemExit):
+            CmdLineParser(['add', 'hello', '--due', 'tomorrow'])
+        with pytest.raises(SystemExit):
+            CmdLineParser(['add', 'hello', '-p', '6'])
+        # 0 would list every open task, it is not a number of tasks to show.
+        with pytest.raises(SystemExit):
+            CmdLineParser(['add', 'hello', '--show-open', '0'])
+        parser = CmdLineParser(['add', 'hello', '--no-duplicates', '--threshold', '0.6'])
+        assert vars(parser.args)['no_duplicates'] == True
+        assert vars(parser.args)['threshold'] == 0.6
 
 
 def test_add_subcommand_without_set_context():
@@ -31,7 +60,11 @@ def test_delete_subcommand_with_set_args():
             'del-task-id': 1, 
             'init': False,
             'execute_cmd': mock_delete_action,
-            'file_path': None
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
         }
 
 
@@ -49,7 +82,11 @@ def test_update_subcommand_with_set_args():
             'update_task_id': 1,
             'update_task_text': 'Hello',
             'execute_cmd': mock_update_action,
-            'file_path': None
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
         }
 
 
@@ -78,42 +115,132 @@ def test_show_subcommand_set_option():
 
         assert vars(parser.args) == {
             'all': False,
+            'tag': None,
+            'sort': None,
+            'tree': False,
             'complete': True,
             'incomplete': False,
             'init': False,
             'execute_cmd': mock_show_action,
-            'file_path': None
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
         }
 
         parser = CmdLineParser(['show', '-i'])
         assert vars(parser.args) == {
             'all': False,
+            'tag': None,
+            'sort': None,
+            'tree': False,
             'complete': False,
             'incomplete': True,
             'init': False,
             'execute_cmd': mock_show_action,
-            'file_path': None
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
         }
 
         parser = CmdLineParser(['show', '-a'])
         assert vars(parser.args) == {
             'all': True,
+            'tag': None,
+            'sort': None,
+            'tree': False,
             'complete': False,
             'incomplete': False,
             'init': False,
             'execute_cmd': mock_show_action,
-            'file_path': None
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
         }
 
 
+def test_show_subcommand_sort_option():
+    with patch('todo.cmd_manager.CmdLineParser._show_action'):
+        assert vars(CmdLineParser(['show', '-i', '--sort', 'due']).args)['sort'] == 'due'
+    with pytest.raises(SystemExit):
+        CmdLineParser(['show', '-i', '--sort', 'text'])
+
+
+def test_next_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._next_action') as mock_next_action:
+        parser = CmdLineParser(['next'])
+        assert vars(parser.args) == {
+            'number': 5,
+            'init': False,
+            'execute_cmd': mock_next_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+        assert vars(CmdLineParser(['next', '-n', '2']).args)['number'] == 2
+        with pytest.raises(SystemExit):
+            CmdLineParser(['next', '-n', '0'])
+
+
+def test_remind_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._remind_action') as mock_remind_action:
+        parser = CmdLineParser(['remind'])
+        assert vars(parser.args) == {
+            'daemon': False,
+            'sink': stdout_sink,
+            'interval': 5.0,
+            'init': False,
+            'execute_cmd': mock_remind_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+        parser = CmdLineParser(['remind', '--daemon', '--sink', 'file:/tmp/r.txt'])
+        assert vars(parser.args)['daemon'] == True
+        assert vars(parser.args)['sink'].path == '/tmp/r.txt'
+    with pytest.raises(SystemExit):
+        CmdLineParser(['remind', '--sink', 'mail:me'])
+
+
+def test_completion_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._completion_action') as mock_action:
+        parser = CmdLineParser(['completion', 'zsh'])
+        assert vars(parser.args) == {
+            'completion-shell': 'zsh',
+            'init': False,
+            'execute_cmd': mock_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+    with pytest.raises(SystemExit):
+        CmdLineParser(['completion', 'tcsh'])
+
+
 def test_complete_subcommand_set_args():
     with patch('todo.cmd_manager.CmdLineParser._complete_action') as mock_complete_action:
         parser = CmdLineParser(['complete', '1'])
         assert vars(parser.args) == {
             'complete-task-id': 1,
+            'recursive': False,
             'init': False,
             'execute_cmd': mock_complete_action,
-            'file_path': None
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
         }
 
 
@@ -121,3 +248,135 @@ def test_complete_subcommand_withou_set_args():
 
     with pytest.raises(SystemExit):
         CmdLineParser(['complete'])
+
+
+def test_report_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._report_action') as mock_report_action:
+        parser = CmdLineParser(['report', '--days', '7', '--json'])
+        assert vars(parser.args) == {
+            'days': 7,
+            'json': True,
+            'init': False,
+            'execute_cmd': mock_report_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+    assert CmdLineParser(['report']).read_only()
+
+
+def test_dedupe_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._dedupe_action') as mock_dedupe_action:
+        parser = CmdLineParser(['dedupe', '--threshold', '0.7'])
+        assert vars(parser.args) == {
+            'threshold': 0.7,
+            'init': False,
+            'execute_cmd': mock_dedupe_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+    assert not CmdLineParser(['dedupe']).read_only()
+
+
+def test_lists_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._lists_action') as mock_lists_action:
+        parser = CmdLineParser(['lists'])
+        assert vars(parser.args) == {
+            'init': False,
+            'execute_cmd': mock_lists_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+    assert CmdLineParser(['lists']).read_only()
+    assert vars(CmdLineParser(['-l', 'ops-2', 'show', '-a']).args)['list'] == 'ops-2'
+    with pytest.raises(SystemExit):
+        CmdLineParser(['--list', '../ops', 'show', '-a'])
+
+
+def test_migrate_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._migrate_action') as mock_migrate_action:
+        parser = CmdLineParser(['migrate', '--batch-size', '500'])
+        assert vars(parser.args) == {
+            'batch_size': 500,
+            'init': False,
+            'execute_cmd': mock_migrate_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+
+
+def test_watch_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._watch_action') as mock_watch_action:
+        parser = CmdLineParser(['watch', '--since', '3', '--once'])
+        assert vars(parser.args) == {
+            'since': 3,
+            'interval': 0.2,
+            'once': True,
+            'init': False,
+            'execute_cmd': mock_watch_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+
+
+def test_sync_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._sync_action') as mock_sync_action:
+        parser = CmdLineParser(['sync', 'other.db'])
+        assert vars(parser.args) == {
+            'other-file': 'other.db',
+            'batch_size': 500,
+            'init': False,
+            'execute_cmd': mock_sync_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+
+
+def test_http_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._http_action') as mock_http_action:
+        parser = CmdLineParser(['http', '--bind', '0.0.0.0:9000', '--pool-size', '4'])
+        assert vars(parser.args) == {
+            'bind': ('0.0.0.0', 9000),
+            'pool_size': 4,
+            'verbose': False,
+            'init': False,
+            'execute_cmd': mock_http_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
+
+
+def test_tag_subcommand_set_args():
+    with patch('todo.cmd_manager.CmdLineParser._tag_rm_action') as mock_tag_rm_action:
+        parser = CmdLineParser(['tag', 'rm', '3', 'home', 'urgent'])
+        assert vars(parser.args) == {
+            'tag-task-id': 3,
+            'tag-names': ['home', 'urgent'],
+            'init': False,
+            'execute_cmd': mock_tag_rm_action,
+            'file_path': None,
+            'list': None,
+            'immutable': False,
+            'trace': False,
+            'memprofile': False
+        }
@@ -1,10 +1,29 @@
 # -*- coding: utf-8 -*-
-from unittest.mock import Mock, patch, call
+import json
 import pytest
 import sqlite3
-from todo.model import Model
+from todo.model import CompressedTexts, Model, ManyToMany
+from todo.storage import Storage, MemoryBackend
 from textwrap import dedent
-from todo.field import IntegerField, TextField, BooleanField, FloatField
+from todo.field import (
+    IntegerField, TextField, BooleanField, FloatField, CompressedTextField, decompress)
+
+
+class Group(Model):
+    """
+    A model class which is related to the users.
+    """
+    group_id = IntegerField(primary_key=True)
+    group_name = TextField()
+
+
+class Member(Model):
+    """
+    A join model class with a composite primary key.
+    """
+    user_id = IntegerField(primary_key=True)
+    group_id = IntegerField(primary_key=True)
+    INDEXES = (('group_id', 'user_id'),)
 
 
 class User(Model):
@@ -15,6 +34,30 @@ class User(Model):
     user_name = TextField(default='Administrator')
     user_auth = BooleanField()
     user_created_at = FloatField()
+    groups = ManyToMany(Member, 'user_id', 'group_id', Group)
+
+
+class Task(Model):
+    """
+    A model class which counts its records by the completion flag.
+    """
+    task_id = IntegerField(primary_key=True)
+    done = BooleanField()
+    COUNTER_COLUMNS = ('done',)
+
+
+@pytest.fixture()
+def memory_backend():
+    """
+    Stores the models in a `MemoryBackend` during the test.
+    """
+    Storage.initialize(MemoryBackend())
+    User.create_table()
+    Task.create_table()
+    Group.create_table()
+    Member.create_table()
+    yield Storage.backend()
+    Storage.initialize(None)
 
 # --- Initialization attribute of  `PRIMARY_KEY`, `MAPPINGS`, `TABLE_NAME`, `FIELDS` ---
 
@@ -35,6 +78,7 @@ def test_init():
     assert User._select() == dedent('''
             SELECT user_id, user_name, user_auth, user_created_at FROM User
         ''').strip()
+    assert User.COLUMNS == ('user_id', 'user_name', 'user_auth', 'user_created_at')
     assert User._delete() == dedent(
         '''
         DELETE FROM User WHERE user_id=?
@@ -46,27 +90,6 @@ def test_get_value_or_default():
     assert User()._get_value_or_default('user_name') == 'Administrator'
     assert User(user_name='Alice')._get_value_or_default('user_name') == 'Alice'
 
-# --- SQL parts ---
-
-def test_create_table():
-    with patch('todo.model.SQLConnection.execute') as execute_sql:
-        User.create_table()
-        sql = [
-            'CREATE TABLE IF NOT EXISTS User ',
-            '(user_id INTEGER PRIMARY KEY,user_name TEXT ,',
-            'user_auth BOOLEAN ,user_created_at REAL )'
-        ]
-        assert execute_sql.call_args == call(''.join(sql))
-        assert execute_sql.return_value.close.call_count == 1
-
-
-def test_drop_table():
-    with patch('todo.model.SQLConnection.execute') as execute_sql:
-        User.drop_table()
-        assert execute_sql.call_args == call('DROP TABLE User')
-        assert execute_sql.return_value.close.call_count == 1
-
-
 def test_convert_result_to_object():
     convert_result = User.convert_result_to_object([(1, 'A', True, 123456789.123450)])
     assert convert_result == [{
@@ -95,79 +118,204 @@ def test_convert_result_to_object():
     ]
 
 
-def test_find_all():
-    
-    with patch('todo.model.SQLConnection.execute') as execute_sql:
-
-        User.find_all()
-        assert execute_sql.call_args == call(
-            'SELECT user_id, user_name, user_auth, user_created_at FROM User',
-            []
-        )
-        assert execute_sql.return_value.fetchall.call_count == 1
-        assert execute_sql.return_value.close.call_count == 1
-
-        User.find_all({'user_id': 1})
-        assert execute_sql.call_args == call(
-            'SELECT user_id, user_name, user_auth, user_created_at FROM User WHERE user_id=?',
-            [1]
-        )
-        assert execute_sql.return_value.fetchall.call_count == 2
-        assert execute_sql.return_value.close.call_count == 2
-
-        User.find_all({'user_auth': True}, size=1, order_by='id desc')
-        sql = [
-            'SELECT user_id, user_name, user_auth, user_created_at FROM User',
-            ' WHERE user_auth=? ORDER BY id desc'
-        ]
-        assert execute_sql.call_args == call(
-            ''.join(sql),
-            [True]
-        )
-        assert execute_sql.return_value.fetchall.call_count == 2
-        assert execute_sql.return_value.fetchmany.call_count == 1
-        assert execute_sql.return_value.fetchmany.call_args == call(1)
-        assert execute_sql.return_value.close.call_count == 3
-
-
-def test_find():
-    
-    with patch('todo.model.SQLConnection.execute') as execute_sql:
-        User.find(1)
-        assert execute_sql.call_args == call(
-            'SELECT user_id, user_name, user_auth, user_created_at FROM User WHERE user_id = ?',
-            [1]
-        )
-        assert execute_sql.return_value.fetchmany.call_count == 1
-        assert execute_sql.return_value.fetchmany.call_args == call(1)
-        assert execute_sql.return_value.close.call_count == 1
-
-
-def test_remove():
-    with patch('todo.model.SQLConnection.execute') as execute_sql:
-        User(user_id=1).remove()
-        assert execute_sql.call_args == call('DELETE FROM User WHERE user_id=?', [1])
-
-
-def test_update():
-    with patch('todo.model.SQLConnection.execute') as execute_sql:
-        User(user_id=1, user_name='user').update()
-        assert execute_sql.call_args == call(
-            'UPDATE User SET  user_id=?, user_name=? where user_id=?',
-            [1, 'user', 1]
-        )
-    
-
-def test_save():
-    with patch('todo.model.SQLConnection.execute') as execute_sql:
-        User(user_id=1, user_name='user').save()
-        assert execute_sql.call_args == call(
-            'INSERT INTO User (user_id, user_name, user_auth, user_created_at) VALUES(?,?,?,?)',
-            [1, 'user', False, 0.0]
-        )
-        User().save()
-        assert execute_sql.call_args == call(
-            'INSERT INTO User (user_id, user_name, user_auth, user_created_at) VALUES(?,?,?,?)',
-            [None, 'Administrator', False, 0.0]
-        )
-    
\ No newline at end of file
+
+def test_row_factory():
+    user = User.ROW_FACTORY(None, (1, 'A', 1, 123456789.123450))
+    assert type(user) is User
+    assert user == {
+        'user_id': 1,
+        'user_name': 'A',
+        'user_auth': True,
+        'user_created_at': 123456789.123450
+    }
+    assert user.user_auth is True
+    assert User.ROW_FACTORY(None, (2, None, 0, None)).user_auth is False
+    assert User.ROW_FACTORY(None, (3, None, None, None)).user_auth is None
+
+# --- DB manipulation ---
+
+def test_crud(memory_backend):
+    alice = User(user_id=1234, user_name='Alice wonderland',
+                 user_auth=True, user_created_at=1.0)
+    assert alice.save()
+    jack = User(user_id=4321, user_name='Black jack',
+                user_auth=False, user_created_at=1.0)
+    jack.save()
+    with pytest.raises(sqlite3.IntegrityError):
+        User(user_id=4321).save()
+
+    assert [jack] == User.find_all(size=1, order_by='user_id desc')
+    assert [alice, jack] == User.find_all(order_by='user_id')
+    assert [alice] == User.find_all({'user_auth': True})
+    assert [alice] == User.find(1234)
+    assert None == User.find(1111)
+
+    assert User(user_id=4321).remove()
+    assert not User(user_id=4321).remove()
+    assert [alice] == User.find_all()
+
+    assert False == User(user_id=1111, user_name='Alice').update()
+    assert User(user_id=1234, user_name='New Alice wonderland').update()
+    assert User.find(1234) == [User(
+        user_id=1234,
+        user_name='New Alice wonderland',
+        user_auth=True,
+        user_created_at=1.0
+    )]
+    assert User.find_all({'user_name': 'Alice wonderland'}) is None
+
+
+def test_find_all_order_and_condition(memory_backend):
+    for i, name in enumerate(['c', 'a', 'b', 'a']):
+        User(user_id=i, user_name=name, user_auth=i % 2 == 0).save()
+
+    result = User.find_all(order_by='user_name desc')
+    assert [u.user_name for u in result] == ['c', 'b', 'a', 'a']
+    result = User.find_all({'user_name': 'a'}, order_by='user_id desc')
+    assert [u.user_id for u in result] == [3, 1]
+    result = User.find_all({'user_name': 'a', 'user_auth': False})
+    assert [u.user_id for u in result] == [1, 3]
+    result = User.find_all({'user_auth': True}, size=1, order_by='user_id desc')
+    assert [u.user_id for u in result] == [2]
+
+
+def test_aggregate(memory_backend):
+    Task(task_id=1, done=False).save()
+    Task(task_id=2, done=False).save()
+    Task(task_id=3, done=True).save()
+
+    assert Task.count() == 3
+    assert Task.count({'done': False}) == 2
+    assert Task.min('task_id') == 1
+    assert Task.max('task_id', {'done': False}) == 2
+    assert Task.group_count('done') == {False: 2, True: 1}
+    assert Task.counters('done') == {False: 2, True: 1}
+
+    Task(task_id=1, done=True).update()
+    Task(task_id=2).remove()
+    assert Task.counters('done') == {False: 0, True: 2}
+    assert Task.group_count('done') == {True: 2}
+    with pytest.raises(NameError):
+        User.counters('user_auth')
+
+
+def test_transaction(memory_backend):
+    User(user_id=1, user_name='Alice').save()
+    with User.transaction():
+        User(user_id=2).save()
+    with pytest.raises(ValueError):
+        with User.transaction():
+            User(user_id=3).save()
+            User(user_id=1, user_name='Bob').update()
+            User(user_id=2).remove()
+            raise ValueError()
+    assert [u.user_id for u in User.find_all(order_by='user_id')] == [1, 2]
+    assert User.find(1)[0].user_name == 'Alice'
+    assert User.find_all({'user_name': 'Bob'}) is None
+
+
+def test_changes_since(memory_backend):
+    User(user_id=1, user_name='Alice').save()
+    User(user_id=2).save()
+    User(user_id=1, user_name='Alice').update()
+    User(user_id=1, user_name='Bob', user_auth=True).update()
+    User(user_id=2).remove()
+    with pytest.raises(ValueError):
+        with User.transaction():
+            User(user_id=3).save()
+            raise ValueError()
+
+    changes = User.changes_since(0)
+    assert [(c.seq, c.op, c.primary_key) for c in changes] == [
+        (1, 'insert', 1), (2, 'insert', 2), (3, 'update', 1), (4, 'delete', 2)]
+    assert changes[0].columns == tuple(User.COLUMNS)
+    assert changes[2].columns == ('user_name', 'user_auth')
+    assert changes[3].columns == ()
+    assert User.changes_since(2, size=1) == [changes[2]]
+    assert User.last_change_seq() == 4
+    assert Task.changes_since(0) == []
+
+    assert User.first_change_seq() == 1
+    assert User.prune_changes(2) == 2
+    assert User.changes_since(0) == changes[2:] and User.first_change_seq() == 3
+    # The latest change is kept, the sequence numbers go on.
+    assert User.prune_changes(10) == 1
+    assert User.changes_since(0) == changes[3:] and User.last_change_seq() == 4
+
+
+def test_composite_primary_key(memory_backend):
+    assert Member.PRIMARY_KEY == ('user_id', 'group_id')
+    assert Member.PRIMARY_KEYS == ('user_id', 'group_id')
+    assert User.PRIMARY_KEYS == ('user_id',)
+    Member(user_id=1, group_id=2).save()
+    Member(user_id=1, group_id=3).save()
+    with pytest.raises(sqlite3.IntegrityError):
+        Member(user_id=1, group_id=2).save()
+    assert Member.find((1, 2)) == [Member(user_id=1, group_id=2)]
+    assert Member(user_id=1, group_id=3).remove()
+    assert Member.find((1, 3)) is None
+    assert Member.changes_since(0)[-1].primary_key == (1, 3)
+
+
+def test_many_to_many(memory_backend):
+    for i, name in enumerate(['Alice', 'Bob', 'Carol'], 1):
+        User(user_id=i, user_name=name, user_auth=i != 2).save()
+    Group(group_id=1, group_name='admin').save()
+    Group(group_id=2, group_name='dev').save()
+    assert User.groups.add(1, 1) and User.groups.add(1, 2)
+    assert not User.groups.add(1, 2)
+    User.groups.add(2, 2)
+    User.groups.add(3, 2)
+
+    related = User.groups.load([1, 2, 4])
+    assert [g.group_name for g in related[1]] == ['admin', 'dev']
+    assert [g.group_name for g in related[2]] == ['dev']
+    assert related[4] == []
+
+    result = User.groups.find_all('group_name', ['dev'], order_by='user_id desc')
+    assert [u.user_id for u in result] == [3, 2, 1]
+    result = User.groups.find_all('group_name', ['dev', 'admin'])
+    assert [u.user_id for u in result] == [1]
+    result = User.groups.find_all('group_name', ['dev'], {'user_auth': True}, size=1)
+    assert [u.user_id for u in result] == [1]
+    assert User.groups.find_all('group_name', ['nobody']) is None
+
+    assert User.groups.remove(1, 1)
+    User.groups.clear(2)
+    assert User.groups.load([1, 2]) == {1: [Group(group_id=2, group_name='dev')], 2: []}
+
+
+def test_compressed_text_field():
+    field = CompressedTextField(threshold=10)
+    text = 'abc ' * 100
+    packed = field.compress(text)
+    assert packed[:1] == b'\x01' and len(packed) < 50
+    assert decompress(packed) == text
+    # Short texts, texts which do not get shorter and None are kept.
+    assert field.compress('abc') == 'abc'
+    assert field.compress('0123456789') == '0123456789'
+    assert field.compress(None) is None
+    with pytest.raises(ValueError):
+        decompress(b'\x09abc')
+    with pytest.raises(ValueError):
+        CompressedTextField(codec='lz4')
+
+    class Note(Model):
+        note_id = IntegerField(primary_key=True)
+        body = CompressedTextField()
+    assert Note.COMPRESSED_COLUMNS == {'body': CompressedTextField()}
+    assert Note.__mro__[1] is CompressedTexts
+    # The text is decompressed once, on the first read of the attribute.
+    note = Note(note_id=1, body=packed)
+    assert dict.__getitem__(note, 'body') is packed
+    assert note.body == text and dict.__getitem__(note, 'body') == text
+    # Every read of the record as a dict reads the text.
+    for read in [lambda n: n['body'], lambda n: n.get('body'), lambda n: dict(n)['body'],
+                 lambda n: {**n}['body'], lambda n: list(n.values())[1],
+                 lambda n: json.loads(json.dumps(n))['body'], lambda n: n.copy()['body']]:
+        assert read(Note(note_id=1, body=packed)) == text
+    assert Note(note_id=1, body=packed) == Note(note_id=1, body=text)
+    with pytest.raises(ValueError, match='compressed column Note.body'):
+        Note.find_all({'body': text})
+    with pytest.raises(ValueError):
+        Note.group_count('body')
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import Mock, patch, call
+import pytest
+import sqlite3
+from todo.model import Model
+from todo.storage import (
+    Compare, Storage, StorageBackend, SQLiteBackend, MemoryBackend, LogBackend,
+    ShardedBackend)
+from datetime import datetime
+import os
+from todo.field import IntegerField, TextField, BooleanField, FloatField
+from todo.todo import Todo
+
+
+class User(Model):
+    """
+    The simplest model class which has a single primary key.
+    """
+    user_id = IntegerField(primary_key=True)
+    user_name = TextField(default='Administrator')
+    user_auth = BooleanField()
+    user_created_at = FloatField()
+
+
+@pytest.fixture(autouse=True)
+def sqlite_backend():
+    """
+    Stores the models in the default `SQLiteBackend` during the test.
+    """
+    Storage.initialize(SQLiteBackend())
+    yield
+    Storage.initialize(None)
+
+
+def test_initialize_storage():
+    Storage.initialize('memory:')
+    assert isinstance(Storage.backend(), MemoryBackend)
+    Storage.initialize(None)
+    assert isinstance(Storage.backend(), SQLiteBackend)
+    with patch('todo.utility.sqlite3.connect') as mock_conn:
+        Storage.initialize('file:/tmp/data-test.db')
+        assert isinstance(Storage.backend(), SQLiteBackend)
+        Storage.backend().connection
+        assert mock_conn.call_args == call('file:/tmp/data-test.db', uri=True)
+        Storage.initialize('/tmp/data-test.db', read_only=True, immutable=True)
+        Storage.backend().connection
+        assert mock_conn.call_args == call(
+            'file:/tmp/data-test.db?mode=ro&immutable=1', uri=True)
+        assert Storage.backend().connection.read_only
+
+
+# --- SQL parts of `SQLiteBackend` ---
+
+def test_create_table():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        User.create_table()
+        sql = [
+            'CREATE TABLE IF NOT EXISTS User ',
+            '(user_id INTEGER PRIMARY KEY,user_name TEXT ,',
+            'user_auth BOOLEAN ,user_created_at REAL )'
+        ]
+        assert execute_sql.call_args_list[0] == call(''.join(sql))
+        # The table, the change feed table and its three triggers.
+        assert execute_sql.return_value.close.call_count == 5
+
+
+class Member(Model):
+    """
+    A join model class with a composite primary key.
+    """
+    user_id = IntegerField(primary_key=True)
+    group_id = IntegerField(primary_key=True)
+
+
+def test_create_table_with_composite_primary_key():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        Member.create_table()
+        assert execute_sql.call_args_list[0] == call(
+            'CREATE TABLE IF NOT EXISTS Member (user_id INTEGER ,group_id INTEGER ,'
+            'PRIMARY KEY (user_id, group_id))')
+        Member(user_id=1, group_id=2).remove()
+        assert execute_sql.call_args == call(
+            'DELETE FROM Member WHERE user_id=? AND group_id=?', [1, 2])
+
+
+def test_drop_table():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        User.drop_table()
+        assert execute_sql.call_args_list[0] == call('DROP TABLE User')
+        assert execute_sql.call_args == call('DROP TABLE IF EXISTS UserChanges')
+        assert execute_sql.return_value.close.call_count == 2
+
+
+def test_find_all():
+    
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+
+        User.find_all()
+        assert execute_sql.call_args == call(
+            'SELECT user_id, user_name, user_auth, user_created_at FROM User',
+            []
+        )
+        assert execute_sql.return_value.fetchall.call_count == 1
+        assert execute_sql.return_value.close.call_count == 1
+
+        User.find_all({'user_id': 1})
+        assert execute_sql.call_args == call(
+            'SELECT user_id, user_name, user_auth, user_created_at FROM User WHERE user_id=?',
+            [1]
+        )
+        assert execute_sql.return_value.fetchall.call_count == 2
+        assert execute_sql.return_value.close.call_count == 2
+
+        User.find_all({'user_auth': True}, size=1, order_by='id desc')
+        sql = [
+            'SELECT user_id, user_name, user_auth, user_created_at FROM User',
+            ' WHERE user_auth=? ORDER BY id desc LIMIT ?'
+        ]
+        assert execute_sql.call_args == call(
+            ''.join(sql),
+            [True, 1]
+        )
+        assert execute_sql.return_value.fetchall.call_count == 3
+        assert execute_sql.return_value.close.call_count == 3
+
+
+def test_find_all_with_compare():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        User.find_all({'user_auth': False, 'user_created_at': Compare('>=', 1.0)})
+        assert execute_sql.call_args == call(
+            'SELECT user_id, user_name, user_auth, user_created_at FROM User'
+            ' WHERE user_auth=? AND user_created_at >= ?',
+            [False, 1.0]
+        )
+
+
+def test_find():
+    
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        User.find(1)
+        assert execute_sql.call_args == call(
+            'SELECT user_id, user_name, user_auth, user_created_at FROM User WHERE user_id = ?',
+            [1]
+        )
+        assert execute_sql.return_value.fetchmany.call_count == 1
+        assert execute_sql.return_value.fetchmany.call_args == call(1)
+        assert execute_sql.return_value.close.call_count == 1
+
+
+def test_remove():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        User(user_id=1).remove()
+        assert execute_sql.call_args == call('DELETE FROM User WHERE user_id=?', [1])
+
+
+def test_update():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        User(user_id=1, user_name='user').update()
+        assert execute_sql.call_args == call(
+            'UPDATE User SET  user_id=?, user_name=? where user_id=?',
+            [1, 'user', 1]
+        )
+    
+
+def test_save():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        User(user_id=1, user_name='user').save()
+        assert execute_sql.call_args == call(
+            'INSERT INTO User (user_id, user_name, user_auth, user_created_at) VALUES(?,?,?,?)',
+            [1, 'user', False, 0.0]
+        )
+        User().save()
+        assert execute_sql.call_args == call(
+            'INSERT INTO User (user_id, user_name, user_auth, user_created_at) VALUES(?,?,?,?)',
+            [None, 'Administrator', False, 0.0]
+        )
+    
+
+def test_count():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        execute_sql.return_value.fetchone.return_value = (2,)
+        assert User.count() == 2
+        assert execute_sql.call_args == call('SELECT COUNT(*) FROM User', [])
+
+        User.count({'user_auth': True, 'user_name': 'A'})
+        assert execute_sql.call_args == call(
+            'SELECT COUNT(*) FROM User WHERE user_auth=? AND user_name=?',
+            [True, 'A']
+        )
+        assert execute_sql.return_value.close.call_count == 2
+
+
+def test_min_and_max():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        execute_sql.return_value.fetchone.return_value = (1.5,)
+        assert User.min('user_created_at') == 1.5
+        assert execute_sql.call_args == call(
+            'SELECT MIN(user_created_at) FROM User', [])
+
+        User.max('user_created_at', {'user_auth': False})
+        assert execute_sql.call_args == call(
+            'SELECT MAX(user_created_at) FROM User WHERE user_auth=?', [False])
+
+
+def test_group_count():
+    with patch('todo.storage.SQLConnection.execute') as execute_sql:
+        execute_sql.return_value.fetchall.return_value = [(0, 3), (1, 2)]
+        assert User.group_count('user_auth') == {False: 3, True: 2}
+        assert execute_sql.call_args == call(
+            'SELECT user_auth, COUNT(*) FROM User GROUP BY user_auth', [])
+
+
+def test_upsert():
+    with patch('todo.storage.SQLConnection.executemany') as executemany, \
+            patch('todo.storage.SQLConnection.execute'):
+        executemany.return_value.rowcount = 1
+        assert User(user_id=1, user_name='user').upsert()
+        assert executemany.call_args == call(
+            'INSERT INTO User (user_id, user_name, user_auth, user_created_at) '
+            'VALUES(?,?,?,?) ON CONFLICT (user_id) DO UPDATE SET '
+            'user_name=excluded.user_name, user_auth=excluded.user_auth, '
+            'user_created_at=excluded.user_created_at',
+            [[1, 'user', False, 0.0]]
+        )
+        rows = [{'user_id': i} for i in range(5)]
+        assert User.bulk_upsert(rows, 'ignore', batch_size=2) == 3
+        assert executemany.call_args_list[-3][0][0].endswith(
+            'ON CONFLICT DO NOTHING')
+        assert [len(c[0][1]) for c in executemany.call_args_list[-3:]] == [2, 2, 1]
+    with pytest.raises(ValueError):
+        User.bulk_upsert([], 'update-newer')
+
+
+@pytest.mark.parametrize('path', ['memory:', 'log'])
+def test_memory_backend_upsert(path, tmp_path):
+    User.VERSION_COLUMN = 'user_created_at'
+    try:
+        Storage.initialize(path if path == 'memory:' else 'log:' + str(tmp_path / 'todo.log'))
+        User.create_table()
+        User(user_id=1, user_name='old', user_created_at=1.0).save()
+        User(user_id=2, user_name='new', user_created_at=3.0).save()
+        rows = [
+            User(user_id=1, user_name='newer', user_created_at=2.0),
+            User(user_id=2, user_name='older', user_created_at=2.0),
+            User(user_id=3, user_name='added', user_created_at=2.0),
+        ]
+        assert User.bulk_upsert(rows, 'update-newer') == 2
+        assert User.bulk_upsert(rows, 'ignore') == 0
+        assert [u.user_name for u in User.find_all(order_by='user_id')] == [
+            'newer', 'new', 'added']
+        assert User.bulk_upsert(rows) == 3
+        assert User.find(2)[0].user_name == 'older'
+        Storage.close()
+    finally:
+        del User.VERSION_COLUMN
+        Storage.initialize(None)
+
+
+def test_memory_backend_collisions():
+    Storage.initialize('memory:')
+    User.create_table()
+    for user_id, name in enumerate(['a', 'b', 'a', 'c', 'b', 'a'], 1):
+        User(user_id=user_id, user_name=name).save()
+    assert Storage.backend().collisions(User, 'user_name', 'user_id') == [[1, 3, 6], [2, 5]]
+    # The base class groups a scan of the records.
+    assert StorageBackend.collisions(Storage.backend(), User, 'user_name', 'user_id') == [
+        [1, 3, 6], [2, 5]]
+    Storage.initialize(None)
+
+
+# --- `LogBackend` ---
+
+def test_memory_backend_compare():
+    Storage.initialize('memory:')
+    User.create_table()
+    User(user_id=1, user_created_at=3.0).save()
+    User(user_id=2, user_created_at=1.0).save()
+    User(user_id=3).save()
+    result = User.find_all({'user_created_at': Compare('<', 2.0)}, order_by='user_id')
+    assert [u.user_id for u in result] == [2, 3]
+    result = User.find_all({'user_auth': False, 'user_created_at': Compare('>', 2.0)})
+    assert [u.user_id for u in result] == [1]
+    assert [u.user_id for u in User.find_all({'user_created_at': Compare('IS', 0.0)})] == [3]
+    assert User.find_all({'user_id': 1, 'user_created_at': Compare('!=', 3.0)}) is None
+    Storage.initialize(None)
+
+
+@pytest.fixture()
+def log_path(tmp_path):
+    """
+    Path to a log file of `LogBackend` which is closed after the test.
+    """
+    path = str(tmp_path / 'todo.log')
+    yield path
+    Storage.close()
+
+
+def test_log_backend_replays_the_log(log_path):
+    Storage.initialize('log:' + log_path)
+    User.create_table()
+    User(user_id=1, user_name='Alice').save()
+    User(user_id=2, user_name='Bob').save()
+    User(user_id=1, user_name='New Alice').update()
+    User(user_id=2).remove()
+    Storage.close()
+
+    Storage.initialize('log:' + log_path)
+    User.create_table()
+    assert User.find_all() == [User(
+        user_id=1, user_name='New Alice', user_auth=False, user_created_at=0.0)]
+
+
+def test_log_backend_drops_the_records_of_rollback(log_path):
+    Storage.initialize('log:' + log_path)
+    User.create_table()
+    with pytest.raises(ValueError):
+        with User.transaction():
+            User(user_id=1).save()
+            raise ValueError()
+    with User.transaction():
+        User(user_id=2).save()
+    Storage.close()
+
+    Storage.initialize('log:' + log_path)
+    assert [u.user_id for u in User.find_all()] == [2]
+
+
+def test_log_backend_replays_composite_primary_keys(log_path):
+    Storage.initialize('log:' + log_path)
+    Member.create_table()
+    Member(user_id=1, group_id=1).save()
+    Member(user_id=1, group_id=2).save()
+    Member(user_id=1, group_id=1).remove()
+    Storage.backend().snapshot()
+    Member(user_id=2, group_id=2).save()
+    Member(user_id=1, group_id=2).remove()
+    Storage.close()
+
+    Storage.initialize('log:' + log_path)
+    assert Member.find_all() == [Member(user_id=2, group_id=2)]
+
+
+def test_log_backend_snapshot_keeps_the_counters_of_a_tuple_of_columns(log_path):
+    Storage.initialize('log:' + log_path)
+    Todo.create_table()
+    Todo(id=1, text='a', list_id=1).save()
+    Todo(id=2, text='b', list_id=1, is_completed=True).save()
+    Storage.backend().snapshot()
+    Todo(id=3, text='c').save()
+    Storage.close()
+
+    Storage.initialize('log:' + log_path)
+    assert Todo.counters(('list_id', 'is_completed')) == {
+        (0, False): 1, (1, False): 1, (1, True): 1}
+
+
+def test_log_backend_snapshot_and_compaction(log_path):
+    Storage.initialize(LogBackend(log_path, snapshot_every=5))
+    User.create_table()
+    for i in range(12):
+        User(user_id=i).save()
+    for i in range(0, 12, 2):
+        User(user_id=i).remove()
+    Storage.close()
+    with open(log_path) as f:
+        assert len(f.readlines()) < 6
+
+    Storage.initialize('log:' + log_path)
+    assert [u.user_id for u in User.find_all(order_by='user_id')] == [1, 3, 5, 7, 9, 11]
+    assert User.count() == 6
+
+
+def test_log_backend_ignores_a_torn_record(log_path):
+    Storage.initialize('log:' + log_path)
+    User.create_table()
+    User(user_id=1).save()
+    Storage.close()
+    with open(log_path, 'a') as f:
+        f.write('{"op":"insert","table":"Us')
+
+    Storage.initialize('log:' + log_path)
+    User(user_id=2).save()
+    Storage.close()
+
+    Storage.initialize('log:' + log_path)
+    assert [u.user_id for u in User.find_all(order_by='user_id')] == [1, 2]
+
+
+def test_log_backend_skips_the_log_covered_by_snapshot(log_path):
+    backend = LogBackend(log_path)
+    Storage.initialize(backend)
+    User.create_table()
+    User(user_id=1).save()
+    backend.snapshot()
+    User(user_id=2).save()
+    Storage.close()
+    # The compaction crashed after the snapshot of the log is written.
+    with open(log_path) as f:
+        records = f.readlines()
+    with open(log_path, 'w') as f:
+        f.write(records[0].replace('1', '0'))
+        f.write('{"op":"insert","table":"User","row":[1,null,false,0.0]}\n')
+
+    Storage.initialize('log:' + log_path)
+    User(user_id=3).save()
+    Storage.close()
+
+    Storage.initialize('log:' + log_path)
+    assert [u.user_id for u in User.find_all(order_by='user_id')] == [1, 3]
+
+
+# --- `ShardedBackend` ---
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_sharded_backend_by_hash(tmp_path, parallel):
+    path = str(tmp_path / 'data.db')
+    Storage.initialize(ShardedBackend(path, shards=3, parallel=parallel))
+    User.create_table()
+    for i in range(1, 21):
+        User(user_id=i, user_name='user {}'.format(i % 4), user_auth=i % 2 == 0).save()
+
+    backend = Storage.backend()
+    shards = [b.aggregate(User, 'COUNT', '*') for b in backend.backends.values()]
+    assert sum(shards) == 20 and all(shards)
+    shard = backend.backends[str(backend._hash(7))]
+    assert shard.get(User, 7) and User.find(7)[0].user_name == 'user 3'
+
+    result = User.find_all(order_by='user_id desc', size=5)
+    assert [u.user_id for u in result] == [20, 19, 18, 17, 16]
+    result = User.find_all({'user_auth': True}, order_by='user_name, user_id')
+    assert [(u.user_name, u.user_id) for u in result] == [
+        ('user 0', 4), ('user 0', 8), ('user 0', 12), ('user 0', 16), ('user 0', 20),
+        ('user 2', 2), ('user 2', 6), ('user 2', 10), ('user 2', 14), ('user 2', 18)]
+    result = User.find_all(order_by='user_auth desc, user_id', size=2)
+    assert [u.user_id for u in result] == [2, 4]
+
+    assert User(user_id=7, user_name='seven').update()
+    assert User(user_id=8).remove()
+    assert not User(user_id=8).remove()
+    assert User.count() == 19
+    assert User.max('user_id', {'user_auth': False}) == 19
+    assert User.group_count('user_auth') == {False: 10, True: 9}
+    Storage.close()
+
+
+def test_sharded_backend_by_month(tmp_path):
+    path = str(tmp_path / 'data.db')
+    Storage.initialize(ShardedBackend(path, by='month', month_column='user_created_at'))
+    User.create_table()
+    january = datetime(2018, 1, 15).timestamp()
+    february = datetime(2018, 2, 15).timestamp()
+    User(user_id=1, user_created_at=january).save()
+    User(user_id=2, user_created_at=february).save()
+    User(user_id=3, user_created_at=january).save()
+    Storage.close()
+
+    assert sorted(os.listdir(str(tmp_path))) == ['data.db.2018-01', 'data.db.2018-02']
+    Storage.initialize(ShardedBackend(path, by='month', month_column='user_created_at'))
+    User.create_table()
+    assert [u.user_id for u in User.find_all(order_by='user_id')] == [1, 2, 3]
+    assert User.find(2)[0].user_created_at == february
+    assert User(user_id=3).remove()
+    assert User.count() == 2
+    Storage.close()
@@ -4,14 +4,18 @@ import pytest
 import sqlite3
 import argparse
 from todo.cmd_manager import CmdLineParser
-from todo.todo import Todo
+from todo.storage import Compare
+from todo.todo import Checkpoint, Todo, TodoSignature
+from todo.utility import DuplicateRecordError, RecordIsNotFoundError
 
 
 def test_init_action():
-    with patch('todo.cmd_manager.Todo') as mock_todo:
+    with patch('todo.cmd_manager.Todo') as mock_todo, \
+            patch('todo.cmd_manager.MODELS', [mock_todo, Mock()]) as models:
         parser = CmdLineParser(['--init'])
         parser._init_action()
         assert mock_todo.drop_table.call_count == 1
+        assert models[1].drop_table.call_count == 1
 
 
 def test_add_action():
@@ -19,17 +23,77 @@ def test_add_action():
         with patch(
             'todo.cmd_manager.CmdLineParser.generate_next_id') as mock_id:
             mock_id.return_value = 10
-            CmdLineParser(['add', 'test text'])._add_action()
-            assert mock_todo.call_args == call(text='test text', id=10)
+            with patch('todo.cmd_manager.uuid4') as mock_uuid:
+                mock_uuid.return_value.hex = 'abc'
+                CmdLineParser(['add', 'test text'])._add_action()
+            assert mock_todo.call_args == call(
+                text='test text', id=10, uid='abc', priority=3, due_at=None, parent_id=None,
+                list_id=0)
+            assert mock_todo.return_value.save.call_count == 1
+            assert mock_todo.find_all.call_count == 0
+
+
+def test_add_action_with_show_open():
+    with patch('todo.cmd_manager.Todo') as mock_todo:
+        with patch(
+            'todo.cmd_manager.CmdLineParser.generate_next_id') as mock_id:
+            mock_id.return_value = 10
+            CmdLineParser(['add', 'test text', '--show-open', '5'])._add_action()
             assert mock_todo.return_value.save.call_count == 1
-            assert mock_todo.find_all.call_args == call({'is_completed': False})
+            assert mock_todo.find_all.call_args == call(
+                {'list_id': 0, 'is_completed': False}, order_by='id', size=5)
+            CmdLineParser(['add', 'test text', '--show-open'])._add_action()
+            assert mock_todo.find_all.call_args == call(
+                {'list_id': 0, 'is_completed': False}, order_by='id', size=10)
+
+
+def test_add_action_with_quiet(capsys):
+    with patch('todo.cmd_manager.Todo') as mock_todo:
+        with patch(
+            'todo.cmd_manager.CmdLineParser.generate_next_id') as mock_id:
+            mock_id.return_value = 10
+            mock_todo.return_value.id = 10
+            CmdLineParser(['add', 'test text', '-q'])._add_action()
+            assert mock_todo.find_all.call_count == 0
+            assert capsys.readouterr().out == '10\n'
+
+
+def test_add_action_with_no_duplicates(capsys):
+    with patch('todo.cmd_manager.Todo') as mock_todo, \
+            patch('todo.dedupe.DuplicateIndex') as mock_index:
+        similar = Todo(id=3, text='buy milk', created_at=0.0, update_at=0.0, priority=3,
+                       due_at=None)
+        mock_index.return_value.similar.return_value = [(similar, 1.0)]
+        with pytest.raises(DuplicateRecordError):
+            CmdLineParser(['add', 'Buy milk', '--no-duplicates', '--threshold', '0.7'])._add_action()
+        assert mock_index.call_args == call(
+            mock_todo, TodoSignature, 'todo_id', Checkpoint, 0.7, {'list_id': 0})
+        assert mock_index.return_value.refresh.call_count == 1
+        assert mock_index.return_value.similar.call_args == call('Buy milk')
+        assert mock_todo.return_value.save.call_count == 0
+        assert capsys.readouterr().out.startswith('3 | buy milk')
+        mock_index.return_value.similar.return_value = []
+        with patch('todo.cmd_manager.CmdLineParser.generate_next_id'):
+            CmdLineParser(['add', 'Buy milk', '--no-duplicates'])._add_action()
+        assert mock_todo.return_value.save.call_count == 1
 
 
 def test_delete_action():
     with patch('todo.cmd_manager.Todo') as mock_todo:
+        mock_todo.find_all.side_effect = [[Todo(id=1, parent_id=None)], None]
         CmdLineParser(['delete', '1'])._delete_action()
         assert mock_todo.call_args == call(id=1)
         assert mock_todo.return_value.remove.call_count == 1
+        assert mock_todo.find_all.call_args_list == [
+            call({'list_id': 0, 'id': 1}, size=1), call({'parent_id': 1})]
+
+
+def test_delete_action_out_of_the_list():
+    with patch('todo.cmd_manager.Todo') as mock_todo:
+        mock_todo.find_all.return_value = None
+        with pytest.raises(RecordIsNotFoundError):
+            CmdLineParser(['delete', '1'])._delete_action()
+        assert mock_todo.return_value.remove.call_count == 0
 
 
 def test_update_action():
@@ -43,6 +107,7 @@ def test_update_action():
                 update_at=10.102
             )
             assert mock_todo.return_value.update.call_count == 1
+            assert mock_todo.find_all.call_args == call({'list_id': 0, 'id': 1}, size=1)
 
 
 def test_complete_action():
@@ -58,11 +123,34 @@ def test_complete_action():
             assert mock_todo.return_value.update.call_count == 1
 
 
+def test_complete_action_recursive(capsys):
+    with patch('todo.cmd_manager.Todo') as mock_todo:
+        with patch('todo.cmd_manager.time.time') as mock_time:
+            mock_time.return_value = 1010.1010
+            mock_todo.subtasks.update.return_value = 3
+            CmdLineParser(['complete', '10', '-r'])._complete_action()
+            assert mock_todo.subtasks.update.call_args == call(
+                10, {'is_completed': True, 'update_at': 1010.1010})
+            assert mock_todo.return_value.update.call_count == 0
+            assert capsys.readouterr().out == 'Task 10 and 2 subtasks complete.\n'
+
+
+def test_show_action_with_tree():
+    with patch('todo.cmd_manager.Todo') as mock_todo, patch(
+            'todo.cmd_manager.CmdLineParser._print_tree') as mock_print:
+        mock_todo.find_all.return_value = [Todo(id=1), Todo(id=4)]
+        CmdLineParser(['show', '--tree'])._show_action()
+        assert mock_todo.find_all.call_args == call(
+            {'list_id': 0, 'parent_id': Compare('IS', None)}, order_by='id')
+        assert mock_todo.subtasks.walk.call_args == call([1, 4])
+        assert mock_print.call_args == call(mock_todo.subtasks.walk.return_value)
+
+
 def test_show_action_when_choice_complete():
     with patch('todo.cmd_manager.Todo') as mock_todo:
         CmdLineParser(['show', '-c'])._show_action()
         assert mock_todo.find_all.call_args == call(
-            {'is_completed': True}
+            {'list_id': 0, 'is_completed': True}, order_by='id'
         )
 
 
@@ -70,14 +158,38 @@ def test_show_action_when_choice_incomplete():
     with patch('todo.cmd_manager.Todo') as mock_todo:
         CmdLineParser(['show', '-i'])._show_action()
         assert mock_todo.find_all.call_args == call(
-            {'is_completed': False}
+            {'list_id': 0, 'is_completed': False}, order_by='id'
         )
 
 
 def test_show_action_when_choice_all():
     with patch('todo.cmd_manager.Todo') as mock_todo:
         CmdLineParser(['show', '-a'])._show_action()
-        assert mock_todo.find_all.call_args == call()
+        assert mock_todo.find_all.call_args == call({'list_id': 0}, order_by='id')
+
+
+def test_show_action_with_sort():
+    with patch('todo.cmd_manager.Todo') as mock_todo:
+        CmdLineParser(['show', '-i', '--sort', 'due'])._show_action()
+        assert mock_todo.find_all.call_args == call(
+            {'list_id': 0, 'is_completed': False}, order_by='due_at, priority')
+        CmdLineParser(['show', '-a', '--sort', 'created'])._show_action()
+        assert mock_todo.find_all.call_args == call(
+            {'list_id': 0}, order_by='is_completed, created_at')
+
+
+def test_next_action():
+    with patch('todo.cmd_manager.Todo') as mock_todo, patch(
+            'todo.cmd_manager.CmdLineParser._print_and_check_result') as mock_print:
+        mock_todo.find_all.side_effect = [['due'], ['no due']]
+        CmdLineParser(['next', '-n', '3'])._next_action()
+        assert mock_print.call_args == call(['due', 'no due'])
+        assert mock_todo.find_all.call_args_list == [
+            call({'list_id': 0, 'is_completed': False, 'due_at': Compare('>', float('-inf'))},
+                 order_by='due_at, priority', size=3),
+            call({'list_id': 0, 'is_completed': False, 'due_at': Compare('IS', None)},
+                 order_by='priority', size=2),
+        ]
 
 
 def test_generate_next_id():
@@ -90,3 +202,21 @@ def test_generate_next_id():
         mock_todo.find_all.return_value = None
         result = CmdLineParser([]).generate_next_id()
         assert result == 1
+
+
+def test_show_action_with_tags():
+    with patch('todo.cmd_manager.Todo') as mock_todo:
+        CmdLineParser(['show', '-i', '--tag', 'a', '--tag', 'b'])._show_action()
+        assert mock_todo.tags.find_all.call_args == call(
+            'name', ['a', 'b'], {'list_id': 0, 'is_completed': False}, order_by='id')
+        assert mock_todo.find_all.call_count == 0
+
+
+def test_tag_add_action():
+    with patch('todo.cmd_manager.Todo') as mock_todo, \
+            patch('todo.cmd_manager.Tag') as mock_tag:
+        mock_tag.find_or_create.side_effect = [Mock(id=5), Mock(id=6)]
+        CmdLineParser(['tag', 'add', '1', 'old', 'new'])._tag_add_action()
+        assert mock_tag.find_or_create.call_args_list == [
+            call({'name': 'old'}), call({'name': 'new'})]
+        assert mock_todo.tags.add.call_args_list == [call(1, 5), call(1, 6)]
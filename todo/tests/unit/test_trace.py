@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import json
+from todo.trace import Tracer
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span('query') as span:
+        assert span is None
+    assert tracer.span('query') is Tracer.NULL_SPAN
+    assert tracer.events == []
+
+
+def test_nested_spans():
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span('command', action='show'):
+        with tracer.span('execute', sql='SELECT 1'):
+            pass
+        with tracer.span('execute', sql='SELECT 2'):
+            pass
+    assert [(e[0], e[3]) for e in tracer.events] == [
+        ('execute', 1), ('execute', 1), ('command', 0)]
+    events = tracer.chrome_trace()['traceEvents']
+    assert [e['name'] for e in events] == ['command', 'execute', 'execute']
+    assert events[0]['ph'] == 'X' and events[0]['args'] == {'action': 'show'}
+    assert events[1]['ts'] >= events[0]['ts']
+
+
+def test_summary_subtracts_the_nested_spans():
+    tracer = Tracer()
+    tracer.enable()
+    tracer.origin = 0.0
+    tracer.add('command', 0.0, 0.010, 0)
+    tracer.add('execute', 0.001, 0.003, 1)
+    tracer.add('fetch', 0.002, 0.0025, 2)
+    tracer.add('execute', 0.004, 0.008, 1)
+    tracer.add('render', 0.012, 0.013, 0)
+    assert tracer.summary().splitlines() == [
+        'span                  calls   total ms    self ms',
+        'command                   1      10.00       4.00',
+        'execute                   2       6.00       5.50',
+        'render                    1       1.00       1.00',
+        'fetch                     1       0.50       0.50',
+    ]
+
+
+def test_write_chrome_trace(tmp_path):
+    tracer = Tracer()
+    tracer.enable()
+    tracer.origin = 0.0
+    tracer.add('import', 0.0, 0.05)
+    path = tracer.write(str(tmp_path / 'trace.json'))
+    trace = json.loads(open(path).read())
+    assert trace['traceEvents'][0]['dur'] == 50000.0
@@ -73,3 +73,25 @@ def test_model_execute_set_autocommit_is_false():
         assert mock_conn.return_value.cursor.return_value.execute.call_count == 1
         assert mock_conn.return_value.cursor.return_value.execute.call_args == call(
             'SELECT * FROM table_name WHERE column = ?', ['values'])
+
+
+def test_model_execute_in_transaction():
+    """
+    Test `SQLConnection.execute()` does not commit inside a transaction.
+    """
+    with patch('todo.utility.sqlite3.connect') as mock_conn:
+        SQLConnection.initialize('file:/tmp/data-test.db')
+        with SQLConnection().transaction():
+            SQLConnection().execute('DELETE FROM table_name')
+            with SQLConnection().transaction():
+                SQLConnection().execute('DELETE FROM table_name')
+            assert mock_conn.return_value.commit.call_count == 0
+        assert mock_conn.return_value.commit.call_count == 1
+        assert mock_conn.return_value.cursor.return_value.execute.call_args_list[0] == call(
+            'BEGIN IMMEDIATE', ())
+
+        with pytest.raises(ValueError):
+            with SQLConnection().transaction():
+                raise ValueError()
+        assert mock_conn.return_value.rollback.call_count == 1
+        assert mock_conn.return_value.commit.call_count == 1
@@ -1,16 +1,118 @@
 # -*- coding: utf-8 -*-
-from .model import Model
-from .field import IntegerField, TextField, BooleanField, FloatField
+from .model import Model, ManyToMany, Tree
+from .field import IntegerField, TextField, BooleanField, FloatField, CompressedTextField
 import time
 
 
+class Tag(Model):
+    """
+    Tag object
+    """
+    UNIQUE_INDEXES = (('name',),)
+
+    id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+    name = TextField(column_type='TEXT NOT NULL')
+
+
+class TodoList(Model):
+    """
+    Named list of tasks, the tasks of the default list have list id 0
+    """
+    # The name of the default list, it has no row.
+    DEFAULT_NAME = 'default'
+    UNIQUE_INDEXES = (('name',),)
+
+    id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+    name = TextField(column_type='TEXT NOT NULL')
+
+
+class TodoTag(Model):
+    """
+    Join object of the tags of the tasks
+    """
+    # The primary key indexes the tags of a task, this index the tasks of a tag.
+    INDEXES = (('tag_id', 'todo_id'),)
+
+    todo_id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+    tag_id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+
+
+class TodoSignature(Model):
+    """
+    Bucket of a band of the MinHash signature of an open task, see
+    `DuplicateIndex`.
+    """
+    # The rows are derived from the tasks, they need no change feed.
+    CHANGE_FEED = False
+    # The primary key finds the tasks of a bucket, this the rows of a task.
+    INDEXES = (('todo_id',),)
+
+    bucket = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+    todo_id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+
+
+class Checkpoint(Model):
+    """
+    Position of an index in the change feed of the tasks
+    """
+    CHANGE_FEED = False
+
+    name = TextField(column_type='TEXT NOT NULL', primary_key=True)
+    seq = IntegerField(column_type='INTEGER NOT NULL', default=0)
+
+
 class Todo(Model):
     """
     Todo object
     """
-    id = IntegerField(column_type='TEXT NOT NULL', primary_key=True)
-    text = TextField(column_type='INTEGER NOT NULL', default='')
+    # Schema version of the table, see `Migration`.
+    SCHEMA_VERSION = 10
+    # The counters of `list_id` and `is_completed` give the open and the
+    # completed tasks of every list.
+    COUNTER_COLUMNS = ('is_completed', 'list_id', ('list_id', 'is_completed'))
+    # `bulk_upsert(..., 'update-newer')` keeps the latest edit of a task.
+    VERSION_COLUMN = 'update_at'
+    # Every query of the tasks of a list is a range of an index which
+    # starts with `list_id`, so it does not read the other lists. The open
+    # tasks are read in the order of these indexes, so `todo next` and
+    # `show --sort` stop after the listed rows instead of sorting.
+    INDEXES = (
+        # A task and its subtasks are found by key, they are in one list.
+        ('uid',),
+        ('parent_id',),
+        # The entries of an index end with the id, so these read the tasks
+        # of a list by id, e.g. the pages of `todo http`.
+        ('list_id',),
+        ('list_id', 'is_completed'),
+        ('list_id', 'is_completed', 'due_at', 'priority'),
+        ('list_id', 'is_completed', 'priority'),
+        ('list_id', 'is_completed', 'created_at'),
+        # `todo report` counts the completions per day and reads the lead
+        # time percentiles from these without reading the rows.
+        ('list_id', 'is_completed', 'MAX(update_at, created_at)'),
+        ('list_id', 'is_completed', 'update_at - created_at'),
+    )
+
+    id = IntegerField(column_type='INTEGER NOT NULL', primary_key=True)
+    # Pasted logs and stack traces are stored compressed.
+    text = CompressedTextField(column_type='TEXT NOT NULL', default='')
     is_completed = BooleanField(column_type='BOOLEAN NOT NULL')
     created_at = FloatField(default=time.time())
     update_at = FloatField()
-    
+    # Identity of the task across the synced databases, see `Sync`.
+    uid = TextField()
+    # 1 is the most urgent priority, 5 the least.
+    priority = IntegerField(column_type='INTEGER NOT NULL', default=3)
+    due_at = FloatField(default=None)
+    # The task which this task is a subtask of, None for a top-level task.
+    parent_id = IntegerField(default=None)
+    # The list of the task, see `TodoList`. The tasks which other programs
+    # insert without a list are in the default list.
+    list_id = IntegerField(column_type='INTEGER NOT NULL DEFAULT 0', default=0)
+
+    tags = ManyToMany(TodoTag, 'todo_id', 'tag_id', Tag)
+    subtasks = Tree('parent_id', rollup='is_completed')
+
+
+# The models of the todo database.
+MODELS = [Todo, TodoList, Tag, TodoTag, TodoSignature, Checkpoint]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import tempfile
+import threading
+import time
+
+# The time this module is imported, `todo` imports it first so the
+# imports of the other modules are measured from here.
+IMPORTED_AT = time.perf_counter()
+
+
+class Tracer(object):
+    """
+    Collector of nested timing spans of a `todo` invocation.
+
+    A span is recorded only when the tracer is enabled, otherwise `span()`
+    returns a shared no-op context manager, so the spans can stay in the
+    hot paths.
+
+    The spans are written as Chrome trace events, which chrome://tracing
+    and https://ui.perfetto.dev open, and summed up per name in a text
+    summary.
+
+    Example
+    -------
+    >>> TRACER.enable()
+    >>> with TRACER.span('query', sql='SELECT ...'):
+    ...     pass
+    >>> print(TRACER.summary())
+    """
+    NULL_SPAN = nullcontext()
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.depth = 0
+        self.origin = IMPORTED_AT
+
+    def enable(self):
+        """
+        Start recording the spans.
+        """
+        self.enabled = True
+
+    def span(self, name, **args):
+        """
+        A context manager which records the block as a span.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase.
+        args : dict
+            Details of the span, shown by the trace viewers.
+        """
+        if not self.enabled:
+            return self.NULL_SPAN
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name, args):
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            self.add(name, start, time.perf_counter(), self.depth, args)
+
+    def add(self, name, start, end, depth=0, args=None):
+        """
+        Record a span of `time.perf_counter()` start and end times.
+        """
+        if self.enabled:
+            self.events.append((name, start, end, depth, args or {}))
+
+    def chrome_trace(self):
+        """
+        The spans as a Chrome trace-event JSON object.
+        """
+        pid = os.getpid()
+        tid = threading.get_ident()
+        return {
+            'traceEvents': [{
+                'name': name,
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6, 1),
+                'dur': round((end - start) * 1e6, 1),
+                'pid': pid,
+                'tid': tid,
+                'args': {k: str(v) for k, v in args.items()},
+            } for name, start, end, _, args in sorted(self.events, key=lambda e: e[1])],
+            'displayTimeUnit': 'ms',
+        }
+
+    def summary(self):
+        """
+        Text summary of the spans: the calls, the total and the self time
+        of every name, the time of the nested spans is not in the self time.
+        """
+        events = sorted(self.events, key=lambda e: (e[1], e[3]))
+        children = [0.0] * len(events)
+        parents = []
+        for i, (_, start, end, depth, _) in enumerate(events):
+            while parents and events[parents[-1]][2] <= start:
+                parents.pop()
+            if parents and events[parents[-1]][3] == depth - 1:
+                children[parents[-1]] += end - start
+            parents.append(i)
+        totals = OrderedDict()
+        for i, (name, start, end, _, _) in enumerate(events):
+            calls, total, own = totals.get(name, (0, 0.0, 0.0))
+            totals[name] = (calls + 1, total + end - start, own + end - start - children[i])
+        lines = ['{:<20} {:>6} {:>10} {:>10}'.format('span', 'calls', 'total ms', 'self ms')]
+        for name, (calls, total, own) in sorted(
+                totals.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<20} {:>6} {:>10.2f} {:>10.2f}'.format(
+                name, calls, total * 1000, own * 1000))
+        return '\n'.join(lines)
+
+    def write(self, path=None):
+        """
+        Write the Chrome trace JSON file.
+
+        Parameters
+        ----------
+        path : str or None
+            The path of the file, `todo-trace-<pid>.json` in the temporary
+            directory if None.
+
+        Returns
+        -------
+        path : str
+            The path of the written file.
+        """
+        if path is None:
+            path = os.path.join(
+                tempfile.gettempdir(), 'todo-trace-{}.json'.format(os.getpid()))
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+
+# The tracer of the process.
+TRACER = Tracer()
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
+import re
 import sqlite3
 import time
+from contextlib import contextmanager
 from datetime import datetime
+from urllib.parse import unquote, urlsplit
+from .trace import TRACER
 
 
 class RecordIsNotFoundError(Exception):
@@ -10,6 +15,13 @@ class RecordIsNotFoundError(Exception):
     """
     pass
 
+
+class DuplicateRecordError(Exception):
+    """
+    Record is similar to a stored record.
+    """
+    pass
+
 class Singleton(type):
     """
     Singleton metaclass
@@ -28,32 +40,35 @@ class Singleton(type):
             cls._instance[cls.__name__] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instance[cls.__name__]
 
-class SQLConnection(object, metaclass=Singleton):
+class Connection(object):
     """
-    A connection of the sqlite3.
+    A connection of the sqlite3 to a database file.
     """
-    PATH = None 
 
-    def __init__(self):
+    def __init__(self, path, read_only=False, immutable=False, **kwargs):
         """
-        Initialize SQLConnection instance.
-        """
-        self.conn = sqlite3.connect(self.PATH if self.PATH else 'file:/tmp/data.db', uri=True)
-
-    @classmethod
-    def initialize(cls, path_to_file=None):
-        """
-        Initialize SQLConnection class instance.
+        Initialize Connection instance.
 
         Parameters
         ----------
-        data_file: str
-            A path to data file.
+        path : str
+            A URI of the database file, e.g. 'file:/tmp/data.db'.
+        read_only : bool
+            Open the file with ``mode=ro``, see `read_only_uri()`.
+        immutable : bool
+            Open a read-only file with ``immutable=1`` too.
+        kwargs : dict
+            Extra arguments of `sqlite3.connect`.
         """
-        if cls._instance:
-            cls._instance = dict()
-        cls.PATH = path_to_file
-
+        if read_only:
+            path = read_only_uri(path, immutable)
+        elif immutable:
+            raise ValueError('An immutable database file can only be read.')
+        with TRACER.span('connect', path=path):
+            self.conn = sqlite3.connect(path, uri=True, **kwargs)
+        self.depth = 0
+        # A read-only connection has nothing to commit.
+        self.read_only = read_only
 
     def execute(self, sql, args=(), autocommit=True):
         """
@@ -73,12 +88,143 @@ class SQLConnection(object, metaclass=Singleton):
         cursor : sqlite3.Cursor
             An `cursor` object of sqlite3 connection.
         """
-        cursor = self.conn.cursor()
-        cursor = cursor.execute(sql, args)
-        if autocommit:
-            self.conn.commit()
+        with TRACER.span('execute', sql=sql):
+            cursor = self.conn.cursor()
+            cursor = cursor.execute(sql, args)
+            if autocommit and not self.depth and not self.read_only:
+                self.conn.commit()
+        return cursor
+
+    def executemany(self, sql, rows, autocommit=True):
+        """
+        Prepare a database query once and execute it with every row of
+        parameters.
+
+        Parameters
+        ----------
+        sql : str
+            A SQL query
+        rows : iterable
+            The query parameters of every execution.
+        autocommit : bool
+            Determine whether need commit DB
+
+        Returns
+        -------
+        cursor : sqlite3.Cursor
+            An `cursor` object of sqlite3 connection, its `rowcount` is
+            the sum of the changed rows.
+        """
+        with TRACER.span('executemany', sql=sql):
+            cursor = self.conn.cursor()
+            cursor = cursor.executemany(sql, rows)
+            if autocommit and not self.depth and not self.read_only:
+                self.conn.commit()
         return cursor
 
+    @contextmanager
+    def transaction(self):
+        """
+        Execute every statement of the block in a single transaction.
+
+        The statements executed inside the block are not committed one by
+        one, the whole block is committed when it exits or rolled back when
+        it raises. Nested blocks join the outermost transaction.
+
+        Example
+        -------
+        >>> with SQLConnection().transaction():
+        ...     SQLConnection().execute('DELETE FROM Todo')
+        """
+        if not self.depth:
+            self.execute('BEGIN IMMEDIATE', autocommit=False)
+        self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.depth -= 1
+            if not self.depth:
+                self.conn.rollback()
+            raise
+        else:
+            self.depth -= 1
+            if not self.depth:
+                self.conn.commit()
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        self.conn.close()
+
+
+class SQLConnection(Connection, metaclass=Singleton):
+    """
+    A connection of the sqlite3.
+    """
+    PATH = None 
+    DEFAULT_PATH = 'file:/tmp/data.db'
+    READ_ONLY = False
+    IMMUTABLE = False
+
+    def __init__(self):
+        """
+        Initialize SQLConnection instance.
+        """
+        super(SQLConnection, self).__init__(
+            self.PATH if self.PATH else self.DEFAULT_PATH, self.READ_ONLY, self.IMMUTABLE)
+
+    @classmethod
+    def initialize(cls, path_to_file=None, read_only=False, immutable=False):
+        """
+        Initialize SQLConnection class instance.
+
+        Parameters
+        ----------
+        data_file: str
+            A path to data file.
+        read_only : bool
+            Open the file read-only.
+        immutable : bool
+            Open the read-only file as immutable.
+        """
+        if cls._instance:
+            cls._instance = dict()
+        cls.PATH = path_to_file
+        cls.READ_ONLY = read_only
+        cls.IMMUTABLE = immutable
+
+
+def read_only_uri(path, immutable=False):
+    """
+    URI which opens a database file read-only
+
+    Parameters
+    ----------
+    path : str
+        A path or a URI of the database file.
+    immutable : bool
+        Whether the file can not change while it is open, e.g. a snapshot
+        or an archive on a read-only mount. SQLite then reads it without
+        any lock and ignores its write-ahead log, so it is only for files
+        which no program writes. A file whose `-wal` file exists may have
+        its latest commits only there, it raises ValueError.
+
+    Returns
+    -------
+    uri : str
+        The URI with ``mode=ro`` and ``immutable=1`` parameters.
+    """
+    if not path.startswith('file:'):
+        path = 'file:' + path
+    if immutable and os.path.exists(unquote(urlsplit(path).path) + '-wal'):
+        raise ValueError(
+            'The write-ahead log of {} holds commits which an immutable read would miss, '
+            'read it without --immutable.'.format(path))
+    params = ['mode=ro'] + (['immutable=1'] if immutable else [])
+    return path + ('&' if '?' in path else '?') + '&'.join(params)
+
+
 def convert_time_to_message(epoch_time):
     """
     Convert time to message
@@ -104,3 +250,72 @@ def convert_time_to_message(epoch_time):
         return '%s days ago' % (delta // 86400)
     dt = datetime.fromtimestamp(epoch_time)
     return '%s year %s month %s day ago' % (dt.year, dt.month, dt.day)
+
+
+def parse_time(text):
+    """
+    Parse a local date or date and time
+
+    Parameters
+    ----------
+    text : str
+        'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'
+
+    Returns
+    -------
+    epoch_time : float
+        Float point number of epoch time
+    """
+    for time_format in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, time_format).timestamp()
+        except ValueError:
+            pass
+    raise ValueError('{!r} is not a YYYY-MM-DD [HH:MM] time.'.format(text))
+
+
+def positive_int(text):
+    """
+    Parse a count of records to show, 0 would mean no limit to a query.
+
+    Parameters
+    ----------
+    text : str
+        A positive integer.
+
+    Returns
+    -------
+    number : int
+        The number.
+    """
+    number = int(text)
+    if number < 1:
+        raise ValueError('{!r} is not a positive integer.'.format(text))
+    return number
+
+
+def parse_list_name(text):
+    """
+    Check the name of a list, it names the completion cache file of the
+    list too.
+
+    Parameters
+    ----------
+    text : str
+        Letters, digits, '_' and '-'.
+
+    Returns
+    -------
+    name : str
+        The name.
+    """
+    if not re.fullmatch(r'[\w-]+', text):
+        raise ValueError('{!r} is not a list name of letters, digits, _ and -.'.format(text))
+    return text
+
+
+def format_time(epoch_time):
+    """
+    Format an epoch time as a local 'YYYY-MM-DD HH:MM' time.
+    """
+    return datetime.fromtimestamp(epoch_time).strftime('%Y-%m-%d %H:%M')